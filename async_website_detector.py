@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+违法网站异步检测引擎
+基于asyncio的检测实现，可在单个事件循环中同时检测数千个网站
+
+与 batch_website_detector 中的线程模型相比：
+1. HTTP、DNS、TLS及子页面请求均为异步IO，不再为每个网站占用一个线程
+2. WHOIS查询（无异步实现）放入阻塞调用线程池执行
+3. HTML解析、关键词匹配等CPU密集型工作放入独立线程池，避免阻塞事件循环
+4. 特征计算复用 WebsiteDetector 的实现，特征字典与风险评分与同步版本一致
+5. 与多线程引擎共享主机并发/速率限制与退避（HOST_LIMITER）、DNS缓存（含NXDOMAIN负缓存）、
+   同一URL与同一主机证书的并发合并、主机级特征共享、阶段指标（METRICS）与分段计时（TRACER）；
+   批量检测同样按主机交错调度（HostScheduler），同一主机同时检测的URL不超过per_host_detections个
+6. AsyncBatchDetector继承BatchDetector，结果输出端、keep_results、微批次评分与报告与多线程版本一致
+
+命令行使用：python batch_website_detector.py --engine async
+"""
+
+import asyncio
+import contextvars
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import aiohttp
+
+from batch_website_detector import (
+    CONFIG, HOST_LIMITER, METRICS, TRACER, BatchDetector, HostFeatureCache, HostScheduler,
+    PageFetch, WebsiteDetector, _certificate_flight, _detection_flight, color_printer, get_dns_cache, logger
+)
+
+
+class AsyncWebsiteDetector:
+    """WebsiteDetector的异步版本，需在 `async with` 中使用"""
+
+    def __init__(self, detector=None, max_connections=1000, cpu_workers=4, blocking_workers=64):
+        self.detector = detector or WebsiteDetector()
+        self.max_connections = max_connections
+        self._cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix='detector-cpu')
+        self._blocking_executor = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix='detector-io')
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=CONFIG.get('per_host_concurrency', 4),
+            ttl_dns_cache=300
+        )
+        self._session = aiohttp.ClientSession(headers=self.detector.headers, connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._cpu_executor.shutdown(wait=False, cancel_futures=True)
+        self._blocking_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run_cpu(self, func, *args):
+        """在CPU线程池中执行解析与特征计算（继承当前span，内层阶段计入本次检测）"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._cpu_executor, context.run, func, *args)
+
+    async def _run_blocking(self, func, *args):
+        """在阻塞调用线程池中执行没有异步实现的IO（如WHOIS）"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._blocking_executor, context.run, func, *args)
+
+    async def _fetch_page(self, url, timeout):
+        """异步请求页面，返回与同步版本相同的PageFetch"""
+        start_time = time.time()
+        try:
+            async with self._session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                content = await response.read()
+                return PageFetch(
+                    url,
+                    content=content,
+                    status_code=response.status,
+                    headers=response.headers,
+                    final_url=str(response.url),
+                    history=[str(r.url) for r in response.history],
+                    elapsed=round(time.time() - start_time, 2)
+                )
+        except Exception as e:
+            return PageFetch(url, error=e)
+
+    async def _get_peer_certificate(self, host):
+        """获取服务器证书，失败时返回异常对象（同一主机的并发请求与多线程引擎共享一次连接）"""
+        try:
+            with METRICS.time_stage('tls'):
+                certificate, _ = await _certificate_flight.do_async(host, self._fetch_peer_certificate, host)
+            return certificate
+        except Exception as e:
+            return e
+
+    async def _fetch_peer_certificate(self, host):
+        context = ssl.create_default_context()
+        address = get_dns_cache().cached_ip(host) or host
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, 443, ssl=context, server_hostname=host), timeout=5
+        )
+        try:
+            return writer.get_extra_info('peercert')
+        finally:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), timeout=5)
+            except Exception:
+                # 证书已取得，关闭连接时的TLS关闭握手失败或超时不影响结果
+                pass
+
+    async def _resolve_dns(self, domain):
+        """并发查询A、MX、TXT记录（共享DnsCache的应答缓存、NXDOMAIN负缓存与并发查询合并），
+        返回格式与WebsiteDetector._resolve_dns一致"""
+        with METRICS.time_stage('dns'):
+            dns_records = await get_dns_cache().resolve_records_async(domain)
+        if isinstance(dns_records['A'], Exception):
+            METRICS.stage_error('dns')
+        return dns_records
+
+    async def extract_host_features(self, host):
+        """WebsiteDetector.extract_host_features的异步版本，返回 (域名特征, DNS特征)"""
+        detector = self.detector
+        with TRACER.span('host_features'):
+            # WHOIS与DNS查询相互独立，同时进行
+            domain_features, dns_records = await asyncio.gather(
+                self._run_blocking(detector._extract_domain_features, f'http://{host}'),
+                self._resolve_dns(host)
+            )
+            dns_features = detector._extract_dns_features(host, dns_records)
+        return domain_features, dns_features
+
+    async def _fetch_main_page(self, url, host):
+        """请求主页面（遵守主机并发、速率限制与退避，等待名额不超过host_slot_timeout秒）"""
+        detector = self.detector
+        async with HOST_LIMITER.slot_async(host, timeout=detector.host_slot_timeout) as acquired:
+            if not acquired:
+                raise detector._host_busy_error(host)
+            with METRICS.time_stage('fetch'):
+                page = await self._fetch_page(url, detector.timeout)
+            HOST_LIMITER.report_page(host, page)
+        if page.error:
+            METRICS.stage_error('fetch')
+        return page
+
+    async def _extract_subpage_features(self, url, page, matcher):
+        """异步并发检测子页面，同时进行的不超过subpage_workers个，整站不超过subpage_budget秒"""
+        detector = self.detector
+        features = detector._empty_subpage_features()
+        try:
+            if page.error:
+                raise page.error
+            internal_links = await self._run_cpu(detector._collect_internal_links, url, page)
+            if not internal_links:
+                return features
+
+            deadline = time.time() + detector.subpage_budget
+            workers = asyncio.Semaphore(detector.subpage_workers)
+
+            async def scan(subpage_url):
+                async with workers:
+                    # 预算用尽后不再开始新的子页面
+                    if deadline - time.time() <= 0:
+                        return None
+                    host = urlparse(subpage_url).netloc
+                    async with HOST_LIMITER.slot_async(host, timeout=deadline - time.time()) as acquired:
+                        remaining = deadline - time.time()
+                        if not acquired or remaining <= 0:
+                            return None
+                        subpage = await self._fetch_page(subpage_url, min(detector.subpage_timeout, remaining))
+                        HOST_LIMITER.report_page(host, subpage)
+                    if subpage.error:
+                        raise subpage.error
+                    return await self._run_cpu(detector._analyze_subpage, subpage_url, subpage, matcher)
+
+            tasks = [asyncio.ensure_future(scan(subpage_url)) for subpage_url in internal_links]
+            await asyncio.wait(tasks, timeout=max(0, deadline - time.time()))
+
+            subpage_results = []
+            for subpage_url, task in zip(internal_links, tasks):
+                if not task.done():
+                    # 超出时间预算，取消并丢弃结果
+                    task.cancel()
+                    subpage_results.append((subpage_url, None))
+                elif task.exception() is not None:
+                    subpage_results.append((subpage_url, task.exception()))
+                else:
+                    subpage_results.append((subpage_url, task.result()))
+            detector._merge_subpage_results(features, url, subpage_results)
+        except Exception as e:
+            logger.error(f"子页面特征提取失败 {url}: {e}")
+        return features
+
+    async def extract_all_features(self, url, host_features=None):
+        """提取所有特征（包含子页面特征），结果与WebsiteDetector.extract_all_features一致
+
+        同一URL的并发检测（包括多线程引擎中正在进行的检测）只执行一次并共享结果；
+        host_features为extract_host_features的结果，为None时在此计算
+        """
+        features, _ = await _detection_flight.do_async(url, self._extract_all_features, url, host_features)
+        return dict(features)
+
+    async def _extract_all_features(self, url, host_features=None):
+        with TRACER.span('detect', url=url) as span:
+            features = await self._collect_features(url, host_features)
+        if span is not None and TRACER.attach_to_results:
+            # 各阶段耗时随特征一起保存在检测结果中
+            features['stage_timings'] = span.timings()
+        return features
+
+    async def _collect_features(self, url, host_features=None):
+        detector = self.detector
+        host = urlparse(url).netloc
+        # 整个检测过程使用同一份关键词快照
+        matcher = detector.keyword_matcher
+
+        # TLS证书、主页面请求与（未传入时的）主机级特征相互独立，同时进行
+        steps = [self._get_peer_certificate(host), self._fetch_main_page(url, host)]
+        if host_features is None:
+            steps.append(self.extract_host_features(host))
+        certificate, page, *computed = await asyncio.gather(*steps)
+        domain_features, dns_features = computed[0] if computed else host_features
+
+        content_features = await self._run_cpu(detector._extract_content_features, url, page, certificate, matcher)
+        http_features = detector._extract_http_features(url, page)
+        with METRICS.time_stage('subpages'):
+            subpage_features = await self._extract_subpage_features(url, page, matcher)
+
+        features = {'url': url}
+        features.update(domain_features)
+        features.update(content_features)
+        features.update(dns_features)
+        features.update(http_features)
+        features.update(subpage_features)
+        return features
+
+
+class AsyncBatchDetector(BatchDetector):
+    """基于asyncio的批量检测器，单个事件循环内保持max_concurrency个网站同时检测
+
+    结果统计、输出端、keep_results、风险评分微批次与报告沿用BatchDetector
+    """
+
+    def __init__(self, max_concurrency=None, keep_results=None, detector=None):
+        super().__init__(keep_results=keep_results, detector=detector)
+        self.max_concurrency = max_concurrency or CONFIG.get('async_concurrency', 1000)
+
+    async def _extract_features_async(self, engine, url, host_cache):
+        """_extract_features的异步版本，返回 (URL, 特征, 异常)；主机繁忙时返回HostBusyError，由调度重新排队"""
+        try:
+            color_printer.print(f"🚀 开始检测 {url} ", 'cyan', bold=True)
+            if not url.startswith(('http://', 'https://')):
+                url = 'http://' + url
+            host_features = await host_cache.get_async(urlparse(url).netloc)
+            return url, await engine.extract_all_features(url, host_features), None
+        except Exception as e:
+            return url, None, e
+
+    async def detect_batch_async(self, urls, sinks=()):
+        """批量检测，每个结果评分后立即写入sinks中的各输出端（输出端由调用方关闭）
+
+        urls可以是任意可迭代对象，同时检测的网站不超过max_concurrency个；
+        与BatchDetector.detect_batch相同，URL按主机交错调度（HostScheduler），
+        同一主机同时检测的URL不超过per_host_detections个，主机繁忙的URL重新排队
+        """
+        self.results = []
+        self.risk_counts = {}
+        total = len(urls) if hasattr(urls, '__len__') else None
+        if total is None:
+            logger.info("🚀 开始异步批量检测（流式输入）")
+        else:
+            logger.info(f"🚀 开始异步批量检测，共 {total} 个网站")
+
+        scheduler = HostScheduler(urls, self.max_detections_per_host, self.schedule_lookahead, HOST_LIMITER)
+        extracted = []
+        busy_retries = {}  # URL -> 因主机繁忙重新排队的次数
+        pending = {}  # 检测任务 -> 主机
+
+        try:
+            async with AsyncWebsiteDetector(self.detector, max_connections=self.max_concurrency) as engine:
+                host_cache = HostFeatureCache(engine.extract_host_features)
+                last_scored = time.time()
+                while True:
+                    # 补足并发窗口，只在有空位时才从输入中读取URL
+                    while len(pending) < self.max_concurrency:
+                        scheduled = scheduler.next()
+                        if scheduled is None:
+                            break
+                        url, host = scheduled
+                        pending[asyncio.ensure_future(self._extract_features_async(engine, url, host_cache))] = host
+                    if not pending:
+                        break
+
+                    done, _ = await asyncio.wait(
+                        pending, timeout=self.score_batch_interval, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        host = pending.pop(task)
+                        if self._finish_scheduled(task.result(), host, scheduler, host_cache, busy_retries):
+                            extracted.append(task.result())
+
+                    # 凑满一批、等待超时或全部完成时评分；评分与写入输出端（可能阻塞在文件或数据库IO上）放入线程池，
+                    # 期间其余检测继续进行
+                    if (len(extracted) >= self.score_batch_size or (scheduler.empty and not pending)
+                            or time.time() - last_scored >= self.score_batch_interval):
+                        batch = extracted[:]
+                        extracted.clear()
+                        await engine._run_blocking(self._score_and_flush, batch, sinks, total)
+                        last_scored = time.time()
+                if extracted:
+                    await engine._run_blocking(self._score_and_flush, extracted[:], sinks, total)
+        finally:
+            for task in pending:
+                task.cancel()
+            # 中途出错时已完成的结果也写出
+            for sink in sinks:
+                sink.flush()
+
+        self._log_batch_summary(host_cache)
+        return self.results
+
+    def _score_and_flush(self, extracted, sinks, total):
+        if extracted:
+            self._score_and_record(extracted, sinks, total)
+        for sink in sinks:
+            sink.flush_if_due()
+
+    def detect_batch(self, urls, sinks=()):
+        """同步入口：在新的事件循环中执行批量检测"""
+        return asyncio.run(self.detect_batch_async(urls, sinks))
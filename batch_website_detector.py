@@ -13,6 +13,8 @@
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
 import re
 import socket
 import ssl
@@ -23,18 +25,39 @@ import csv
 import os
 import time
 import hashlib
+import bisect
+import heapq
+import ipaddress
+import struct
+import operator
+import itertools
+import uuid
+import random
+import sys
+import asyncio
+import contextvars
 from urllib.parse import urlparse, urljoin
 from bs4 import BeautifulSoup
 import dns.resolver
+import dns.asyncresolver
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 import joblib
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
 import warnings
 import pymysql 
 import signal
+import sqlite3
+import threading
+import queue
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from collections.abc import Mapping
+from array import array
+import math
+import functools
 warnings.filterwarnings('ignore')
 # 读取配置文件
 def load_config(config_path='config.json'):
@@ -51,7 +74,45 @@ def load_config(config_path='config.json'):
         'max_workers': 10,
         'timeout': 10,
         'max_subpages': 50,
-        'cache_ttl': 3600
+        'cache_ttl': 3600,
+        'subpage_workers': 8,
+        'subpage_budget': 30,
+        'subpage_pool_size': 64,
+        'per_host_concurrency': 4,
+        'whois_cache_path': 'whois_cache.db',
+        'whois_cache_ttl': 604800,
+        'whois_failure_ttl': 600,
+        'dns_cache_size': 100000,
+        'dns_negative_ttl': 300,
+        'db_pool_size': 8,
+        'db_batch_size': 500,
+        'blacklist_update_interval': 86400,
+        'blacklist_sync_column': 'id',
+        'blacklist_snapshot': True,
+        'brands_file': '',
+        'score_batch_size': 64,
+        'score_batch_interval': 1.0,
+        'sink_buffer_size': 100,
+        'sink_flush_interval': 5.0,
+        'keep_results': True,
+        'max_in_flight': 0,
+        'job_db_path': 'detection_jobs.db',
+        'api_workers': 32,
+        'api_request_concurrency': 8,
+        'result_cache_size': 10000,
+        'result_cache_max_bytes': 268435456,
+        'result_cache_ttl': 3600,
+        'result_cache_failure_ttl': 60,
+        'per_ip_concurrency': 8,
+        'per_host_rate': 10,
+        'host_backoff_base': 1.0,
+        'host_backoff_max': 60.0,
+        'per_host_detections': 2,
+        'schedule_lookahead': 1000,
+        'host_slot_timeout': 10,
+        'host_busy_retries': 3,
+        'async_concurrency': 1000,
+        'attach_timings': False
     }
     
     if os.path.exists(config_path):
@@ -65,6 +126,9 @@ def load_config(config_path='config.json'):
 # 数据库配置
 CONFIG = load_config()
 DB_CONFIG = CONFIG['db_config']
+
+# 默认定时检测间隔（秒）
+DEFAULT_INTERVAL = 10
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -96,72 +160,957 @@ def extract_domain_from_url(url):
     domain = url.split('/')[0].split('?')[0].split(':')[0]
     return domain
 
-def update_blacklist_from_db():
-    """从数据库更新黑名单文件"""
+def get_registered_domain(host):
+    """提取注册域名（eTLD+1），如 www.example.com.cn -> example.com.cn，IP地址原样返回"""
+    host = host.split(':')[0].strip('.').lower()
+    if not host or is_ip_address(host):
+        return host
     try:
-        # 连接数据库
-        connection = pymysql.connect(**DB_CONFIG)
-        
-        # 创建游标
-        with connection.cursor() as cursor:
-            # 执行SQL查询
-            sql = "SELECT site_url, rel_url FROM gat_violat_chap;"
+        # python-whois自带公共后缀列表
+        return whois.extract_domain(host)
+    except Exception:
+        return host
+
+
+# WHOIS缓存中保存的字段
+WHOIS_FIELDS = ('creation_date', 'expiration_date', 'registrar')
+
+
+def _encode_whois_value(value):
+    """将WHOIS字段转换为可JSON序列化的值"""
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_whois_value(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _decode_whois_value(value):
+    """_encode_whois_value的逆过程"""
+    if isinstance(value, dict) and '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    if isinstance(value, list):
+        return [_decode_whois_value(v) for v in value]
+    return value
+
+
+def query_whois(domain):
+    """执行WHOIS查询，只保留特征计算需要的字段"""
+    domain_info = whois.whois(domain)
+    return {field: domain_info.get(field) for field in WHOIS_FIELDS}
+
+
+class SingleFlight:
+    """合并同一键的并发调用
+
+    同一时刻同一键只执行一次，其余调用方等待并共享该次调用的结果（或异常）；
+    调用结束后即移除，不做缓存。do()返回 (结果, 是否共享了其他调用方的结果)。
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """do()的协程版本：func返回awaitable，等待时不阻塞事件循环；与do()的调用方共享同一组进行中的调用"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'inflight': len(self._inflight)}
+
+
+class Span:
+    """一个阶段的计时记录
+
+    name为阶段名，start为开始时间（时间戳），duration为耗时（秒），error为阶段内抛出的异常类型名，
+    parent为同一线程（或协程）内外层的span，children为已结束的内层span。
+    """
+
+    __slots__ = ('name', 'start', 'duration', 'attributes', 'error', 'parent', 'children', '_started')
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.children = []
+        self.error = None
+        self.duration = None
+        self.start = time.time()
+        self._started = time.perf_counter()
+
+    @property
+    def path(self):
+        """从最外层span到本span的阶段名，以/分隔"""
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return '/'.join(reversed(names))
+
+    def timings(self):
+        """返回内层各阶段的耗时 {相对路径: 秒}，同一路径出现多次时累加"""
+        timings = {}
+        pending = [(child, child.name) for child in reversed(self.children)]
+        while pending:
+            span, path = pending.pop()
+            timings[path] = round(timings.get(path, 0.0) + span.duration, 4)
+            pending.extend((child, f'{path}/{child.name}') for child in reversed(span.children))
+        return timings
+
+
+class _SpanContext:
+    __slots__ = ('tracer', 'name', 'attributes', 'span', 'token')
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        current = self.tracer._current
+        self.span = Span(self.name, self.attributes, current.get())
+        self.token = current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.duration = time.perf_counter() - span._started
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        self.tracer._current.reset(self.token)
+        if span.parent is not None:
+            span.parent.children.append(span)
+        self.tracer._finish(span)
+        return False
+
+
+_NO_SPAN = nullcontext()
+
+
+class SpanTracer:
+    """检测各阶段及其子步骤的分段计时
+
+    没有注册钩子且不附加到检测结果时span()返回空上下文，不做任何计时。
+    启用后同一线程（或asyncio任务）内嵌套的span构成父子关系，每个span结束时依次调用钩子hook(span)，
+    可将span转发到自有的追踪系统；钩子在结束span的线程中调用，抛出的异常只记录日志。
+    """
+
+    def __init__(self, attach_to_results=False):
+        self.attach_to_results = attach_to_results
+        self._hooks = ()
+        # 当前span按上下文保存：各线程互不影响，asyncio任务继承创建时的外层span
+        self._current = contextvars.ContextVar('current_span', default=None)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self._hooks) or self.attach_to_results
+
+    def add_hook(self, hook):
+        with self._lock:
+            self._hooks = self._hooks + (hook,)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = tuple(h for h in self._hooks if h != hook)
+
+    def span(self, name, **attributes):
+        """返回计时上下文，`with tracer.span('dns') as span:` 未启用时span为None"""
+        if not self._hooks and not self.attach_to_results:
+            return _NO_SPAN
+        return _SpanContext(self, name, attributes)
+
+    def traced(self, name):
+        """span()的装饰器形式"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self._hooks and not self.attach_to_results:
+                    return func(*args, **kwargs)
+                with _SpanContext(self, name, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish(self, span):
+        for hook in self._hooks:
+            try:
+                hook(span)
+            except Exception as e:
+                logger.warning(f"span钩子执行失败 {span.name}: {e}")
+
+
+class SpanStats:
+    """按span路径汇总耗时的钩子，用于输出各阶段耗时分位数表
+
+    每个路径保留次数、总耗时与最大值，另以蓄水池抽样保留至多max_samples个耗时计算分位数
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._stats = {}  # 路径 -> [次数, 总耗时, 最大值, 出错次数, 抽样]
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        path = span.path
+        with self._lock:
+            stats = self._stats.get(path)
+            if stats is None:
+                stats = self._stats[path] = [0, 0.0, 0.0, 0, array('d')]
+            stats[0] += 1
+            stats[1] += span.duration
+            stats[2] = max(stats[2], span.duration)
+            if span.error:
+                stats[3] += 1
+            samples = stats[4]
+            if len(samples) < self.max_samples:
+                samples.append(span.duration)
+            else:
+                index = random.randrange(stats[0])
+                if index < self.max_samples:
+                    samples[index] = span.duration
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        """返回 {路径: {'count', 'errors', 'mean', 'p50', 'p90', 'p99', 'max'}}，按路径排序"""
+        with self._lock:
+            items = [(path, stats[:4] + [np.array(stats[4])]) for path, stats in self._stats.items()]
+        summary = {}
+        for path, (count, total, maximum, errors, samples) in sorted(items):
+            row = {'count': count, 'errors': errors, 'mean': total / count}
+            for percentile, value in zip(self.PERCENTILES, np.percentile(samples, self.PERCENTILES)):
+                row[f'p{percentile}'] = float(value)
+            row['max'] = maximum
+            summary[path] = row
+        return summary
+
+    def format_table(self):
+        """生成各阶段耗时分位数表（毫秒），内层阶段按层级缩进"""
+        summary = self.summary()
+        if not summary:
+            return '没有阶段耗时记录'
+        columns = ('count', 'errors', 'mean') + tuple(f'p{p}' for p in self.PERCENTILES) + ('max',)
+        names = {path: '  ' * path.count('/') + path.rsplit('/', 1)[-1] for path in summary}
+        width = max(len('阶段'), max(len(name) for name in names.values()))
+        lines = [f"{'阶段':<{width}}" + ''.join(f'{column:>10}' for column in columns)]
+        for path, row in summary.items():
+            cells = [f"{row['count']:>10}", f"{row['errors']:>10}"]
+            cells += [f'{row[column] * 1000:>10.1f}' for column in columns[2:]]
+            lines.append(f'{names[path]:<{width}}' + ''.join(cells))
+        return '\n'.join(lines)
+
+
+# 进程内共享的分段计时（--timings与attach_timings配置，或注册自定义钩子时启用）
+TRACER = SpanTracer(attach_to_results=CONFIG.get('attach_timings', False))
+
+
+# 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_metric_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_metric_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class MetricsRegistry:
+    """进程内指标（计数器与耗时直方图），按Prometheus文本格式输出
+
+    计数器与直方图由检测各阶段直接更新；缓存命中、线程池队列长度等已有统计通过register注册回调，
+    输出时才读取，回调返回数值或 [(标签字典, 数值)]，返回None或出错时跳过。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._meta = {}  # 指标名 -> (类型, 说明)
+        self._counters = {}  # (指标名, 标签) -> 数值
+        self._histograms = {}  # (指标名, 标签) -> [各桶计数（不累计，最后一个为+Inf）, 总和]
+        self._collectors = {}  # 指标名 -> [回调]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def describe(self, name, kind, help_text):
+        """声明指标类型（counter / gauge / histogram）与说明"""
+        self._meta[name] = (kind, help_text)
+
+    def register(self, name, kind, help_text, collect):
+        """注册输出时读取的回调指标，同一指标可注册多个回调（各自输出不同标签）"""
+        self.describe(name, kind, help_text)
+        self._collectors.setdefault(name, []).append(collect)
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = self._key(name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += value
+
+    def stage_error(self, stage):
+        """记录检测阶段出错一次"""
+        self.inc('detector_stage_errors_total', {'stage': stage})
+
+    @contextmanager
+    def time_stage(self, stage):
+        """统计检测阶段耗时，阶段内抛出异常时同时记录一次出错；阶段同时作为TRACER的span"""
+        start = time.perf_counter()
+        try:
+            with TRACER.span(stage):
+                yield
+        except Exception:
+            self.stage_error(stage)
+            raise
+        finally:
+            self.observe('detector_stage_seconds', time.perf_counter() - start, {'stage': stage})
+
+    def timed(self, stage):
+        """time_stage的装饰器形式"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time_stage(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def histogram_stats(self, name):
+        """返回 {标签: (次数, 总和)}"""
+        with self._lock:
+            return {labels: (sum(counts), total) for (metric, labels), (counts, total) in self._histograms.items()
+                    if metric == name}
+
+    def _collect(self, name):
+        collected = []
+        for collect in self._collectors[name]:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.warning(f"读取指标失败 {name}: {e}")
+                continue
+            if samples is None:
+                continue
+            if isinstance(samples, (int, float)):
+                collected.append(((), samples))
+            else:
+                collected.extend((tuple(sorted(labels.items())), value) for labels, value in samples)
+        return collected
+
+    def render(self):
+        """按Prometheus文本格式（0.0.4）输出全部指标"""
+        with self._lock:
+            samples = {}
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            histograms = {}
+            for (name, labels), (counts, total) in self._histograms.items():
+                histograms.setdefault(name, []).append((labels, list(counts), total))
+        for name in self._collectors:
+            samples.setdefault(name, []).extend(self._collect(name))
+
+        lines = []
+        for name in sorted(set(samples) | set(histograms)):
+            kind, help_text = self._meta.get(name, ('histogram' if name in histograms else 'counter', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(samples.get(name, ())):
+                lines.append(f'{name}{_format_metric_labels(labels)} {_format_metric_value(value)}')
+            for labels, counts, total in sorted(histograms.get(name, ())):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    le = (('le', _format_metric_value(float(bound))),)
+                    lines.append(f'{name}_bucket{_format_metric_labels(labels + le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_metric_labels(labels)} {_format_metric_value(total)}')
+                lines.append(f'{name}_count{_format_metric_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享的指标（API的 /api/metrics 与批量检测的 --metrics-file 输出）
+METRICS = MetricsRegistry()
+METRICS.describe('detector_stage_seconds', 'histogram', '检测各阶段耗时（秒）')
+METRICS.describe('detector_stage_errors_total', 'counter', '检测各阶段出错次数')
+
+
+class WhoisLookupError(Exception):
+    """WHOIS查询失败"""
+
+
+class WhoisCache:
+    """WHOIS查询结果缓存
+
+    以注册域名为键保存在SQLite中，程序重启后依然有效。
+    查询成功的结果缓存ttl秒；查询失败或未解析出任何字段的结果只缓存failure_ttl秒。
+    """
+
+    def __init__(self, path, ttl=604800, failure_ttl=600, query=query_whois):
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.query = query
+        self.hits = 0
+        self.misses = 0
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS whois_cache ("
+                "domain TEXT PRIMARY KEY, record TEXT, error TEXT, expires_at REAL NOT NULL)"
+            )
+            # 清理过期记录
+            self._conn.execute("DELETE FROM whois_cache WHERE expires_at < ?", (time.time(),))
+
+    def _get(self, domain):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record, error, expires_at FROM whois_cache WHERE domain = ?", (domain,)
+            ).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return row
+
+    def _put(self, domain, record, error, ttl):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "REPLACE INTO whois_cache (domain, record, error, expires_at) VALUES (?, ?, ?, ?)",
+                (domain, record, error, time.time() + ttl)
+            )
+
+    def lookup(self, domain):
+        """返回domain的WHOIS字段字典；查询失败（包括缓存中的失败记录）时抛出WhoisLookupError"""
+        row = self._get(domain)
+        if row is not None:
+            with self._lock:
+                self.hits += 1
+            record, error, _ = row
+            if error is not None:
+                raise WhoisLookupError(error)
+            return {field: _decode_whois_value(value) for field, value in json.loads(record).items()}
+
+        with self._lock:
+            self.misses += 1
+        # 同一域名的并发查询只发起一次
+        domain_info, _ = self._flight.do(domain, self._query, domain)
+        return dict(domain_info)
+
+    def _query(self, domain):
+        """执行WHOIS查询并写入缓存"""
+        try:
+            domain_info = self.query(domain)
+        except Exception as e:
+            self._put(domain, None, str(e), self.failure_ttl)
+            raise WhoisLookupError(str(e)) from e
+
+        # 网络异常时python-whois常返回空结果而不抛出异常，按失败结果的有效期缓存
+        ttl = self.ttl if any(domain_info.get(field) for field in WHOIS_FIELDS) else self.failure_ttl
+        record = json.dumps({field: _encode_whois_value(value) for field, value in domain_info.items()})
+        self._put(domain, record, None, ttl)
+        return domain_info
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM whois_cache").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'entries': entries
+            }
+
+
+_whois_cache = None
+_whois_cache_lock = threading.Lock()
+
+
+def get_whois_cache():
+    """获取进程内共享的WHOIS缓存"""
+    global _whois_cache
+    with _whois_cache_lock:
+        if _whois_cache is None:
+            cache_path = CONFIG.get('whois_cache_path', 'whois_cache.db')
+            if not os.path.isabs(cache_path):
+                cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), cache_path)
+            _whois_cache = WhoisCache(
+                cache_path,
+                ttl=CONFIG.get('whois_cache_ttl', 604800),
+                failure_ttl=CONFIG.get('whois_failure_ttl', 600)
+            )
+        return _whois_cache
+
+
+class MySQLConnectionPool:
+    """线程安全的MySQL连接池
+
+    连接按后进先出复用，取出时ping检测并自动重连；同时借出的连接数不超过max_size
+    """
+
+    def __init__(self, db_config, max_size=8):
+        self.db_config = db_config
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    return pymysql.connect(**self.db_config)
+                try:
+                    connection.ping(reconnect=True)
+                    return connection
+                except pymysql.MySQLError:
+                    # 连接已失效，丢弃后继续尝试下一个
+                    self._close_quietly(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, broken=False):
+        try:
+            if broken or not connection.open:
+                self._close_quietly(connection)
+            else:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，使用完毕后归还连接池"""
+        connection = self._acquire()
+        broken = False
+        try:
+            yield connection
+        except pymysql.OperationalError:
+            # 连接级错误，不再复用该连接
+            broken = True
+            raise
+        finally:
+            self._release(connection, broken)
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._close_quietly(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """获取进程内共享的数据库连接池"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = MySQLConnectionPool(DB_CONFIG, max_size=CONFIG.get('db_pool_size', 8))
+        return _db_pool
+
+
+def classify_blacklist_entry(value):
+    """将黑名单表中的一条记录归类，返回 ('ip', IP或CIDR网段)、('domain', 域名) 或 None
+
+    域名支持 *.example.com 形式的通配符（只匹配子域名）
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if is_ip_address(value):
+        return 'ip', value
+    if is_domain(value):
+        return 'domain', value
+    if value.startswith('*.') and is_domain(value[2:]):
+        return 'domain', value
+    # IPv6地址与CIDR网段
+    try:
+        network = ipaddress.ip_network(value, strict=False)
+        if network.num_addresses == 1:
+            return 'ip', str(network.network_address)
+        return 'ip', str(network)
+    except ValueError:
+        pass
+    # 尝试从URL中提取域名
+    extracted = extract_domain_from_url(value)
+    if is_ip_address(extracted):
+        return 'ip', extracted
+    if is_domain(extracted):
+        return 'domain', extracted
+    return None
+
+
+class DomainSuffixIndex:
+    """域名黑名单索引，支持上级域名匹配与通配符
+
+    example.com 匹配其自身及所有子域名（www.example.com、m.a.example.com）；
+    *.example.com 只匹配子域名。查询时从完整主机名开始逐级去掉最左侧标签，
+    每级一次哈希查找，耗时只与标签数有关，与黑名单规模无关。
+    """
+
+    def __init__(self, entries=()):
+        self._domains = set()  # 匹配自身及子域名的条目
+        self._wildcards = set()  # 只匹配子域名的条目（*.example.com）
+        self._parents = set()  # 上述两者的并集，用于上级域名查找
+        self.update(entries)
+
+    @staticmethod
+    def normalize(host):
+        """统一为小写、去掉端口与末尾的点"""
+        host = host.strip().lower()
+        if ':' in host:
+            host = host.split(':', 1)[0]
+        return host.rstrip('.')
+
+    def update(self, entries):
+        for entry in entries:
+            entry = self.normalize(entry)
+            if entry.startswith('*.'):
+                self._wildcards.add(entry[2:])
+                self._parents.add(entry[2:])
+            elif entry:
+                self._domains.add(entry)
+                self._parents.add(entry)
+
+    def match(self, host):
+        """主机名或其上级域名在黑名单中时返回True"""
+        host = host.lower()
+        if ':' in host:
+            host = host.split(':', 1)[0]
+        if host.endswith('.'):
+            host = host.rstrip('.')
+        if host in self._domains:
+            return True
+        parents = self._parents
+        index = host.find('.')
+        while index != -1:
+            if host[index + 1:] in parents:
+                return True
+            index = host.find('.', index + 1)
+        return False
+
+    def __len__(self):
+        return len(self._domains) + len(self._wildcards)
+
+
+# IPv4地址映射到IPv6的 ::ffff:0:0/96 段，使两种地址共用一个整数区间
+_IPV4_MAPPED_OFFSET = 0xFFFF00000000
+_unpack_ipv4 = struct.Struct('!I').unpack
+
+
+def _ip_to_int(ip):
+    """将IP地址转换为整数（IPv4映射到IPv6地址空间）"""
+    if ':' in ip:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    return _IPV4_MAPPED_OFFSET + _unpack_ipv4(socket.inet_aton(ip))[0]
+
+
+class IPRangeIndex:
+    """IP黑名单区间索引，支持单个IP与CIDR网段
+
+    所有条目转换为整数区间并合并重叠部分，按起点排序保存；查询时二分查找，
+    百万级条目也只需约20次比较。
+    """
+
+    def __init__(self, entries=()):
+        self._ranges = ([], [])  # (区间起点列表, 区间终点列表)，整体替换保证查询时一致
+        self.update(entries)
+
+    @staticmethod
+    def _to_range(entry):
+        if '/' not in entry and is_ip_address(entry):
+            # 单个IPv4地址（最常见）走快速路径
+            value = _ip_to_int(entry)
+            return value, value
+        network = ipaddress.ip_network(entry, strict=False)
+        start, end = int(network.network_address), int(network.broadcast_address)
+        if network.version == 4:
+            start += _IPV4_MAPPED_OFFSET
+            end += _IPV4_MAPPED_OFFSET
+        return start, end
+
+    def update(self, entries):
+        new_ranges = []
+        for entry in entries:
+            try:
+                new_ranges.append(self._to_range(entry))
+            except ValueError:
+                logger.debug(f"忽略无效的IP黑名单条目: {entry}")
+        if not new_ranges:
+            return
+        new_ranges.sort()
+
+        # 与现有区间归并，合并重叠或相邻的区间
+        starts, ends = [], []
+        current_starts, current_ends = self._ranges
+        for start, end in heapq.merge(zip(current_starts, current_ends), new_ranges):
+            if ends and start <= ends[-1] + 1:
+                if end > ends[-1]:
+                    ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._ranges = (starts, ends)
+
+    def match(self, ip):
+        """IP落在任一黑名单区间内时返回True"""
+        try:
+            value = _ip_to_int(ip)
+        except (OSError, ValueError):
+            return False
+        starts, ends = self._ranges
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def __len__(self):
+        return len(self._ranges[0])
+
+
+class BlacklistStore:
+    """进程内共享的黑名单（恶意IP与恶意域名）
+
+    以数据库中gat_violat_chap表为准，按水位字段（sync_column，如自增id或update_time）
+    增量同步：每次只查询水位之后新增或变更的记录并合并到内存集合中；每隔
+    full_sync_interval秒全量同步一次以清除已删除的记录。黑名单文件仅作为可选的
+    快照，用于数据库不可用时启动。
+    """
+
+    def __init__(self, ip_file, domain_file, sync_column='id', full_sync_interval=86400, write_snapshot=True):
+        self.ip_file = ip_file
+        self.domain_file = domain_file
+        self.sync_column = sync_column
+        self.full_sync_interval = full_sync_interval
+        self.write_snapshot = write_snapshot
+        self.ips = set()
+        self.domains = set()
+        self.ip_index = IPRangeIndex()
+        self.domain_index = DomainSuffixIndex()
+        self._high_water = None
+        self._last_full_sync = None
+        self._sync_lock = threading.Lock()
+        self.load_snapshot()
+
+    @staticmethod
+    def _read_lines(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def load_snapshot(self):
+        """从快照文件加载黑名单"""
+        try:
+            self._replace(self._read_lines(self.ip_file), self._read_lines(self.domain_file))
+        except Exception as e:
+            logger.warning(f"加载黑名单失败: {e}")
+
+    def _replace(self, ips, domains):
+        """用新的黑名单整体替换现有数据（先构建索引再替换）"""
+        ip_index, domain_index = IPRangeIndex(ips), DomainSuffixIndex(domains)
+        self.ips, self.domains = ips, domains
+        self.ip_index, self.domain_index = ip_index, domain_index
+
+    def match_domain(self, host):
+        """主机名或其上级域名是否在黑名单中"""
+        return self.domain_index.match(host)
+
+    def match_ip(self, ip):
+        """IP是否在黑名单（含CIDR网段）中"""
+        return self.ip_index.match(ip)
+
+    def _save_snapshot(self, ips, domains):
+        """写入快照文件（先写临时文件再替换，避免读到写了一半的文件）"""
+        for path, values in ((self.ip_file, ips), (self.domain_file, domains)):
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for value in sorted(values):
+                    f.write(f"{value}\n")
+            os.replace(temp_path, path)
+
+    def _fetch_rows(self, cursor, since):
+        column = self.sync_column
+        if since is None:
+            sql = f"SELECT `{column}` AS sync_mark, site_url, rel_url FROM gat_violat_chap"
             cursor.execute(sql)
-            results = cursor.fetchall()
-            
-            # 提取所有URL
-            all_urls = []
-            for row in results:
-                if row['site_url']:
-                    all_urls.append(row['site_url'])
-                if row['rel_url']:
-                    all_urls.append(row['rel_url'])
-            
-            # 去重
-            unique_urls = list(set(all_urls))
-            
-            # 分别存储IP和域名
-            ips = set()
-            domains = set()
-            
-            for url in unique_urls:
-                # 提取域名或IP
-                if is_ip_address(url):
-                    ips.add(url)
-                elif is_domain(url):
-                    domains.add(url)
-                else:
-                    # 尝试从URL中提取域名
-                    extracted = extract_domain_from_url(url)
-                    if is_ip_address(extracted):
-                        ips.add(extracted)
-                    elif is_domain(extracted):
-                        domains.add(extracted)
-            
-            # 获取当前目录
+        else:
+            # 使用>=：水位为时间戳时，同一时刻稍后提交的记录也不会漏掉（重复记录合并时自然去重）
+            sql = f"SELECT `{column}` AS sync_mark, site_url, rel_url FROM gat_violat_chap WHERE `{column}` >= %s"
+            cursor.execute(sql, (since,))
+        return cursor.fetchall()
+
+    def sync(self, force_full=False):
+        """从数据库同步黑名单，返回 (是否全量同步, 新增IP数, 新增域名数)"""
+        with self._sync_lock:
+            now = time.time()
+            full = (force_full or self._high_water is None or self._last_full_sync is None
+                    or now - self._last_full_sync >= self.full_sync_interval)
+            with get_db_pool().connection() as connection, connection.cursor() as cursor:
+                rows = self._fetch_rows(cursor, None if full else self._high_water)
+
+            ips, domains = set(), set()
+            high_water = None if full else self._high_water
+            for row in rows:
+                for value in (row['site_url'], row['rel_url']):
+                    entry = classify_blacklist_entry(value)
+                    if entry is None:
+                        continue
+                    (ips if entry[0] == 'ip' else domains).add(entry[1])
+                mark = row['sync_mark']
+                if mark is not None and (high_water is None or mark > high_water):
+                    high_water = mark
+
+            if full:
+                added_ips, added_domains = len(ips - self.ips), len(domains - self.domains)
+                # 全量结果整体替换
+                self._replace(ips, domains)
+                self._last_full_sync = now
+            else:
+                ips -= self.ips
+                domains -= self.domains
+                added_ips, added_domains = len(ips), len(domains)
+                # 增量结果直接合并到现有索引
+                self.ips.update(ips)
+                self.domains.update(domains)
+                self.ip_index.update(ips)
+                self.domain_index.update(domains)
+            self._high_water = high_water
+
+            if self.write_snapshot and (full or added_ips or added_domains):
+                try:
+                    self._save_snapshot(self.ips, self.domains)
+                except Exception as e:
+                    logger.warning(f"写入黑名单快照失败: {e}")
+            return full, added_ips, added_domains
+
+
+_blacklist_store = None
+_blacklist_store_lock = threading.Lock()
+
+
+def get_blacklist_store():
+    """获取进程内共享的黑名单"""
+    global _blacklist_store
+    with _blacklist_store_lock:
+        if _blacklist_store is None:
             current_dir = os.path.dirname(os.path.abspath(__file__))
-            
-            # 写入blacklist_ips.txt
-            ip_file = os.path.join(current_dir, 'blacklist_ips.txt')
-            with open(ip_file, 'w', encoding='utf-8') as f:
-                for ip in sorted(ips):
-                    f.write(f"{ip}\n")
-            
-            # 写入blacklist_domains.txt
-            domain_file = os.path.join(current_dir, 'blacklist_domains.txt')
-            with open(domain_file, 'w', encoding='utf-8') as f:
-                for domain in sorted(domains):
-                    f.write(f"{domain}\n")
-            
-            print(f"✅ 成功更新黑名单文件！")
-            print(f"   - 新增 {len(ips)} 个IP地址到 {ip_file}")
-            print(f"   - 新增 {len(domains)} 个域名到 {domain_file}")
+            _blacklist_store = BlacklistStore(
+                os.path.join(current_dir, 'blacklist_ips.txt'),
+                os.path.join(current_dir, 'blacklist_domains.txt'),
+                sync_column=CONFIG.get('blacklist_sync_column', 'id'),
+                full_sync_interval=CONFIG.get('blacklist_update_interval', 86400),
+                write_snapshot=CONFIG.get('blacklist_snapshot', True)
+            )
+        return _blacklist_store
+
+
+def update_blacklist_from_db():
+    """从数据库增量同步黑名单，成功时返回True"""
+    try:
+        store = get_blacklist_store()
+        full, added_ips, added_domains = store.sync()
+        
+        if full:
+            print(f"✅ 黑名单全量同步完成！")
+        elif added_ips or added_domains:
+            print(f"✅ 黑名单增量同步完成！")
+        if full or added_ips or added_domains:
+            print(f"   - 新增 {added_ips} 个IP地址，共 {len(store.ips)} 个")
+            print(f"   - 新增 {added_domains} 个域名，共 {len(store.domains)} 个")
+        return True
             
     except Exception as e:
         print(f"❌ 从数据库更新黑名单失败: {e}")
-    finally:
-        if 'connection' in locals() and connection.open:
-            connection.close()
+        return False
 # 彩色输出工具类
 class ColorPrinter:
     """彩色输出工具类"""
@@ -332,39 +1281,1125 @@ class ColorPrinter:
         if high_risk == 0 and medium_risk == 0:
             self.print("✅ 安全良好: 本次检测未发现明显风险网站", 'green', bold=True)
 
-# 创建全局彩色打印实例
-color_printer = ColorPrinter()
+# 创建全局彩色打印实例
+color_printer = ColorPrinter()
+
+# 修改原有的打印函数使用彩色输出
+def print_colored_detection_result(result):
+    """彩色打印检测结果"""
+    url = result.get('网址', '未知')
+    risk_level = result.get('风险等级', '未知')
+    risk_score = result.get('风险评分', '0%')
+    risk_desc = result.get('风险描述', '')
+    
+    color_printer.print_risk_level(risk_level, url, risk_score)
+    
+    if risk_desc:
+        lines = risk_desc.split('\n')
+        for line in lines:
+            if line.startswith('🚨') or line.startswith('⚠️'):
+                color_printer.print(f"   {line}", 'red' if '🚨' in line else 'yellow')
+            elif line.startswith('✅'):
+                color_printer.print(f"   {line}", 'green')
+            elif line.startswith('💡'):
+                color_printer.print(f"   {line}", 'blue')
+            elif line.startswith('•'):
+                color_printer.print(f"   {line}", 'white')
+    
+    print()  # 空行分隔
+
+
+def _dns_answer(dns_records, record_type):
+    """取出DNS查询结果，查询失败时抛出原异常"""
+    answer = dns_records.get(record_type)
+    if answer is None:
+        raise dns.resolver.NoAnswer()
+    if isinstance(answer, Exception):
+        raise answer
+    return answer
+
+
+class DnsCache:
+    """共享DNS解析器
+
+    - 应答按记录TTL缓存（dnspython LRUCache），NXDOMAIN另做负缓存
+    - A、MX、TXT记录并发查询
+    - HTTP与TLS连接直接使用已缓存的A记录，同一次检测中域名只解析一次
+    """
+
+    def __init__(self, max_size=100000, negative_ttl=300, max_workers=32):
+        self.resolver = dns.resolver.Resolver()
+        self.resolver.cache = dns.resolver.LRUCache(max_size)
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._nxdomain = {}  # 域名 -> 负缓存过期时间
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dns')
+        self._async_resolver = None
+
+    def resolve(self, domain, record_type):
+        """查询单条记录，域名不存在时抛出NXDOMAIN"""
+        self._check_nxdomain(domain)
+        try:
+            # 同一域名同一记录类型的并发查询只发起一次
+            answer, _ = self._flight.do((domain, record_type), self.resolver.resolve, domain, record_type)
+            return answer
+        except dns.resolver.NXDOMAIN:
+            self._remember_nxdomain(domain)
+            raise
+
+    async def resolve_async(self, domain, record_type):
+        """resolve()的协程版本，共享应答缓存、NXDOMAIN负缓存以及与同步调用方的并发查询合并"""
+        self._check_nxdomain(domain)
+        if self._async_resolver is None:
+            self._async_resolver = dns.asyncresolver.Resolver()
+            self._async_resolver.cache = self.resolver.cache
+        try:
+            answer, _ = await self._flight.do_async(
+                (domain, record_type), self._async_resolver.resolve, domain, record_type
+            )
+            return answer
+        except dns.resolver.NXDOMAIN:
+            self._remember_nxdomain(domain)
+            raise
+
+    def _check_nxdomain(self, domain):
+        with self._lock:
+            expires_at = self._nxdomain.get(domain)
+        if expires_at is not None and expires_at > time.time():
+            raise dns.resolver.NXDOMAIN(qnames=[dns.name.from_text(domain)])
+
+    def _remember_nxdomain(self, domain):
+        with self._lock:
+            if len(self._nxdomain) >= self.max_size:
+                now = time.time()
+                self._nxdomain = {d: t for d, t in self._nxdomain.items() if t > now}
+                if len(self._nxdomain) >= self.max_size:
+                    self._nxdomain.clear()
+            self._nxdomain[domain] = time.time() + self.negative_ttl
+
+    def resolve_records(self, domain, record_types=('A', 'MX', 'TXT')):
+        """并发查询多种记录，返回 {记录类型: 应答或查询异常}"""
+        futures = {record_type: self._executor.submit(self.resolve, domain, record_type)
+                   for record_type in record_types}
+        records = {}
+        for record_type, future in futures.items():
+            try:
+                records[record_type] = future.result()
+            except Exception as e:
+                records[record_type] = e
+        return records
+
+    async def resolve_records_async(self, domain, record_types=('A', 'MX', 'TXT')):
+        """resolve_records()的协程版本"""
+        answers = await asyncio.gather(
+            *(self.resolve_async(domain, record_type) for record_type in record_types), return_exceptions=True
+        )
+        return dict(zip(record_types, answers))
+
+    def stats(self):
+        """返回缓存命中统计"""
+        cache = self.resolver.cache
+        hits, misses = cache.hits(), cache.misses()
+        total = hits + misses
+        with self._lock:
+            negative_entries = len(self._nxdomain)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+            'entries': len(cache.data),
+            'negative_entries': negative_entries
+        }
+
+    def cached_ip(self, host):
+        """返回缓存中host的首个A记录IP，未缓存时返回None（不发起查询）"""
+        if not host or ':' in host or is_ip_address(host):
+            return None
+        try:
+            answer = self.resolver.cache.get(
+                (dns.name.from_text(host), dns.rdatatype.A, dns.rdataclass.IN)
+            )
+        except Exception:
+            return None
+        if answer is None or answer.rrset is None or len(answer) == 0:
+            return None
+        return str(answer[0])
+
+
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+
+
+def get_dns_cache():
+    """获取进程内共享的DNS缓存"""
+    global _dns_cache
+    with _dns_cache_lock:
+        if _dns_cache is None:
+            _dns_cache = DnsCache(
+                max_size=CONFIG.get('dns_cache_size', 100000),
+                negative_ttl=CONFIG.get('dns_negative_ttl', 300)
+            )
+        return _dns_cache
+
+
+class _CachedDNSConnectionMixin:
+    """优先使用DNS缓存中已解析的IP建立连接，Host头与SNI仍使用原域名"""
+
+    def _new_conn(self):
+        ip = get_dns_cache().cached_ip(self.host)
+        if ip is None:
+            return super()._new_conn()
+        try:
+            return urllib3.util.connection.create_connection(
+                (ip, self.port),
+                self.timeout,
+                source_address=self.source_address,
+                socket_options=self.socket_options,
+            )
+        except socket.timeout as e:
+            raise urllib3.exceptions.ConnectTimeoutError(
+                self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})"
+            ) from e
+        except OSError as e:
+            raise urllib3.exceptions.NewConnectionError(
+                self, f"Failed to establish a new connection: {e}"
+            ) from e
+
+
+class _CachedDNSHTTPConnection(_CachedDNSConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _CachedDNSHTTPSConnection(_CachedDNSConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _CachedDNSHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _CachedDNSHTTPConnection
+
+
+class _CachedDNSHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _CachedDNSHTTPSConnection
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """使用共享DNS缓存建立连接的HTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CachedDNSHTTPConnectionPool,
+            'https': _CachedDNSHTTPSConnectionPool,
+        }
+
+
+class HostLimiter:
+    """按主机与解析IP限制并发请求数，按主机限制请求速率，主机返回429/5xx时对其退避；所有检测线程共享"""
+
+    # 触发退避的HTTP状态码（以及所有5xx）
+    BACKOFF_STATUS = (429,)
+    # 协程等待名额时的轮询间隔（秒），名额与同步调用方共享，无法直接await线程信号量
+    ASYNC_POLL_INTERVAL = 0.05
+
+    def __init__(self, max_per_host, max_per_ip=None, rate=0, backoff_base=1.0, backoff_max=60.0):
+        self.max_per_host = max_per_host
+        self.max_per_ip = max_per_ip
+        self.interval = 1.0 / rate if rate else 0.0
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = {}  # host或('ip', IP) -> [信号量, 使用者数量]
+        self._pacing = {}  # host -> [下次允许请求的时间, 退避截止时间, 连续失败次数]
+        self._lock = threading.Lock()
+
+    def _keys(self, host):
+        keys = [host]
+        if self.max_per_ip:
+            # 同一IP上的多个站点共享IP级名额（只使用已缓存的解析结果，不额外查询DNS）
+            hostname = host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+            ip = hostname if is_ip_address(hostname) else get_dns_cache().cached_ip(hostname)
+            if ip:
+                keys.append(('ip', ip))
+        return keys
+
+    def _enter(self, key, limit):
+        with self._lock:
+            entry = self._slots.get(key)
+            if entry is None:
+                entry = self._slots[key] = [threading.BoundedSemaphore(limit), 0]
+            entry[1] += 1
+        return entry
+
+    def _exit(self, key, entry, acquired):
+        if acquired:
+            entry[0].release()
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                # 主机空闲后释放其信号量，避免长时间运行时无限增长
+                del self._slots[key]
+                if key in self._pacing and self._pacing_expired(self._pacing[key]):
+                    del self._pacing[key]
+
+    @staticmethod
+    def _pacing_expired(pacing, now=None):
+        now = now or time.time()
+        return pacing[0] <= now and pacing[1] <= now and pacing[2] == 0
+
+    @contextmanager
+    def slot(self, host, timeout=None):
+        """占用主机（及其IP）的一个并发名额并等待到允许请求的时间，在timeout秒内无法开始请求时返回False"""
+        deadline = time.time() + timeout if timeout is not None else None
+        held = []
+        acquired = True
+        try:
+            for key in self._keys(host):
+                entry = self._enter(key, self.max_per_host if key == host else self.max_per_ip)
+                if deadline is None:
+                    ok = entry[0].acquire()
+                else:
+                    ok = entry[0].acquire(timeout=max(0, deadline - time.time()))
+                held.append((key, entry, ok))
+                if not ok:
+                    acquired = False
+                    break
+            if acquired:
+                acquired = self._wait_turn(host, deadline)
+            yield acquired
+        finally:
+            for key, entry, ok in reversed(held):
+                self._exit(key, entry, ok)
+
+    @asynccontextmanager
+    async def slot_async(self, host, timeout=None):
+        """slot()的协程版本，等待名额与请求时间时不阻塞事件循环（与同步调用方共享名额、速率与退避）"""
+        deadline = time.time() + timeout if timeout is not None else None
+        held = []
+        acquired = True
+        try:
+            for key in self._keys(host):
+                entry = self._enter(key, self.max_per_host if key == host else self.max_per_ip)
+                ok = await self._acquire_async(entry[0], deadline)
+                held.append((key, entry, ok))
+                if not ok:
+                    acquired = False
+                    break
+            if acquired:
+                delay = self._reserve_turn(host, deadline)
+                acquired = delay is not None
+                if delay:
+                    await asyncio.sleep(delay)
+            yield acquired
+        finally:
+            for key, entry, ok in reversed(held):
+                self._exit(key, entry, ok)
+
+    async def _acquire_async(self, semaphore, deadline):
+        while not semaphore.acquire(blocking=False):
+            remaining = deadline - time.time() if deadline is not None else self.ASYNC_POLL_INTERVAL
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(self.ASYNC_POLL_INTERVAL, remaining))
+        return True
+
+    def _wait_turn(self, host, deadline):
+        """按请求速率与退避时间预约本次请求的开始时间并等待，超出deadline时返回False"""
+        delay = self._reserve_turn(host, deadline)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def _reserve_turn(self, host, deadline):
+        """预约本次请求的开始时间，返回需要等待的秒数，超出deadline时返回None"""
+        with self._lock:
+            now = time.time()
+            if len(self._pacing) > 100000:
+                # 清理已过期且空闲的主机记录
+                self._pacing = {h: p for h, p in self._pacing.items()
+                                if h in self._slots or not self._pacing_expired(p, now)}
+            pacing = self._pacing.setdefault(host, [0.0, 0.0, 0])
+            start = max(now, pacing[0], pacing[1])
+            if deadline is not None and start > deadline:
+                return None
+            pacing[0] = start + self.interval
+        return start - now
+
+    def report(self, host, status_code, retry_after=None):
+        """记录主机的响应状态：429/5xx时按指数退避（优先使用Retry-After），其他响应清除退避"""
+        with self._lock:
+            pacing = self._pacing.get(host)
+            if status_code in self.BACKOFF_STATUS or 500 <= status_code < 600:
+                if pacing is None:
+                    pacing = self._pacing[host] = [0.0, 0.0, 0]
+                pacing[2] += 1
+                delay = self.backoff_base * 2 ** (pacing[2] - 1)
+                try:
+                    delay = float(retry_after) if retry_after is not None else delay
+                except (TypeError, ValueError):
+                    pass
+                pacing[1] = max(pacing[1], time.time() + min(delay, self.backoff_max))
+            elif pacing is not None and status_code:
+                pacing[1] = 0.0
+                pacing[2] = 0
+
+    def backoff_remaining(self, host):
+        """返回主机剩余的退避时间（秒）"""
+        with self._lock:
+            pacing = self._pacing.get(host)
+        return max(0.0, pacing[1] - time.time()) if pacing else 0.0
+
+    def report_page(self, host, page):
+        """根据PageFetch记录主机响应状态"""
+        if page.error is None:
+            self.report(host, page.status_code, page.headers.get('Retry-After'))
+
+    def stats(self):
+        """返回正在请求的主机数与处于退避中的主机数"""
+        now = time.time()
+        with self._lock:
+            return {
+                'active_hosts': sum(1 for key in self._slots if not isinstance(key, tuple)),
+                'backoff_hosts': sum(1 for pacing in self._pacing.values() if pacing[1] > now)
+            }
+
+
+class HostBusyError(Exception):
+    """在等待时间内没有取得主机的请求名额（并发已满、速率限制或处于退避中）"""
+
+
+# 全局主机并发、速率限制与退避
+HOST_LIMITER = HostLimiter(
+    CONFIG.get('per_host_concurrency', 4),
+    max_per_ip=CONFIG.get('per_ip_concurrency', 8),
+    rate=CONFIG.get('per_host_rate', 10),
+    backoff_base=CONFIG.get('host_backoff_base', 1.0),
+    backoff_max=CONFIG.get('host_backoff_max', 60.0)
+)
+
+
+# 读取输入迭代器结束的标记
+_END_OF_INPUT = object()
+
+
+class HostScheduler:
+    """批量检测的URL调度：在有限的预读窗口内按主机交错提交URL
+
+    同一主机同时检测的URL不超过max_per_host个，优先选择当前检测数最少且不在退避中的主机，
+    避免输入中集中在同一主机的URL同时占满所有检测线程
+    """
+
+    def __init__(self, urls, max_per_host=2, lookahead=1000, limiter=None):
+        self.max_per_host = max_per_host
+        self.lookahead = max(1, lookahead)
+        self.limiter = limiter
+        self.exhausted = False
+        self._iter = iter(urls)
+        self._queues = OrderedDict()  # 主机 -> 预读的URL队列（按轮转顺序）
+        self._buffered = 0
+        self._active = {}  # 主机 -> 检测中的URL数
+
+    @staticmethod
+    def host_of(url):
+        if not url.startswith(('http://', 'https://')):
+            url = 'http://' + url
+        return urlparse(url).netloc
+
+    @property
+    def empty(self):
+        """输入已读完且没有待提交的URL"""
+        return self.exhausted and not self._buffered
+
+    def _fill(self):
+        while not self.exhausted and self._buffered < self.lookahead:
+            url = next(self._iter, _END_OF_INPUT)
+            if url is _END_OF_INPUT:
+                self.exhausted = True
+                break
+            self._queues.setdefault(self.host_of(url), deque()).append(url)
+            self._buffered += 1
+
+    def next(self):
+        """返回下一个可提交的 (URL, 主机)；当前没有可提交的URL时返回None"""
+        self._fill()
+        best_host, best_rank = None, None
+        for host in self._queues:
+            active = self._active.get(host, 0)
+            if active >= self.max_per_host:
+                continue
+            backing_off = self.limiter is not None and self.limiter.backoff_remaining(host) > 0
+            rank = (backing_off, active)
+            if best_rank is None or rank < best_rank:
+                best_host, best_rank = host, rank
+                if rank == (False, 0):
+                    break
+        if best_host is None:
+            return None
+        queue_ = self._queues[best_host]
+        url = queue_.popleft()
+        if queue_:
+            self._queues.move_to_end(best_host)
+        else:
+            del self._queues[best_host]
+        self._buffered -= 1
+        self._active[best_host] = self._active.get(best_host, 0) + 1
+        return url, best_host
+
+    def requeue(self, url, host):
+        """将未能开始检测的URL放回主机队列末尾，稍后重新提交（不占用预读窗口外的输入）"""
+        self._queues.setdefault(host, deque()).append(url)
+        self._buffered += 1
+
+    def done(self, host):
+        """URL检测完成后释放主机的检测名额，返回预读窗口内该主机的URL是否已全部检测完"""
+        self._active[host] -= 1
+        if not self._active[host]:
+            del self._active[host]
+            return host not in self._queues
+        return False
+
+
+class HostFeatureCache:
+    """批量检测中按主机共享的主机级特征（域名与DNS特征）
+
+    同一主机的URL只计算一次（并发请求合并），主机的URL全部检测完后由调用方discard释放
+    """
+
+    def __init__(self, compute):
+        self.compute = compute
+        self.computed = 0
+        self.reused = 0
+        self._features = {}
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        features = self._cached(host)
+        if features is not None:
+            return features
+        features, shared = self._flight.do(host, self._compute, host)
+        if shared:
+            self._count_reused()
+        return features
+
+    async def get_async(self, host):
+        """get()的协程版本，compute为协程函数"""
+        features = self._cached(host)
+        if features is not None:
+            return features
+        features, shared = await self._flight.do_async(host, self._compute_async, host)
+        if shared:
+            self._count_reused()
+        return features
+
+    def _cached(self, host):
+        with self._lock:
+            features = self._features.get(host)
+        if features is not None:
+            self._count_reused()
+        return features
+
+    def _count_reused(self):
+        with self._lock:
+            self.reused += 1
+        METRICS.inc('detector_host_features_total', {'result': 'reused'})
+
+    def _compute(self, host):
+        return self._store(host, self.compute(host))
+
+    async def _compute_async(self, host):
+        return self._store(host, await self.compute(host))
+
+    def _store(self, host, features):
+        with self._lock:
+            self._features[host] = features
+            self.computed += 1
+        METRICS.inc('detector_host_features_total', {'result': 'computed'})
+        return features
+
+    def discard(self, host):
+        with self._lock:
+            self._features.pop(host, None)
+
+
+class PageFetch:
+    """单次页面请求结果，供各特征提取器共享（响应内容、响应头、耗时、重定向历史、解析后的文档）"""
+
+    def __init__(self, url, content=b'', status_code=0, headers=None, final_url=None,
+                 history=None, elapsed=-1, error=None):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self.final_url = final_url or url
+        self.history = history or []  # 重定向经过的URL列表
+        self.elapsed = elapsed  # 请求耗时（秒）
+        self.error = error  # 请求失败时的异常
+        self._soup = None
+        self._text = None
+
+    @classmethod
+    def from_response(cls, url, response, elapsed):
+        """由requests响应对象构建"""
+        return cls(
+            url,
+            content=response.content,
+            status_code=response.status_code,
+            headers=response.headers,
+            final_url=response.url,
+            history=[r.url for r in response.history],
+            elapsed=elapsed
+        )
+
+    @property
+    def soup(self):
+        """解析后的文档（首次访问时解析，之后复用）"""
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.content, 'html.parser')
+        return self._soup
+
+    @property
+    def text(self):
+        """页面纯文本"""
+        if self._text is None:
+            self._text = self.soup.get_text()
+        return self._text
+
+
+class KeywordMatcher:
+    """多类别敏感关键词匹配器（Aho-Corasick自动机）
+
+    关键词加载时构建一次，对每段文本只需扫描一遍即可得到各类别命中的关键词数量，
+    结果与逐个关键词执行 `keyword.lower() in text` 的统计方式一致。
+    """
+
+    def __init__(self, keywords_dict):
+        self.keywords = keywords_dict
+        self.categories = list(keywords_dict.keys())
+        self._goto = [{}]  # 各状态的字符转移表
+        self._fail = [0]  # 失配跳转
+        self._report = [0]  # 状态自身或失配链上最近的终止状态
+        self._next_report = [0]  # 终止状态沿失配链的下一个终止状态
+        self._state_counts = [None]  # 终止状态 -> [(类别下标, 命中计数)]
+        self._always_counts = [0] * len(self.categories)  # 空关键词总是命中
+        self.keyword_count = 0
+
+        pattern_counts = {}
+        for index, keywords in enumerate(keywords_dict.values()):
+            for keyword in keywords or []:
+                if not isinstance(keyword, str):
+                    continue
+                self.keyword_count += 1
+                pattern = keyword.lower()
+                if not pattern:
+                    self._always_counts[index] += 1
+                    continue
+                counts = pattern_counts.setdefault(pattern, {})
+                counts[index] = counts.get(index, 0) + 1
+
+        for pattern, counts in pattern_counts.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._report.append(0)
+                    self._next_report.append(0)
+                    self._state_counts.append(None)
+                state = next_state
+            self._state_counts[state] = list(counts.items())
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        """按广度优先顺序计算失配跳转与输出链"""
+        goto, fail, state_counts = self._goto, self._fail, self._state_counts
+        queue = deque()
+        for state in goto[0].values():
+            queue.append(state)
+            if state_counts[state]:
+                self._report[state] = state
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                inherited = self._report[fail[next_state]]
+                if state_counts[next_state]:
+                    self._report[next_state] = next_state
+                    self._next_report[next_state] = inherited
+                else:
+                    self._report[next_state] = inherited
+
+    def count(self, text):
+        """扫描已转为小写的文本，返回 {类别: 命中的关键词数量}"""
+        goto, fail, report = self._goto, self._fail, self._report
+        found = set()
+        state = 0
+        for char in text:
+            next_state = goto[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(char)
+            state = next_state or 0
+            if report[state]:
+                found.add(report[state])
+
+        totals = list(self._always_counts)
+        seen = set()
+        for state in found:
+            while state and state not in seen:
+                seen.add(state)
+                for index, hits in self._state_counts[state]:
+                    totals[index] += hits
+                state = self._next_report[state]
+        return dict(zip(self.categories, totals))
+
+
+class BrandIndex:
+    """品牌名相似度索引（仿冒/钓鱼域名检测）
+
+    相似度定义为 1 - 编辑距离 / max(两者长度)。品牌名在构建时按长度排序分组并编码为
+    NumPy字符矩阵，查询时对一组内的所有品牌同时计算编辑距离（逐字符更新整组的动态规划
+    行）。由于编辑距离不小于长度差，每组都有相似度上限，按上限从高到低遍历，上限不超过
+    当前结果时跳过剩余分组。结果与逐个品牌计算完全一致。
+    """
+
+    # 每组至少包含的品牌数，品牌较少时合并相邻长度以减少NumPy调用次数
+    MIN_GROUP_SIZE = 64
+
+    def __init__(self, brands):
+        self.brands = []
+        seen = set()
+        for brand in brands:
+            brand = brand.strip().lower()
+            if brand and brand not in seen:
+                seen.add(brand)
+                self.brands.append(brand)
+
+        self._groups = []  # [(品牌列表, 字符矩阵, 品牌长度数组)]
+        group = []
+        for brand in sorted(self.brands, key=len):
+            if len(group) >= self.MIN_GROUP_SIZE and len(brand) != len(group[-1]):
+                self._groups.append(self._build_group(group))
+                group = []
+            group.append(brand)
+        if group:
+            self._groups.append(self._build_group(group))
+
+    @staticmethod
+    def _build_group(names):
+        lengths = np.array([len(name) for name in names])
+        codes = np.zeros((len(names), lengths.max()), dtype=np.int32)  # 0为填充位，不参与结果
+        for row, name in enumerate(names):
+            codes[row, :len(name)] = [ord(char) for char in name]
+        return names, codes, lengths
+
+    @staticmethod
+    def _group_distances(text, codes, lengths):
+        """计算text与一组品牌的编辑距离"""
+        count, width = codes.shape
+        columns = np.arange(width + 1)
+        previous_row = np.tile(columns, (count, 1))
+        for i, char in enumerate(text, 1):
+            current_row = np.empty_like(previous_row)
+            current_row[:, 0] = i
+            # 替换与插入
+            np.minimum(previous_row[:, :-1] + (codes != ord(char)), previous_row[:, 1:] + 1, out=current_row[:, 1:])
+            # 删除：current[j] = min(current[j], current[j-1] + 1)，用前缀最小值一次完成
+            previous_row = np.minimum.accumulate(current_row - columns, axis=1) + columns
+        # 第j列只依赖前j个字符，按各品牌自身长度取值即可忽略填充位
+        return previous_row[np.arange(count), lengths]
+
+    def closest(self, text, limit=3):
+        """返回与text最相似的品牌 [(品牌, 相似度)]，按相似度从高到低排列（不含相似度为0的品牌）"""
+        text = text.lower()
+        length = len(text)
+        if not length:
+            return []
+
+        def upper_bound(group):
+            # 组内品牌长度有序，与text长度最接近的品牌上限最高
+            lengths = group[2]
+            nearest = min(max(length, lengths[0]), lengths[-1])
+            return min(length, nearest) / max(length, nearest)
+
+        heap = []  # 当前最相似的limit个品牌 (相似度, 品牌)，堆顶为其中最小者
+        for bound, group in sorted(((upper_bound(group), group) for group in self._groups),
+                                   key=lambda item: item[0], reverse=True):
+            if len(heap) == limit and bound <= heap[0][0]:
+                break
+            names, codes, lengths = group
+            distances = self._group_distances(text, codes, lengths)
+            similarities = 1 - distances / np.maximum(length, lengths)
+            for index in np.argsort(-similarities, kind='stable')[:limit]:
+                similarity = max(0, 1 - int(distances[index]) / max(length, int(lengths[index])))
+                if similarity <= 0:
+                    break
+                if len(heap) < limit:
+                    heapq.heappush(heap, (similarity, names[index]))
+                elif similarity > heap[0][0]:
+                    heapq.heapreplace(heap, (similarity, names[index]))
+                else:
+                    break
+        return [(brand, similarity) for similarity, brand in sorted(heap, reverse=True)]
+
+    def best_similarity(self, text):
+        """返回text与所有品牌的最高相似度"""
+        matches = self.closest(text, limit=1)
+        return matches[0][1] if matches else 0
+
+    def closest_by_label(self, host, limit=3):
+        """对主机名的每一级标签分别查找最相似的品牌，返回 {标签: [(品牌, 相似度)]}"""
+        host = host.lower().split(':', 1)[0]
+        return {label: self.closest(label, limit) for label in host.split('.') if label}
+
+
+def load_brand_keywords(path):
+    """从文件加载品牌名（每行一个，#开头为注释），文件不存在时返回空列表"""
+    if not path:
+        return []
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    if not os.path.exists(path):
+        logger.warning(f"品牌名文件不存在: {path}")
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def load_sensitive_keywords():
+    """从数据库加载敏感关键词，数据库不可用时从keyword.json文件读取"""
+    keywords_dict = {}
+    try:
+        with get_db_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                # 执行SQL查询
+                sql = """select illegal, (select dict_label from sys_dict_data where dict_type = 'contraband_type' and dict_value = g.category ) as dict_type from gat_illegal_keyword g"""
+                cursor.execute(sql)
+                results = cursor.fetchall()
+                
+                # 构建关键词字典
+                for row in results:
+                    keyword = row['illegal']
+                    category = row['dict_type']
+                    if category not in keywords_dict:
+                        keywords_dict[category] = []
+                    keywords_dict[category].append(keyword)
+    except Exception as e:
+        logger.error(f"从数据库加载关键词失败: {e}")
+        # 如果数据库连接失败，从keyword.json文件中读取关键词
+        try:
+            # 获取当前文件所在目录
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            # 构建keyword.json文件的完整路径
+            keyword_file_path = os.path.join(current_dir, 'keyword.json')
+            # 检查文件是否存在
+            if os.path.exists(keyword_file_path):
+                with open(keyword_file_path, 'r', encoding='utf-8') as f:
+                    # 读取文件内容并解析为字典
+                    file_content = f.read()
+                    # 处理文件内容，去除可能的BOM字符
+                    file_content = file_content.lstrip('\ufeff')
+                    keywords_dict = json.loads(file_content)
+                    logger.info(f"成功从文件加载关键词，共加载 {len(keywords_dict)} 个类别")
+            else:
+                logger.warning(f"关键词文件不存在: {keyword_file_path}")
+        except Exception as file_error:
+            logger.error(f"从文件加载关键词失败: {file_error}")
+            keywords_dict = {}
+    return keywords_dict
+
+
+class KeywordStore:
+    """进程内共享的敏感关键词库
+
+    关键词与编译好的KeywordMatcher作为一个整体快照原子替换，检测过程中持有的
+    匹配器不会被修改；后台线程每refresh_interval秒重新加载一次，只有关键词
+    实际发生变化时才重新构建匹配器。
+    """
+
+    def __init__(self, loader=load_sensitive_keywords, refresh_interval=3600):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._fingerprint = None
+        self.matcher = KeywordMatcher({})
+        self.refresh()
+
+    @staticmethod
+    def _fingerprint_of(keywords_dict):
+        payload = json.dumps(list(keywords_dict.items()), ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def refresh(self):
+        """重新加载关键词，关键词有变化时返回True"""
+        with self._refresh_lock:
+            keywords_dict = self.loader()
+            if not keywords_dict and self.matcher.keyword_count:
+                # 数据库与文件均加载失败时保留现有关键词
+                logger.warning("关键词加载结果为空，继续使用现有关键词")
+                return False
+            fingerprint = self._fingerprint_of(keywords_dict)
+            if fingerprint == self._fingerprint:
+                return False
+            matcher = KeywordMatcher(keywords_dict)
+            self.matcher, self._fingerprint = matcher, fingerprint
+            logger.info(f"关键词库已更新，共 {len(matcher.categories)} 个类别、{matcher.keyword_count} 个关键词")
+            return True
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"后台刷新关键词失败: {e}")
+
+    def start(self):
+        """启动后台刷新线程"""
+        if self._thread is None and self.refresh_interval > 0:
+            self._thread = threading.Thread(target=self._refresh_loop, name='keyword-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop_event.set()
+
+
+_keyword_store = None
+_keyword_store_lock = threading.Lock()
+
+
+def get_keyword_store():
+    """获取进程内共享的关键词库（首次调用时加载并启动后台刷新）"""
+    global _keyword_store
+    with _keyword_store_lock:
+        if _keyword_store is None:
+            _keyword_store = KeywordStore(refresh_interval=CONFIG.get('cache_ttl', 3600))
+            _keyword_store.start()
+        return _keyword_store
+
+
+class RiskRule:
+    """基于规则风险评分中的一条规则
+
+    feature comparator threshold 成立（且附加条件also成立）时加weight分；
+    per_unit为True时加 weight × 特征值。缺失特征按0处理。
+    """
+
+    __slots__ = ('feature', 'comparator', 'threshold', 'weight', 'per_unit', 'also')
+
+    def __init__(self, feature, comparator, threshold, weight, per_unit=False, also=None):
+        self.feature = feature
+        self.comparator = comparator
+        self.threshold = threshold
+        self.weight = weight
+        self.per_unit = per_unit
+        self.also = also  # 附加条件 (特征, 比较符, 阈值)
+
+
+# 比较符 -> (标量比较函数, NumPy比较函数)
+RISK_COMPARATORS = {
+    '>': (operator.gt, np.greater),
+    '>=': (operator.ge, np.greater_equal),
+    '<': (operator.lt, np.less),
+    '<=': (operator.le, np.less_equal),
+    '==': (operator.eq, np.equal),
+    '!=': (operator.ne, np.not_equal),
+}
+
+# 由多个特征求和得到的派生特征
+DERIVED_RISK_FEATURES = {
+    'sensitive_total': ('sensitive_gambling', 'sensitive_fraud', 'sensitive_pornography', 'sensitive_financial_fraud'),
+}
+
+RISK_RULES = [
+    # 子页面风险因子
+    RiskRule('has_sensitive_subpage', '==', 1, 30),  # 包含高敏感子页面
+    RiskRule('suspicious_subpages', '>', 0, 10, per_unit=True),  # 每个可疑子页面增加风险
+    RiskRule('avg_subpage_risk', '>', 50, 15),  # 子页面平均风险较高
+    # 域名风险因子
+    RiskRule('in_blacklist', '==', 1, 50),  # 黑名单直接高分
+    RiskRule('homograph_attack', '==', 1, 30),  # 同形异义字符攻击
+    RiskRule('potential_phishing', '==', 1, 25),  # 品牌钓鱼
+    RiskRule('brand_similarity', '>', 0.8, 20),  # 高品牌相似度
+    RiskRule('entropy', '>', 4.0, 15),  # 高熵值（随机域名）
+    RiskRule('is_very_new_domain', '==', 1, 5),  # 非常新的域名
+    RiskRule('short_registration', '==', 1, 5),  # 短期注册
+    RiskRule('suspicious_registrar', '==', 1, 10),  # 可疑注册商
+    RiskRule('suspicious_combo', '>', 2, 15),  # 可疑关键词组合
+    # 内容风险因子（敏感内容总数 >0/>5/>10 分别累计为10/20/30分）
+    RiskRule('sensitive_total', '>', 0, 10),
+    RiskRule('sensitive_total', '>', 5, 10),
+    RiskRule('sensitive_total', '>', 10, 10),
+    RiskRule('sensitive_keyword_ratio', '>', 0.1, 15),
+    RiskRule('has_login_form', '==', 1, 25, also=('has_ssl', '==', 0)),  # 登录表单无SSL
+    RiskRule('suspicious_scripts', '>', 3, 15),  # 可疑脚本
+    RiskRule('domain_changed', '==', 1, 20),  # 域名跳转
+    # SSL证书风险因子
+    RiskRule('has_ssl', '==', 0, 15),
+    RiskRule('ssl_valid', '==', 0, 20),
+    RiskRule('trusted_ca', '==', 0, 10),  # 非可信CA
+    RiskRule('cert_too_new', '==', 1, 10),  # 证书太新
+    RiskRule('cert_valid_days', '<', 30, 10),  # 证书即将过期
+    # 网络风险因子
+    RiskRule('blacklisted_ip', '==', 1, 40),  # 黑名单IP
+    RiskRule('web_accessible', '==', 0, 30),  # 无法访问
+    RiskRule('dns_resolved', '==', 0, 25),
+    RiskRule('response_time', '>', 5, 10),  # 响应时间过长
+    RiskRule('http_status', '>=', 400, 15),  # HTTP错误状态
+    # 安全头（负向风险，每项减2分）
+    RiskRule('hsts', '!=', 0, -2, per_unit=True),
+    RiskRule('x_frame_options', '!=', 0, -2, per_unit=True),
+    RiskRule('x_content_type', '!=', 0, -2, per_unit=True),
+    RiskRule('x_xss_protection', '!=', 0, -2, per_unit=True),
+    RiskRule('csp', '!=', 0, -2, per_unit=True),
+    # 信任指标（负向风险）
+    RiskRule('has_contact_info', '==', 1, -10),
+    RiskRule('has_privacy_policy', '==', 1, -10),
+    RiskRule('has_mx', '==', 1, -5),  # 有MX记录
+    RiskRule('domain_age_days', '>', 365, -15),  # 老域名
+]
+
+# 风险等级阈值（从高到低），低于所有阈值为LOW
+RISK_LEVEL_THRESHOLDS = [(70, 'HIGH'), (40, 'MEDIUM')]
+
+
+def _risk_feature_value(features, name):
+    """取评分用特征值，派生特征为各组成特征之和"""
+    if name in DERIVED_RISK_FEATURES:
+        return sum(features.get(part, 0) for part in DERIVED_RISK_FEATURES[name])
+    return features.get(name, 0)
+
+
+def _risk_level(risk_score):
+    for threshold, level in RISK_LEVEL_THRESHOLDS:
+        if risk_score >= threshold:
+            return level
+    return 'LOW'
+
+
+def rule_based_risk(features, rules=RISK_RULES):
+    """按规则表对单个网站评分，返回 (风险等级, 0-100的风险评分)"""
+    risk_score = 0
+    for rule in rules:
+        value = _risk_feature_value(features, rule.feature)
+        if not RISK_COMPARATORS[rule.comparator][0](value, rule.threshold):
+            continue
+        if rule.also:
+            feature, comparator, threshold = rule.also
+            if not RISK_COMPARATORS[comparator][0](_risk_feature_value(features, feature), threshold):
+                continue
+        risk_score += rule.weight * value if rule.per_unit else rule.weight
+    risk_score = max(0, min(100, risk_score))  # 限制在0-100范围内
+    return _risk_level(risk_score), risk_score
+
+
+class RuleScorer:
+    """规则表的向量化实现：对 N×F 特征矩阵一次性评分，结果与rule_based_risk一致"""
+
+    def __init__(self, rules=RISK_RULES):
+        self.rules = rules
+        columns = []
+        for rule in rules:
+            for feature in (rule.feature, rule.also[0] if rule.also else None):
+                if feature and feature not in columns:
+                    columns.append(feature)
+        self.columns = columns
+        column_index = {feature: index for index, feature in enumerate(columns)}
+
+        # 按比较符分组：(比较函数, 规则下标, 特征列, 阈值)
+        groups = {}
+        also_groups = {}
+        for rule_index, rule in enumerate(rules):
+            groups.setdefault(rule.comparator, []).append((rule_index, column_index[rule.feature], rule.threshold))
+            if rule.also:
+                feature, comparator, threshold = rule.also
+                also_groups.setdefault(comparator, []).append((rule_index, column_index[feature], threshold))
+        self._groups = [self._compile(comparator, entries) for comparator, entries in groups.items()]
+        self._also_groups = [self._compile(comparator, entries) for comparator, entries in also_groups.items()]
+
+        self._weights = np.array([rule.weight for rule in rules], dtype=np.float64)
+        self._per_unit = np.array([rule.per_unit for rule in rules])
+        self._value_columns = np.array([column_index[rule.feature] for rule in rules])
+
+    @staticmethod
+    def _compile(comparator, entries):
+        rule_indexes, feature_columns, thresholds = zip(*entries)
+        return (RISK_COMPARATORS[comparator][1], np.array(rule_indexes), np.array(feature_columns),
+                np.array(thresholds, dtype=np.float64))
+
+    def feature_matrix(self, features_list):
+        """将特征字典列表转换为 N×F 矩阵（列顺序为self.columns）"""
+        return np.array([[_risk_feature_value(features, column) for column in self.columns]
+                         for features in features_list], dtype=np.float64).reshape(-1, len(self.columns))
+
+    def score_matrix(self, matrix):
+        """对特征矩阵评分，返回裁剪到0-100的风险评分数组"""
+        matched = np.empty((len(matrix), len(self.rules)), dtype=bool)
+        for compare, rule_indexes, feature_columns, thresholds in self._groups:
+            matched[:, rule_indexes] = compare(matrix[:, feature_columns], thresholds)
+        for compare, rule_indexes, feature_columns, thresholds in self._also_groups:
+            matched[:, rule_indexes] &= compare(matrix[:, feature_columns], thresholds)
+        contributions = np.where(self._per_unit, matrix[:, self._value_columns], 1.0) * self._weights * matched
+        # 按规则顺序逐列累加，浮点结果与逐条规则累加完全一致
+        scores = np.zeros(len(matrix))
+        for column in contributions.T:
+            scores += column
+        return np.clip(scores, 0, 100)
+
+    def score(self, features_list):
+        """对多个网站评分，返回 [(风险等级, 风险评分)]"""
+        results = []
+        for risk_score in self.score_matrix(self.feature_matrix(features_list)).tolist():
+            if risk_score.is_integer():
+                risk_score = int(risk_score)
+            results.append((_risk_level(risk_score), risk_score))
+        return results
+
+
+_rule_scorer = None
+
+
+def get_rule_scorer():
+    """获取进程内共享的向量化规则评分器"""
+    global _rule_scorer
+    if _rule_scorer is None:
+        _rule_scorer = RuleScorer()
+    return _rule_scorer
+
+
+_subpage_executor = None
+_subpage_executor_lock = threading.Lock()
+
+
+def get_subpage_executor():
+    """获取进程内所有检测器共享的子页面检测线程池（首次使用时创建）"""
+    global _subpage_executor
+    with _subpage_executor_lock:
+        if _subpage_executor is None:
+            _subpage_executor = ThreadPoolExecutor(
+                max_workers=CONFIG.get('subpage_pool_size', 64), thread_name_prefix='subpage'
+            )
+        return _subpage_executor
+
+
+# 同一URL的并发检测与同一主机的并发TLS证书获取在所有检测器之间合并
+_detection_flight = SingleFlight()
+_certificate_flight = SingleFlight()
 
-# 修改原有的打印函数使用彩色输出
-def print_colored_detection_result(result):
-    """彩色打印检测结果"""
-    url = result.get('网址', '未知')
-    risk_level = result.get('风险等级', '未知')
-    risk_score = result.get('风险评分', '0%')
-    risk_desc = result.get('风险描述', '')
-    
-    color_printer.print_risk_level(risk_level, url, risk_score)
-    
-    if risk_desc:
-        lines = risk_desc.split('\n')
-        for line in lines:
-            if line.startswith('🚨') or line.startswith('⚠️'):
-                color_printer.print(f"   {line}", 'red' if '🚨' in line else 'yellow')
-            elif line.startswith('✅'):
-                color_printer.print(f"   {line}", 'green')
-            elif line.startswith('💡'):
-                color_printer.print(f"   {line}", 'blue')
-            elif line.startswith('•'):
-                color_printer.print(f"   {line}", 'white')
-    
-    print()  # 空行分隔
 
 class WebsiteDetector:
     """违法网站检测器类"""
-    # 添加类级缓存
-    _keyword_cache = None
-    _cache_timestamp = 0
-    _cache_ttl = 3600  # 缓存有效期，单位秒
     
     def __init__(self):
         self.headers = {
@@ -372,13 +2407,18 @@ class WebsiteDetector:
         }
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        self.session.mount('http://', CachedDNSAdapter())
+        self.session.mount('https://', CachedDNSAdapter())
         self.timeout = 10
         # 添加子页面检测相关参数
         self.max_subpages = 50  # 最多检测的子页面数量
         self.subpage_timeout = 8  # 子页面检测超时时间
+        self.subpage_workers = CONFIG.get('subpage_workers', 8)  # 子页面并发检测线程数
+        self.subpage_budget = CONFIG.get('subpage_budget', 30)  # 单个网站子页面检测总时间预算（秒）
+        self.host_slot_timeout = CONFIG.get('host_slot_timeout', 10)  # 主页面等待主机请求名额的最长时间（秒）
         
-        # 敏感关键词库 - 扩展分类
-        self.sensitive_keywords = self._load_keywords_from_db()
+        # 敏感关键词库 - 扩展分类（进程内共享，后台定时刷新）
+        self.keyword_store = get_keyword_store()
         
         # 可疑域名后缀 - 扩展列表
         self.suspicious_tlds = [
@@ -393,11 +2433,12 @@ class WebsiteDetector:
             'icbc', 'ccb', 'abc', 'boc', 'unionpay', 'paypal', 'amazon',
             'microsoft', 'google', 'apple', 'facebook', 'instagram'
         ]
+        # 可通过brands_file配置追加品牌名与重点保护域名
+        self.brand_keywords += load_brand_keywords(CONFIG.get('brands_file'))
+        self.brand_index = BrandIndex(self.brand_keywords)
         
-        # 黑名单IP段和域名
-        self.blacklisted_ips = set()
-        self.blacklisted_domains = set()
-        self._load_blacklists()
+        # 黑名单IP和域名（进程内共享）
+        self.blacklist_store = get_blacklist_store()
         
         # 加载模型（如果存在）
         self.model = self._load_model()
@@ -407,66 +2448,72 @@ class WebsiteDetector:
             "Let's Encrypt", "DigiCert", "GlobalSign", "Sectigo", "GoDaddy",
             "Amazon", "Google Trust Services", "Cloudflare", "Entrust"
         ]
-    def _load_keywords_from_db(self):
-        """从数据库加载敏感关键词，带有缓存机制"""
-        import time
-        current_time = time.time()
-        
-        # 检查缓存是否有效
-        if self._keyword_cache and (current_time - self._cache_timestamp < self._cache_ttl):
-            return self._keyword_cache
 
-        keywords_dict = {}
+    @property
+    def keyword_matcher(self):
+        """当前生效的关键词匹配器"""
+        return self.keyword_store.matcher
+
+    @property
+    def sensitive_keywords(self):
+        """当前生效的敏感关键词字典"""
+        return self.keyword_store.matcher.keywords
+
+    def _extract_subpage_features(self, url, page=None, matcher=None):
+        """提取子页面特征并进行检测
+
+        matcher为本次检测使用的关键词匹配器，为None时使用当前生效的匹配器
+        """
+        features = self._empty_subpage_features()
+        matcher = matcher or self.keyword_matcher
+        
         try:
-            # 连接数据库
-            connection = pymysql.connect(**DB_CONFIG)
-            try:
-                with connection.cursor() as cursor:
-                    # 执行SQL查询
-                    sql = """select illegal, (select dict_label from sys_dict_data where dict_type = 'contraband_type' and dict_value = g.category ) as dict_type from gat_illegal_keyword g"""
-                    cursor.execute(sql)
-                    results = cursor.fetchall()
-                    
-                    # 构建关键词字典
-                    for row in results:
-                        keyword = row['illegal']
-                        category = row['dict_type']
-                        if category not in keywords_dict:
-                            keywords_dict[category] = []
-                        keywords_dict[category].append(keyword)
-            finally:
-                connection.close()
-            # 更新缓存
-            self._keyword_cache = keywords_dict
-            self._cache_timestamp = current_time
+            # 获取主页面内容（优先复用已请求的主页面）
+            if page is None:
+                page = self._fetch_page(url, timeout=self.subpage_timeout)
+            if page.error:
+                raise page.error
+            
+            internal_links = self._collect_internal_links(url, page)
+            if not internal_links:
+                return features
+            
+            # 在共享线程池中并发检测子页面，同时进行的不超过subpage_workers个，整站不超过subpage_budget秒
+            executor = get_subpage_executor()
+            deadline = time.time() + self.subpage_budget
+            links = iter(internal_links)
+            pending = {}
+            completed = {}
+            for subpage_url in itertools.islice(links, self.subpage_workers):
+                pending[executor.submit(self._scan_subpage, subpage_url, deadline, matcher)] = subpage_url
+            while pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    subpage_url = pending.pop(future)
+                    completed[subpage_url] = future.exception() or future.result()
+                    # 预算用尽后不再提交新的子页面
+                    next_url = next(links, None) if time.time() < deadline else None
+                    if next_url is not None:
+                        pending[executor.submit(self._scan_subpage, next_url, deadline, matcher)] = next_url
+            # 仍在进行的检测受同一截止时间约束（主机名额等待、请求超时均不超过deadline），结果将被丢弃
+            for future in pending:
+                future.cancel()
+            
+            # 未完成或未开始的子页面结果为None（超出时间预算被丢弃）
+            subpage_results = [(subpage_url, completed.get(subpage_url)) for subpage_url in internal_links]
+            self._merge_subpage_results(features, url, subpage_results)
+            
         except Exception as e:
-            logger.error(f"从数据库加载关键词失败: {e}")
-            # 如果数据库连接失败，从keyword.txt文件中读取关键词
-            try:
-                import json
-                import os
-                # 获取当前文件所在目录
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-                # 构建keyword.txt文件的完整路径
-                keyword_file_path = os.path.join(current_dir, 'keyword.json')
-                # 检查文件是否存在
-                if os.path.exists(keyword_file_path):
-                    with open(keyword_file_path, 'r', encoding='utf-8') as f:
-                        # 读取文件内容并解析为字典
-                        file_content = f.read()
-                        # 处理文件内容，去除可能的BOM字符
-                        file_content = file_content.lstrip('\ufeff')
-                        keywords_dict = json.loads(file_content)
-                        logger.info(f"成功从文件加载关键词，共加载 {len(keywords_dict)} 个类别")
-                else:
-                    logger.warning(f"关键词文件不存在: {keyword_file_path}")
-            except Exception as file_error:
-                logger.error(f"从文件加载关键词失败: {file_error}")
-                keywords_dict = {}
-        return keywords_dict
-    def _extract_subpage_features(self, url):
-        """提取子页面特征并进行检测"""
-        features = {
+            logger.error(f"子页面特征提取失败 {url}: {e}")
+        
+        return features
+
+    def _empty_subpage_features(self):
+        """子页面特征初始值"""
+        return {
             'subpage_count': 0,  # 检测的子页面数量
             'suspicious_subpages': 0,  # 可疑子页面数量
             'avg_subpage_risk': 0.0,  # 子页面平均风险分数
@@ -474,131 +2521,238 @@ class WebsiteDetector:
             'subpage_keywords': {},  # 子页面中发现的关键词统计
             'subpage_details': []  # 子页面详细信息
         }
-        
-        try:
-            # 获取主页面内容
-            response = self.session.get(url, timeout=self.subpage_timeout)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            parsed_url = urlparse(url)
-            base_domain = parsed_url.netloc
-            
-            # 提取所有内部链接作为子页面候选
-            internal_links = set()
-            for a_tag in soup.find_all('a', href=True):
-                href = a_tag['href'].strip()
-                if href and not href.startswith(('javascript:', '#', 'mailto:', 'tel:')):
-                    # 转换相对链接为绝对链接
-                    absolute_url = urljoin(url, href)
-                    parsed_link = urlparse(absolute_url)
-                    
-                    # 检查是否为同一域名下的链接
-                    if parsed_link.netloc == base_domain:
-                        # 标准化URL（去除锚点等）
-                        normalized_url = parsed_link.scheme + '://' + parsed_link.netloc + parsed_link.path
-                        if normalized_url not in internal_links and normalized_url != url:
-                            internal_links.add(normalized_url)
-                            
-                            # 限制子页面数量
-                            if len(internal_links) >= self.max_subpages:
-                                break
+
+    def _collect_internal_links(self, url, page):
+        """提取所有内部链接作为子页面候选（保持页面中的出现顺序）"""
+        base_domain = urlparse(url).netloc
+        internal_links = []
+        for a_tag in page.soup.find_all('a', href=True):
+            href = a_tag['href'].strip()
+            if href and not href.startswith(('javascript:', '#', 'mailto:', 'tel:')):
+                # 转换相对链接为绝对链接
+                absolute_url = urljoin(url, href)
+                parsed_link = urlparse(absolute_url)
+                
+                # 检查是否为同一域名下的链接
+                if parsed_link.netloc == base_domain:
+                    # 标准化URL（去除锚点等）
+                    normalized_url = parsed_link.scheme + '://' + parsed_link.netloc + parsed_link.path
+                    if normalized_url not in internal_links and normalized_url != url:
+                        internal_links.append(normalized_url)
+                        
+                        # 限制子页面数量
+                        if len(internal_links) >= self.max_subpages:
+                            break
+        return internal_links
+
+    def _merge_subpage_results(self, features, url, subpage_results):
+        """汇总子页面检测结果
+
+        subpage_results为 [(子页面URL, 结果)]，结果为_analyze_subpage的返回值、
+        检测过程中的异常，或None（超出时间预算被丢弃）
+        """
+        total_risk_score = 0
+        dropped = 0
+        for subpage_url, subpage_result in subpage_results:
+            if subpage_result is None:
+                dropped += 1
+                continue
+            if isinstance(subpage_result, Exception):
+                logger.warning(f"子页面检测失败 {subpage_url}: {subpage_result}")
+                METRICS.stage_error('subpages')
+                continue
             
-            # 对子页面进行检测
-            features['subpage_count'] = len(internal_links)
-            total_risk_score = 0
+            detail, keyword_stats = subpage_result
+            subpage_risk = detail['risk_score']
             
-            for subpage_url in internal_links:
-                try:
-                    # 对子页面进行简单特征提取
-                    subpage_features = {}
-                    subpage_response = self.session.get(subpage_url, timeout=self.subpage_timeout)
-                    subpage_soup = BeautifulSoup(subpage_response.content, 'html.parser')
-                    
-                    # 提取子页面内容特征
-                    text_content = subpage_soup.get_text().lower()
-                    
-                    # 统计敏感关键词
-                    subpage_keyword_count = 0
-                    keyword_stats = {}
-                    
-                    for category, keywords in self.sensitive_keywords.items():
-                        count = sum(1 for keyword in keywords if keyword.lower() in text_content)
-                        keyword_stats[category] = count
-                        subpage_keyword_count += count
-                    
-                    # 计算子页面风险分数
-                    subpage_risk = 0
-                    if subpage_keyword_count > 5:
-                        subpage_risk = 80  # 高风险
-                        features['has_sensitive_subpage'] = 1
-                    elif subpage_keyword_count > 2:
-                        subpage_risk = 50  # 中风险
-                    
-                    # 检查是否有可疑表单或脚本
-                    has_login_form = 1 if subpage_soup.find('input', type='password') else 0
-                    script_count = len(subpage_soup.find_all('script'))
-                    
-                    if has_login_form and not subpage_url.startswith('https://'):
-                        subpage_risk += 30
-                    if script_count > 5:
-                        subpage_risk += 20
-                    
-                    # 限制风险分数范围
-                    subpage_risk = min(100, max(0, subpage_risk))
-                    
-                    # 更新统计信息
-                    total_risk_score += subpage_risk
-                    if subpage_risk > 60:
-                        features['suspicious_subpages'] += 1
-                    
-                    # 更新关键词统计
-                    for category, count in keyword_stats.items():
-                        if count > 0:
-                            if category not in features['subpage_keywords']:
-                                features['subpage_keywords'][category] = 0
-                            features['subpage_keywords'][category] += count
-                    
-                    # 保存子页面详细信息
-                    features['subpage_details'].append({
-                        'url': subpage_url,
-                        'risk_score': subpage_risk,
-                        'keyword_count': subpage_keyword_count,
-                        'has_login_form': has_login_form,
-                        'script_count': script_count
-                    })
-                    
-                except Exception as e:
-                    logger.warning(f"子页面检测失败 {subpage_url}: {e}")
-                    continue
+            # 更新统计信息
+            features['subpage_count'] += 1
+            total_risk_score += subpage_risk
+            if detail['keyword_count'] > 5:
+                features['has_sensitive_subpage'] = 1
+            if subpage_risk > 60:
+                features['suspicious_subpages'] += 1
             
-            # 计算平均风险分数
-            if features['subpage_count'] > 0:
-                features['avg_subpage_risk'] = total_risk_score / features['subpage_count']
+            # 更新关键词统计
+            for category, count in keyword_stats.items():
+                if count > 0:
+                    if category not in features['subpage_keywords']:
+                        features['subpage_keywords'][category] = 0
+                    features['subpage_keywords'][category] += count
             
-        except Exception as e:
-            logger.error(f"子页面特征提取失败 {url}: {e}")
+            # 保存子页面详细信息
+            features['subpage_details'].append(detail)
+        
+        if dropped:
+            logger.info(f"子页面检测超出时间预算，丢弃 {dropped} 个子页面 {url}")
+        
+        # 计算平均风险分数（仅统计实际完成检测的子页面）
+        if features['subpage_count'] > 0:
+            features['avg_subpage_risk'] = total_risk_score / features['subpage_count']
+
+    def _scan_subpage(self, subpage_url, deadline, matcher=None):
+        """请求并检测单个子页面，超出时间预算时返回None"""
+        host = urlparse(subpage_url).netloc
+        with HOST_LIMITER.slot(host, timeout=deadline - time.time()) as acquired:
+            remaining = deadline - time.time()
+            if not acquired or remaining <= 0:
+                return None
+            subpage = self._fetch_page(subpage_url, timeout=min(self.subpage_timeout, remaining))
+            HOST_LIMITER.report_page(host, subpage)
+        if subpage.error:
+            raise subpage.error
+        return self._analyze_subpage(subpage_url, subpage, matcher)
+
+    def _analyze_subpage(self, subpage_url, subpage, matcher=None):
+        """对已请求的子页面进行简单特征提取，返回 (子页面详情, 关键词统计)"""
+        subpage_soup = subpage.soup
+        
+        # 提取子页面内容特征并统计敏感关键词
+        text_content = subpage.text.lower()
+        keyword_stats = (matcher or self.keyword_matcher).count(text_content)
+        subpage_keyword_count = sum(keyword_stats.values())
+        
+        # 计算子页面风险分数
+        subpage_risk = 0
+        if subpage_keyword_count > 5:
+            subpage_risk = 80  # 高风险
+        elif subpage_keyword_count > 2:
+            subpage_risk = 50  # 中风险
         
+        # 检查是否有可疑表单或脚本
+        has_login_form = 1 if subpage_soup.find('input', type='password') else 0
+        script_count = len(subpage_soup.find_all('script'))
+        
+        if has_login_form and not subpage_url.startswith('https://'):
+            subpage_risk += 30
+        if script_count > 5:
+            subpage_risk += 20
+        
+        # 限制风险分数范围
+        subpage_risk = min(100, max(0, subpage_risk))
+        
+        detail = {
+            'url': subpage_url,
+            'risk_score': subpage_risk,
+            'keyword_count': subpage_keyword_count,
+            'has_login_form': has_login_form,
+            'script_count': script_count
+        }
+        return detail, keyword_stats
+
+    def extract_all_features(self, url, host_features=None):
+        """提取所有特征（包含子页面特征），同一URL的并发检测只执行一次并共享结果
+
+        host_features为extract_host_features的结果，批量检测时同一主机的URL共用，为None时在此计算
+        """
+        features, _ = _detection_flight.do(url, self._extract_all_features, url, host_features)
+        return dict(features)
+
+    @TRACER.traced('host_features')
+    def extract_host_features(self, host):
+        """提取只与主机有关的特征，返回 (域名特征, DNS特征)
+
+        先解析DNS，之后的HTTP与TLS连接直接使用缓存的解析结果
+        """
+        dns_records = self._resolve_dns(host)
+        dns_features = self._extract_dns_features(host, dns_records)
+        domain_features = self._extract_domain_features(f'http://{host}')
+        return domain_features, dns_features
+
+    def _extract_all_features(self, url, host_features=None):
+        with TRACER.span('detect', url=url) as span:
+            features = self._collect_features(url, host_features)
+        if span is not None and TRACER.attach_to_results:
+            # 各阶段耗时随特征一起保存在检测结果中
+            features['stage_timings'] = span.timings()
         return features
 
-    def extract_all_features(self, url):
-        """提取所有特征（包含子页面特征）"""
+    def _collect_features(self, url, host_features=None):
         features = {'url': url}
+        host = urlparse(url).netloc
+        
+        # 域名（词法、WHOIS、品牌相似度）与DNS特征只与主机有关
+        if host_features is None:
+            host_features = self.extract_host_features(host)
+        domain_features, dns_features = host_features
+        
+        # 主页面只请求一次，各维度共享同一份响应（遵守主机并发、速率限制与退避）
+        # 等待名额不超过host_slot_timeout秒，主机长时间退避时不占用检测线程，由调用方稍后重试
+        with HOST_LIMITER.slot(host, timeout=self.host_slot_timeout) as acquired:
+            if not acquired:
+                raise self._host_busy_error(host)
+            with METRICS.time_stage('fetch'):
+                page = self._fetch_page(url)
+            HOST_LIMITER.report_page(host, page)
+        if page.error:
+            METRICS.stage_error('fetch')
+        
+        # 整个检测过程使用同一份关键词快照，避免后台刷新导致主页面与子页面统计口径不一致
+        matcher = self.keyword_matcher
         
-        # 提取各维度特征
-        domain_features = self._extract_domain_features(url)
-        content_features = self._extract_content_features(url)
-        network_features = self._extract_network_features(url)
-        subpage_features = self._extract_subpage_features(url)  # 添加子页面特征
+        # 提取页面级特征
+        content_features = self._extract_content_features(url, page, matcher=matcher)
+        http_features = self._extract_http_features(url, page)
+        with METRICS.time_stage('subpages'):
+            subpage_features = self._extract_subpage_features(url, page, matcher)  # 添加子页面特征
         
         # 合并所有特征
         features.update(domain_features)
         features.update(content_features)
-        features.update(network_features)
+        features.update(dns_features)
+        features.update(http_features)
         features.update(subpage_features)  # 添加子页面特征
         
         return features
+
+    def _host_busy_error(self, host):
+        return HostBusyError(
+            f"主机 {host} 在{self.host_slot_timeout}秒内没有空闲的请求名额"
+            f"（退避剩余 {HOST_LIMITER.backoff_remaining(host):.0f} 秒）"
+        )
+
+    def _fetch_page(self, url, timeout=None):
+        """请求页面一次，返回可在各特征提取器之间共享的PageFetch"""
+        start_time = time.time()
+        try:
+            response = self.session.get(url, timeout=timeout or self.timeout)
+            return PageFetch.from_response(url, response, round(time.time() - start_time, 2))
+        except Exception as e:
+            return PageFetch(url, error=e)
+
+    @staticmethod
+    def _file_mtime(path):
+        """返回文件修改时间，文件不存在时返回None"""
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    @property
+    def blacklisted_ips(self):
+        return self.blacklist_store.ips
+
+    @property
+    def blacklisted_domains(self):
+        return self.blacklist_store.domains
+
+    def refresh_reference_data(self):
+        """重新加载发生变化的模型文件，返回是否有更新
+
+        常驻运行时每轮检测前调用，文件未变化时不做任何加载；黑名单由BlacklistStore增量同步
+        """
+        model_mtime = self._file_mtime('website_detection_model.pkl')
+        changed = False
+        if model_mtime != self._model_mtime:
+            self.model = self._load_model()
+            logger.info("检测模型已重新加载")
+            changed = True
+        return changed
+
     def _load_model(self):
         """加载预训练的机器学习模型"""
         model_path = 'website_detection_model.pkl'
+        self._model_mtime = self._file_mtime(model_path)
         if os.path.exists(model_path):
             try:
                 return joblib.load(model_path)
@@ -606,22 +2760,6 @@ class WebsiteDetector:
                 logger.warning(f"模型加载失败: {e}")
         return None
     
-    def _load_blacklists(self):
-        """加载黑名单数据"""
-        try:
-            # 加载已知恶意IP列表
-            if os.path.exists('blacklist_ips.txt'):
-                with open('blacklist_ips.txt', 'r') as f:
-                    self.blacklisted_ips = {line.strip() for line in f if line.strip()}
-            
-            # 加载已知恶意域名列表
-            if os.path.exists('blacklist_domains.txt'):
-                with open('blacklist_domains.txt', 'r') as f:
-                    self.blacklisted_domains = {line.strip() for line in f if line.strip()}
-                    
-        except Exception as e:
-            logger.warning(f"加载黑名单失败: {e}")
-    
     def _detect_homograph_attacks(self, domain):
         """检测同形异义字符攻击"""
         homograph_chars = {
@@ -655,6 +2793,12 @@ class WebsiteDetector:
         
         return previous_row[-1]
     
+    @METRICS.timed('whois')
+    def _lookup_whois(self, domain):
+        """查询WHOIS信息，返回包含注册日期、到期日期、注册商的字典（按注册域名缓存）"""
+        return get_whois_cache().lookup(get_registered_domain(domain))
+
+    @TRACER.traced('domain')
     def _extract_domain_features(self, url):
         """提取域名特征"""
         features = {}
@@ -685,16 +2829,11 @@ class WebsiteDetector:
             entropy = round( -sum((count/len(domain)) * math.log2(count/len(domain)) for count in char_counts.values()), 2)
             features['entropy'] = entropy
             
-            # 黑名单检测
-            features['in_blacklist'] = 1 if domain in self.blacklisted_domains else 0
+            # 黑名单检测（含上级域名与通配符匹配）
+            features['in_blacklist'] = 1 if self.blacklist_store.match_domain(domain) else 0
             
             # 品牌钓鱼检测
-            brand_similarity = 0
-            domain_lower = domain.lower()
-            for brand in self.brand_keywords:
-                distance = self._calculate_levenshtein_distance(domain_lower, brand)
-                similarity = max(0, 1 - distance / max(len(domain_lower), len(brand)))
-                brand_similarity = max(brand_similarity, similarity)
+            brand_similarity = self.brand_index.best_similarity(domain)
             features['brand_similarity'] =round( brand_similarity , 2)
             features['potential_phishing'] = 1 if brand_similarity > 0.7 else 0
             
@@ -708,11 +2847,11 @@ class WebsiteDetector:
             ]
             features['suspicious_combo'] = sum(1 for combo in suspicious_combinations if combo in domain.lower())
             
-            # WHOIS信息
+            # WHOIS信息（按注册域名缓存）
             try:
-                domain_info = whois.whois(domain)
-                if domain_info.creation_date:
-                    creation_date = domain_info.creation_date
+                domain_info = self._lookup_whois(domain)
+                if domain_info.get('creation_date'):
+                    creation_date = domain_info['creation_date']
                     if isinstance(creation_date, list):
                         creation_date = creation_date[0]
                     days_since_creation = (datetime.datetime.now() - creation_date).days
@@ -724,8 +2863,8 @@ class WebsiteDetector:
                     features['is_new_domain'] = 1
                     features['is_very_new_domain'] = 1
                     
-                if domain_info.expiration_date:
-                    expiration_date = domain_info.expiration_date
+                if domain_info.get('expiration_date'):
+                    expiration_date = domain_info['expiration_date']
                     if isinstance(expiration_date, list):
                         expiration_date = expiration_date[0]
                     days_to_expire = (expiration_date - datetime.datetime.now()).days
@@ -736,7 +2875,7 @@ class WebsiteDetector:
                     features['short_registration'] = 1
                     
                 # 注册商信息
-                registrar = str(domain_info.registrar).lower() if domain_info.registrar else ''
+                registrar = str(domain_info['registrar']).lower() if domain_info.get('registrar') else ''
                 suspicious_registrars = ['namecheap', 'godaddy', 'publicdomainregistry']
                 features['suspicious_registrar'] = 1 if any(r in registrar for r in suspicious_registrars) else 0
                     
@@ -753,16 +2892,24 @@ class WebsiteDetector:
             
         return features
     
-    def _extract_content_features(self, url):
-        """提取内容特征"""
+    @TRACER.traced('content')
+    def _extract_content_features(self, url, page=None, certificate=None, matcher=None):
+        """提取内容特征
+
+        certificate为已获取的服务器证书（获取失败时为异常对象），为None时在此建立TLS连接获取
+        """
         features = {}
+        matcher = matcher or self.keyword_matcher
         try:
-            response = self.session.get(url, timeout=self.timeout)
-            soup = BeautifulSoup(response.content, 'html.parser')
+            if page is None:
+                page = self._fetch_page(url)
+            if page.error:
+                raise page.error
+            soup = page.soup
             
             # 基础内容特征
-            features['content_length'] = len(response.content)
-            features['text_length'] = len(soup.get_text())
+            features['content_length'] = len(page.content)
+            features['text_length'] = len(page.text)
             features['image_count'] = len(soup.find_all('img'))
             features['link_count'] = len(soup.find_all('a'))
             features['form_count'] = len(soup.find_all('form'))
@@ -770,10 +2917,9 @@ class WebsiteDetector:
                                             if a['href'].startswith('http') and urlparse(url).netloc not in a['href']])
             
             # 敏感关键词检测 - 分类统计
-            text_content = soup.get_text().lower()
+            text_content = page.text.lower()
             total_sensitive = 0
-            for category, keywords in self.sensitive_keywords.items():
-                category_count = sum(1 for keyword in keywords if keyword.lower() in text_content)
+            for category, category_count in matcher.count(text_content).items():
                 features[f'sensitive_{category}'] = category_count
                 total_sensitive += category_count
             
@@ -812,10 +2958,10 @@ class WebsiteDetector:
             features['suspicious_scripts'] = suspicious_scripts
             
             # 重定向检测
-            if response.history:
-                features['redirect_count'] = len(response.history)
-                features['final_url'] = response.url
-                features['domain_changed'] = 1 if urlparse(url).netloc != urlparse(response.url).netloc else 0
+            if page.history:
+                features['redirect_count'] = len(page.history)
+                features['final_url'] = page.final_url
+                features['domain_changed'] = 1 if urlparse(url).netloc != urlparse(page.final_url).netloc else 0
             else:
                 features['redirect_count'] = 0
                 features['final_url'] = url
@@ -823,37 +2969,13 @@ class WebsiteDetector:
             
             # SSL证书信息 - 增强版
             try:
-                parsed = urlparse(url)
-                context = ssl.create_default_context()
-                with socket.create_connection((parsed.netloc, 443), timeout=5) as sock:
-                    with context.wrap_socket(sock, server_hostname=parsed.netloc) as ssock:
-                        cert = ssock.getpeercert()
-                        features['has_ssl'] = 1
-                        features['ssl_valid'] = 1 if cert else 0
-                        
-                        if cert:
-                            # 检查证书颁发者
-                            issuer = dict(x[0] for x in cert['issuer'])
-                            ca_name = issuer.get('organizationName', '')
-                            features['trusted_ca'] = 1 if any(ca in ca_name for ca in self.trusted_cas) else 0
-                            
-                            # 检查证书有效期
-                            not_before = datetime.datetime.strptime(cert['notBefore'], '%b %d %H:%M:%S %Y %Z')
-                            not_after = datetime.datetime.strptime(cert['notAfter'], '%b %d %H:%M:%S %Y %Z')
-                            features['cert_valid_days'] = (not_after - datetime.datetime.now()).days
-                            features['cert_too_new'] = 1 if (datetime.datetime.now() - not_before).days < 7 else 0
-                            
-                            # 域名匹配检查
-                            cn = None
-                            for item in cert['subject']:
-                                for key, value in item:
-                                    if key == 'commonName':
-                                        cn = value
-                                        break
-                            
-                            features['ssl_domain_match'] = 1 if cn and parsed.netloc in cn else 0
-                            features['wildcard_cert'] = 1 if cn and '*' in cn else 0
-                            
+                host = urlparse(url).netloc
+                if certificate is None:
+                    certificate = self._get_peer_certificate(host)
+                if isinstance(certificate, Exception):
+                    raise certificate
+                features.update(self._ssl_features(host, certificate))
+                
             except Exception as e:
                 features['has_ssl'] = 0
                 features['ssl_valid'] = 0
@@ -878,32 +3000,91 @@ class WebsiteDetector:
                 'cert_valid_days': -1, 'cert_too_new': 0, 'ssl_domain_match': 0,
                 'wildcard_cert': 0
             })
-            for category in self.sensitive_keywords.keys():
+            for category in matcher.categories:
                 features[f'sensitive_{category}'] = 0
             
         return features
     
-    def _extract_network_features(self, url):
-        """提取网络特征"""
+    @METRICS.timed('tls')
+    def _get_peer_certificate(self, host):
+        """建立TLS连接并返回服务器证书，证书校验失败时抛出异常（同一主机的并发请求共享一次连接）"""
+        certificate, _ = _certificate_flight.do(host, self._fetch_peer_certificate, host)
+        return certificate
+
+    def _fetch_peer_certificate(self, host):
+        context = ssl.create_default_context()
+        address = get_dns_cache().cached_ip(host) or host
+        with socket.create_connection((address, 443), timeout=5) as sock:
+            with context.wrap_socket(sock, server_hostname=host) as ssock:
+                return ssock.getpeercert()
+
+    def _ssl_features(self, host, cert):
+        """根据服务器证书计算SSL特征"""
         features = {}
-        try:
-            parsed = urlparse(url)
-            domain = parsed.netloc
+        features['has_ssl'] = 1
+        features['ssl_valid'] = 1 if cert else 0
+        
+        if cert:
+            # 检查证书颁发者
+            issuer = dict(x[0] for x in cert['issuer'])
+            ca_name = issuer.get('organizationName', '')
+            features['trusted_ca'] = 1 if any(ca in ca_name for ca in self.trusted_cas) else 0
+            
+            # 检查证书有效期
+            not_before = datetime.datetime.strptime(cert['notBefore'], '%b %d %H:%M:%S %Y %Z')
+            not_after = datetime.datetime.strptime(cert['notAfter'], '%b %d %H:%M:%S %Y %Z')
+            features['cert_valid_days'] = (not_after - datetime.datetime.now()).days
+            features['cert_too_new'] = 1 if (datetime.datetime.now() - not_before).days < 7 else 0
             
+            # 域名匹配检查
+            cn = None
+            for item in cert['subject']:
+                for key, value in item:
+                    if key == 'commonName':
+                        cn = value
+                        break
+            
+            features['ssl_domain_match'] = 1 if cn and host in cn else 0
+            features['wildcard_cert'] = 1 if cn and '*' in cn else 0
+        return features
+
+    def _resolve_dns(self, domain):
+        """并发查询域名的A、MX、TXT记录（共享缓存），返回 {记录类型: 应答或查询异常}"""
+        with METRICS.time_stage('dns'):
+            dns_records = get_dns_cache().resolve_records(domain)
+        if isinstance(dns_records.get('A'), Exception):
+            METRICS.stage_error('dns')
+        return dns_records
+
+    def _extract_network_features(self, url, page=None, dns_records=None):
+        """提取网络特征（DNS特征与HTTP响应特征）
+
+        dns_records为_resolve_dns的查询结果，为None时在此查询
+        """
+        features = self._extract_dns_features(urlparse(url).netloc, dns_records)
+        features.update(self._extract_http_features(url, page))
+        return features
+
+    def _extract_dns_features(self, host, dns_records=None):
+        """提取DNS特征（A/MX/TXT记录与IP黑名单），只与主机有关"""
+        features = {}
+        try:
             # DNS解析 - 增强版
+            if dns_records is None:
+                dns_records = self._resolve_dns(host)
             try:
                 # A记录
-                answers = dns.resolver.resolve(domain, 'A')
+                answers = _dns_answer(dns_records, 'A')
                 features['dns_resolved'] = 1
                 features['ip_count'] = len(answers)
                 features['first_ip'] = str(answers[0])
                 
-                # 黑名单IP检查
-                features['blacklisted_ip'] = 1 if features['first_ip'] in self.blacklisted_ips else 0
+                # 黑名单IP检查（所有解析到的IP，含CIDR网段匹配）
+                features['blacklisted_ip'] = 1 if any(self.blacklist_store.match_ip(str(answer)) for answer in answers) else 0
                 
                 # MX记录
                 try:
-                    mx_answers = dns.resolver.resolve(domain, 'MX')
+                    mx_answers = _dns_answer(dns_records, 'MX')
                     features['has_mx'] = 1
                     features['mx_count'] = len(mx_answers)
                 except:
@@ -912,7 +3093,7 @@ class WebsiteDetector:
                 
                 # TXT记录（SPF检查）
                 try:
-                    txt_answers = dns.resolver.resolve(domain, 'TXT')
+                    txt_answers = _dns_answer(dns_records, 'TXT')
                     spf_records = [str(record) for record in txt_answers if 'spf' in str(record).lower()]
                     features['has_spf'] = 1 if spf_records else 0
                 except:
@@ -926,18 +3107,30 @@ class WebsiteDetector:
                 features['mx_count'] = 0
                 features['has_spf'] = 0
                 features['blacklisted_ip'] = 0
+                
+        except Exception as e:
+            logger.error(f"网络特征提取失败 {host}: {e}")
             
-            # 响应时间分析
-            start_time = time.time()
+        return features
+
+    @TRACER.traced('http')
+    def _extract_http_features(self, url, page=None):
+        """提取主页面HTTP响应特征（响应时间、状态码、服务器信息与安全头）"""
+        features = {}
+        try:
+            # 响应时间分析（复用主页面请求，不再单独发送HEAD请求）
             try:
-                response = self.session.head(url, timeout=5)
-                features['response_time'] =round(time.time() - start_time, 2)
-                features['http_status'] = response.status_code
+                if page is None:
+                    page = self._fetch_page(url)
+                if page.error:
+                    raise page.error
+                features['response_time'] = page.elapsed
+                features['http_status'] = page.status_code
                 features['web_accessible'] = 1
                 
                 # 服务器信息
-                features['server_header'] = response.headers.get('Server', '')
-                features['powered_by'] = response.headers.get('X-Powered-By', '')
+                features['server_header'] = page.headers.get('Server', '')
+                features['powered_by'] = page.headers.get('X-Powered-By', '')
                 
                 # 安全头检查
                 security_headers = {
@@ -949,7 +3142,7 @@ class WebsiteDetector:
                 }
                 
                 for header, feature_name in security_headers.items():
-                    features[feature_name] = 1 if header in response.headers else 0
+                    features[feature_name] = 1 if header in page.headers else 0
                 
             except:
                 features['response_time'] = -1
@@ -974,118 +3167,37 @@ class WebsiteDetector:
     def predict_risk(self, features):
         """预测风险等级 - 增强版评分算法"""
         if not self.model:
-            # 增强的基于规则风险评分
-            risk_score = 0
-            # 添加子页面风险因子
-            if features.get('has_sensitive_subpage', 0) == 1:
-                risk_score += 30  # 包含高敏感子页面
-            if features.get('suspicious_subpages', 0) > 0:
-                risk_score += features['suspicious_subpages'] * 10  # 每个可疑子页面增加风险
-            if features.get('avg_subpage_risk', 0) > 50:
-                risk_score += 15  # 子页面平均风险较高
-            # 域名风险因子（权重增加）
-            if features.get('in_blacklist', 0) == 1:
-                risk_score += 50  # 黑名单直接高分
-            if features.get('homograph_attack', 0) == 1:
-                risk_score += 30  # 同形异义字符攻击
-            if features.get('potential_phishing', 0) == 1:
-                risk_score += 25  # 品牌钓鱼
-            if features.get('brand_similarity', 0) > 0.8:
-                risk_score += 20  # 高品牌相似度
-            if features.get('entropy', 0) > 4.0:
-                risk_score += 15  # 高熵值（随机域名）
-            if features.get('is_very_new_domain', 0) == 1:
-                risk_score += 5  # 非常新的域名
-            if features.get('short_registration', 0) == 1:
-                risk_score += 5  # 短期注册
-            if features.get('suspicious_registrar', 0) == 1:
-                risk_score += 10  # 可疑注册商
-            if features.get('suspicious_combo', 0) > 2:
-                risk_score += 15  # 可疑关键词组合
-            
-            # 内容风险因子（细化分类）
-            gambling_content = features.get('sensitive_gambling', 0)
-            fraud_content = features.get('sensitive_fraud', 0)
-            porn_content = features.get('sensitive_pornography', 0)
-            financial_fraud = features.get('sensitive_financial_fraud', 0)
-            
-            total_sensitive = gambling_content + fraud_content + porn_content + financial_fraud
-            if total_sensitive > 10:
-                risk_score += 30
-            elif total_sensitive > 5:
-                risk_score += 20
-            elif total_sensitive > 0:
-                risk_score += 10
-                
-            if features.get('sensitive_keyword_ratio', 0) > 0.1:
-                risk_score += 15
-            if features.get('has_login_form', 0) == 1 and features.get('has_ssl', 0) == 0:
-                risk_score += 25  # 登录表单无SSL
-            if features.get('suspicious_scripts', 0) > 3:
-                risk_score += 15  # 可疑脚本
-            if features.get('domain_changed', 0) == 1:
-                risk_score += 20  # 域名跳转
-                
-            # SSL证书风险因子
-            if features.get('has_ssl', 0) == 0:
-                risk_score += 15
-            if features.get('ssl_valid', 0) == 0:
-                risk_score += 20
-            if features.get('trusted_ca', 0) == 0:
-                risk_score += 10  # 非可信CA
-            if features.get('cert_too_new', 0) == 1:
-                risk_score += 10  # 证书太新
-            if features.get('cert_valid_days', 0) < 30:
-                risk_score += 10  # 证书即将过期
-                
-            # 网络风险因子
-            if features.get('blacklisted_ip', 0) == 1:
-                risk_score += 40  # 黑名单IP
-            if features.get('web_accessible', 0) == 0:
-                risk_score += 30  # 无法访问
-            if features.get('dns_resolved', 0) == 0:
-                risk_score += 25
-            if features.get('response_time', 0) > 5:
-                risk_score += 10  # 响应时间过长
-            if features.get('http_status', 0) >= 400:
-                risk_score += 15  # HTTP错误状态
-                
-            # 安全头检查（负向风险）
-            security_score = (features.get('hsts', 0) + features.get('x_frame_options', 0) + 
-                            features.get('x_content_type', 0) + features.get('x_xss_protection', 0) + 
-                            features.get('csp', 0))
-            risk_score -= security_score * 2  # 安全头减少风险
-            
-            # 信任指标（负向风险）
-            if features.get('has_contact_info', 0) == 1:
-                risk_score -= 10
-            if features.get('has_privacy_policy', 0) == 1:
-                risk_score -= 10
-            if features.get('has_mx', 0) == 1:
-                risk_score -= 5  # 有MX记录
-            if features.get('domain_age_days', 0) > 365:
-                risk_score -= 15  # 老域名
-                
-            # 风险等级判定（调整阈值）
-            risk_score = max(0, min(100, risk_score))  # 限制在0-100范围内
-            
-            if risk_score >= 70:
-                return 'HIGH', risk_score
-            elif risk_score >= 40:
-                return 'MEDIUM', risk_score
-            else:
-                return 'LOW', risk_score
+            # 增强的基于规则风险评分（规则表见RISK_RULES）
+            with METRICS.time_stage('scoring'):
+                return rule_based_risk(features)
         else:
             # 使用机器学习模型预测
-            feature_vector = self._prepare_features_for_model(features)
-            prediction = self.model.predict([feature_vector])[0]
-            probability = self.model.predict_proba([feature_vector])[0]
-            risk_score = int(probability[1] * 100) if len(probability) > 1 else 50
-            
-            if prediction == 1:
-                return 'HIGH' if risk_score > 70 else 'MEDIUM', risk_score
-            else:
-                return 'LOW', risk_score
+            return self.predict_risk_batch([features])[0]
+    
+    @METRICS.timed('scoring')
+    def predict_risk_batch(self, features_list):
+        """批量预测风险等级，返回 [(风险等级, 风险评分)]
+
+        有模型时对整批特征只调用一次predict_proba，否则使用向量化的规则评分
+        """
+        if not features_list:
+            return []
+        if not self.model:
+            return get_rule_scorer().score(features_list)
+        
+        feature_matrix = np.array([self._prepare_features_for_model(features) for features in features_list], dtype=np.float64)
+        probabilities = self.model.predict_proba(feature_matrix)
+        return [self._risk_from_probability(probability) for probability in probabilities]
+    
+    def _risk_from_probability(self, probability):
+        """由模型输出的类别概率得到风险等级与评分（预测类别即概率最大的类别）"""
+        prediction = self.model.classes_[int(np.argmax(probability))]
+        risk_score = int(probability[1] * 100) if len(probability) > 1 else 50
+        
+        if prediction == 1:
+            return 'HIGH' if risk_score > 70 else 'MEDIUM', risk_score
+        else:
+            return 'LOW', risk_score
     
     def _prepare_features_for_model(self, features):
         """准备机器学习模型需要的特征向量"""
@@ -1102,16 +3214,593 @@ class WebsiteDetector:
         
         return [features.get(key, 0) for key in feature_order]
 
+# 特征名称中英文对照
+FEATURE_TRANSLATIONS = {
+        'domain_length': '域名长度',
+        'subdomain_count': '子域名数量',
+        'has_hyphen': '包含连字符',
+        'has_digits': '包含数字',
+        'suspicious_tld': '可疑顶级域名',
+        'digit_ratio': '数字比例',
+        'special_char_ratio': '特殊字符比例',
+        'consonant_ratio': '辅音比例',
+        'entropy': '熵值（随机性）',
+        'in_blacklist': '黑名单匹配',
+        'brand_similarity': '品牌相似度',
+        'potential_phishing': '疑似钓鱼',
+        'homograph_attack': '同形异义攻击',
+        'suspicious_combo': '可疑关键词组合',
+        'domain_age_days': '域名年龄（天）',
+        'is_new_domain': '新域名（30天内）',
+        'is_very_new_domain': '极新域名（7天内）',
+        'days_to_expire': '到期剩余天数',
+        'short_registration': '短期注册',
+        'suspicious_registrar': '可疑注册商',
+        'content_length': '内容长度',
+        'text_length': '文本长度',
+        'image_count': '图片数量',
+        'link_count': '链接数量',
+        'form_count': '表单数量',
+        'external_links': '外部链接数',
+        'sensitive_gambling': '赌博关键词',
+        'sensitive_fraud': '诈骗关键词',
+        'sensitive_pornography': '色情关键词',
+        'sensitive_financial_fraud': '金融诈骗关键词',
+        'sensitive_illegal_trade': '非法交易关键词',
+        'sensitive_cybercrime': '网络犯罪关键词',
+        'sensitive_违规书籍': '违规书籍关键词数量',
+        'sensitive_网站违禁词': '网站违禁词数量',
+        'sensitive_涉稳': '涉稳关键词数量',
+        'sensitive_涉黄': '涉黄关键词数量',
+        'sensitive_涉赌': '涉赌关键词数量',
+        'sensitive_涉政': '涉政关键词数量',
+        'sensitive_涉枪暴': '涉枪暴关键词数量',
+        'sensitive_涉恐涉邪': '涉恐涉邪关键词数量',
+        'sensitive_涉黑灰产': '涉黑灰产关键词数量',
+        'sensitive_涉电诈': '涉电诈关键词数量',
+        'sensitive_违规化学品': '违规化学品关键词数量',
+        'sensitive_keyword_count': '敏感词总数',
+        'sensitive_keyword_ratio': '敏感词占比',
+        'sensitive_keyword_count': '敏感词总数',
+        'sensitive_keyword_ratio': '敏感词占比',
+        'has_title': '有标题',
+        'title_length': '标题长度',
+        'has_description': '有描述',
+        'has_keywords': '有关键词',
+        'has_robots': '有robots',
+        'has_login_form': '有登录表单',
+        'has_contact_info': '有联系信息',
+        'has_privacy_policy': '有隐私政策',
+        'suspicious_images': '可疑图片',
+        'script_count': '脚本数量',
+        'suspicious_scripts': '可疑脚本',
+        'redirect_count': '重定向次数',
+        'domain_changed': '域名变更',
+        'has_ssl': '有SSL证书',
+        'ssl_valid': 'SSL有效',
+        'trusted_ca': '可信CA',
+        'cert_valid_days': '证书有效天数',
+        'cert_too_new': '证书太新',
+        'ssl_domain_match': '域名匹配',
+        'wildcard_cert': '通配符证书',
+        'dns_resolved': 'DNS解析成功',
+        'ip_count': 'IP数量',
+        'first_ip': '首个IP',
+        'blacklisted_ip': 'IP黑名单',
+        'has_mx': '有MX记录',
+        'mx_count': 'MX记录数',
+        'has_spf': '有SPF记录',
+        'web_accessible': '可访问',
+        'response_time': '响应时间',
+        'http_status': 'HTTP状态码',
+        'server_header': '服务器信息',
+        'powered_by': '技术栈',
+        'hsts': 'HSTS安全头',
+        'x_frame_options': 'X-Frame-Options',
+        'x_content_type': 'X-Content-Type-Options',
+        'x_xss_protection': 'X-XSS-Protection',
+        'csp': 'Content-Security-Policy',
+        'subpage_count': '检测子页面数量',
+        'suspicious_subpages': '可疑子页面数',
+        'avg_subpage_risk': '子页面平均风险',
+        'has_sensitive_subpage': '包含敏感子页面',
+        'subpage_keywords': '子页面中发现的关键词统计',
+        'subpage_details': '子页面详细信息',
+        'stage_timings': '阶段耗时（秒）'
+    }
+
+# 字符串类特征（保存在FeatureRecord的附加表中）
+STRING_FEATURES = ('url', 'final_url', 'first_ip', 'server_header', 'powered_by')
+
+# 数值特征的固定字段表（FeatureRecord按此顺序保存在数组中）
+NUMERIC_FEATURES = tuple(
+    key for key in FEATURE_TRANSLATIONS
+    if key not in STRING_FEATURES and key not in ('subpage_keywords', 'subpage_details', 'stage_timings')
+)
+_NUMERIC_INDEX = {key: index for index, key in enumerate(NUMERIC_FEATURES)}
+# 超出该范围的整数无法用双精度精确表示（NaN比较结果也为False），保存在附加表中
+_EXACT_FLOAT_LIMIT = 2 ** 53
+
+# 子页面详情的固定字段
+SUBPAGE_DETAIL_FIELDS = ('url', 'risk_score', 'keyword_count', 'has_login_form', 'script_count')
+
+# 特征键顺序元组的共享表，字段相同的记录共用同一个元组
+_feature_key_orders = {}
+
+
+def _shared_key_order(keys):
+    keys = tuple(keys)
+    return _feature_key_orders.setdefault(keys, keys)
+
+
+class FeatureRecord(Mapping):
+    """紧凑的特征记录（只读映射）
+
+    数值特征按NUMERIC_FEATURES固定字段保存在双精度数组中（缺失为NaN，整数字段另有
+    位标记以还原类型），字符串与不在字段表中的特征放在附加表中，子页面详情保存为元组。
+    中文特征视图只在序列化时通过translated()生成，不随记录常驻内存。
+    """
+
+    __slots__ = ('_keys', '_values', '_int_mask', '_extra', '_subpages')
+
+    def __init__(self, features):
+        self._keys = _shared_key_order(features.keys())
+        self._values = array('d', [math.nan]) * len(NUMERIC_FEATURES)
+        self._int_mask = 0
+        self._extra = None
+        self._subpages = None
+        for key, value in features.items():
+            index = _NUMERIC_INDEX.get(key)
+            if index is not None and type(value) in (int, float) and abs(value) < _EXACT_FLOAT_LIMIT:
+                self._values[index] = value
+                if type(value) is int:
+                    self._int_mask |= 1 << index
+            elif key == 'subpage_details' and self._compact_subpages(value):
+                continue
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[key] = value
+
+    def _compact_subpages(self, details):
+        """子页面详情字段固定时保存为元组，返回是否成功"""
+        if not isinstance(details, list) or any(
+                not isinstance(detail, dict) or tuple(detail) != SUBPAGE_DETAIL_FIELDS for detail in details):
+            return False
+        self._subpages = tuple(tuple(detail.values()) for detail in details)
+        return True
+
+    def __getitem__(self, key):
+        index = _NUMERIC_INDEX.get(key)
+        if index is not None:
+            value = self._values[index]
+            if not math.isnan(value):
+                return int(value) if self._int_mask >> index & 1 else value
+        if key == 'subpage_details' and self._subpages is not None:
+            return [dict(zip(SUBPAGE_DETAIL_FIELDS, detail)) for detail in self._subpages]
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def to_dict(self):
+        """还原为普通的英文特征字典"""
+        return {key: self[key] for key in self._keys}
+
+    def display_value(self, key, default=None):
+        """按中文视图的规则取值：数值-1、None与空字符串视为无效，返回default"""
+        value = self.get(key)
+        if key in ('url', 'final_url'):
+            return value
+        if isinstance(value, (int, float)):
+            return value if value != -1 else default
+        return value if value not in [None, '', -1] else default
+
+    def translated(self):
+        """生成中文特征视图（与原_translate_features输出一致）"""
+        translated = {}
+        for key in self._keys:
+            if key in FEATURE_TRANSLATIONS:
+                value = self.display_value(key, default=self)
+                if value is not self:
+                    translated[FEATURE_TRANSLATIONS[key]] = value
+            elif key == 'url':
+                translated['网址'] = self[key]
+            elif key == 'final_url':
+                translated['最终网址'] = self[key]
+        return translated
+
+
+# 风险等级中文映射
+RISK_LEVEL_NAMES = {
+    'HIGH': '高风险',
+    'MEDIUM': '中风险',
+    'LOW': '低风险',
+    'ERROR': '检测失败'
+}
+
+
+class DetectionResult(Mapping):
+    """单个网站的检测结果（只读映射，键与原结果字典一致）
+
+    特征以FeatureRecord保存，'详细特征'与'英文原文'在访问时才生成；
+    检测失败的结果风险等级为ERROR、特征为空，并带有'错误信息'
+    """
+
+    __slots__ = ('url', 'risk_level', 'risk_score', 'risk_description', 'detection_time', 'timestamp', 'features',
+                 'error')
+
+    KEYS = ('网址', '风险等级', '风险评分', '风险描述', '检测时间', '详细特征', '英文原文')
+    ERROR_KEYS = KEYS + ('错误信息',)
+
+    def __init__(self, url, risk_level, risk_score, risk_description, features, error=None):
+        now = datetime.datetime.now()
+        self.error = error
+        self.url = url
+        self.risk_level = risk_level
+        self.risk_score = risk_score
+        self.risk_description = risk_description
+        self.detection_time = now.strftime('%Y-%m-%d %H:%M:%S')
+        self.timestamp = now.isoformat()
+        self.features = features if isinstance(features, FeatureRecord) else FeatureRecord(features)
+
+    def __getitem__(self, key):
+        if key == '网址':
+            return self.url
+        if key == '风险等级':
+            return RISK_LEVEL_NAMES.get(self.risk_level, self.risk_level)
+        if key == '风险评分':
+            return f"{self.risk_score}%"
+        if key == '风险描述':
+            return self.risk_description
+        if key == '检测时间':
+            return self.detection_time
+        if key == '详细特征':
+            return self.features.translated()
+        if key == '英文原文':
+            return {
+                'url': self.url,
+                'risk_level': self.risk_level,
+                'risk_score': self.risk_score,
+                'features': self.features,
+                'timestamp': self.timestamp
+            }
+        if key == '错误信息' and self.error is not None:
+            return self.error
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS if self.error is None else self.ERROR_KEYS)
+
+    def __len__(self):
+        return len(self.KEYS if self.error is None else self.ERROR_KEYS)
+
+    def to_dict(self):
+        """转换为可JSON序列化的普通字典"""
+        result = dict(self.items())
+        result['英文原文']['features'] = self.features.to_dict()
+        return result
+
+
+def result_json_default(obj):
+    """json.dump的default参数：逐个展开检测结果，避免一次性生成全部字典"""
+    if isinstance(obj, (DetectionResult, FeatureRecord)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def normalize_url(url):
+    """规范化URL作为缓存键：补全协议，协议与主机名小写，去掉默认端口与片段，空路径补为/"""
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')) and '://' not in url:
+        url = 'http://' + url
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or (scheme, port) in (('http', 80), ('https', 443)) else f'{host}:{port}'
+    path = parsed.path or '/'
+    return f"{scheme}://{netloc}{path}" + (f"?{parsed.query}" if parsed.query else '')
+
+
+class DetectionResultCache:
+    """检测结果缓存（LRU + TTL）
+
+    以规范化URL为键，条目数不超过max_entries，结果按JSON序列化长度估算的总字节数不超过max_bytes，
+    超出时淘汰最久未使用的结果。结果保存ttl秒；网站无法访问或域名无法解析的结果多为临时故障，
+    只保存failure_ttl秒（为0时不缓存）。
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=3600, failure_ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # 键 -> (结果, 估算字节数, 缓存时间, 有效期)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _approx_size(result):
+        return len(json.dumps(result, ensure_ascii=False, default=result_json_default).encode('utf-8'))
+
+    def get(self, key):
+        """返回 (结果, 缓存时间)，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] + entry[3] <= time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[2]
+
+    @staticmethod
+    def _is_failure(result):
+        """网站无法访问或域名无法解析的检测结果"""
+        features = result.features if isinstance(result, DetectionResult) else result.get('英文原文', {}).get('features', {})
+        return features.get('web_accessible') == 0 or features.get('dns_resolved') == 0
+
+    def put(self, key, result):
+        ttl = self.failure_ttl if self._is_failure(result) else self.ttl
+        if ttl <= 0:
+            return
+        size = self._approx_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.time(), ttl)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        size = self._entries.pop(key)[1]
+        self.total_bytes -= size
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'evictions': self.evictions
+            }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """获取进程内共享的检测结果缓存"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = DetectionResultCache(
+                max_entries=CONFIG.get('result_cache_size', 10000),
+                max_bytes=CONFIG.get('result_cache_max_bytes', 256 * 1024 * 1024),
+                ttl=CONFIG.get('result_cache_ttl', 3600),
+                failure_ttl=CONFIG.get('result_cache_failure_ttl', 60)
+            )
+        return _result_cache
+
+
+def _cache_stats():
+    """已创建的各缓存的命中统计 {缓存名: stats}"""
+    caches = {'whois': _whois_cache, 'dns': _dns_cache, 'result': _result_cache}
+    return {name: cache.stats() for name, cache in caches.items() if cache is not None}
+
+
+def _register_detector_metrics():
+    """注册缓存命中、请求合并、主机限流与线程池队列等已有统计的指标"""
+    METRICS.describe('detector_host_features_total', 'counter', '批量检测中主机级特征的计算与复用次数')
+    for name, field, kind, help_text in (
+        ('detector_cache_hits_total', 'hits', 'counter', '缓存命中次数'),
+        ('detector_cache_misses_total', 'misses', 'counter', '缓存未命中次数'),
+        ('detector_cache_hit_ratio', 'hit_rate', 'gauge', '缓存命中率'),
+        ('detector_cache_entries', 'entries', 'gauge', '缓存条目数'),
+    ):
+        METRICS.register(name, kind, help_text, lambda field=field: [
+            ({'cache': cache}, stats[field]) for cache, stats in _cache_stats().items()
+        ])
+
+    flights = {'detection': _detection_flight, 'certificate': _certificate_flight}
+
+    def flight_stats():
+        stats = {name: flight.stats() for name, flight in flights.items()}
+        if _whois_cache is not None:
+            stats['whois'] = _whois_cache._flight.stats()
+        if _dns_cache is not None:
+            stats['dns'] = _dns_cache._flight.stats()
+        return stats
+
+    METRICS.register('detector_singleflight_calls_total', 'counter', '合并并发调用后实际执行的次数',
+                     lambda: [({'flight': name}, stats['calls']) for name, stats in flight_stats().items()])
+    METRICS.register('detector_singleflight_shared_total', 'counter', '等待并共享其他调用结果的次数',
+                     lambda: [({'flight': name}, stats['shared']) for name, stats in flight_stats().items()])
+    METRICS.register('detector_host_limiter_hosts', 'gauge', '正在请求与处于退避中的主机数',
+                     lambda: [({'state': state}, count) for state, count in HOST_LIMITER.stats().items()])
+    def executor_queue_depths():
+        executors = {'dns': _dns_cache._executor if _dns_cache else None, 'subpage': _subpage_executor}
+        return [({'executor': name}, executor._work_queue.qsize())
+                for name, executor in executors.items() if executor is not None]
+
+    METRICS.register('detector_executor_queue_depth', 'gauge', '线程池中等待执行的任务数', executor_queue_depths)
+
+
+_register_detector_metrics()
+
+
+# CSV结果文件的字段
+CSV_RESULT_FIELDS = ('网址', '风险等级', '风险评分', '检测时间')
+
+
+class ResultSink:
+    """检测结果输出端：结果逐条写入缓冲区，缓冲满或距上次写出超过flush_interval秒时写出
+
+    子类实现_write_batch(results)；缓冲区最多保存buffer_size条结果，内存占用与检测总数无关
+    """
+
+    def __init__(self, buffer_size=None, flush_interval=None):
+        self.buffer_size = buffer_size or CONFIG.get('sink_buffer_size', 100)
+        self.flush_interval = flush_interval if flush_interval is not None else CONFIG.get('sink_flush_interval', 5.0)
+        self.written = 0
+        self._buffer = []
+        self._last_flush = time.time()
+
+    def write(self, result):
+        self._buffer.append(result)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """距上次写出超过flush_interval秒时写出缓冲区"""
+        if self._buffer and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        buffer, self._buffer = self._buffer, []
+        self._last_flush = time.time()
+        if buffer:
+            self._write_batch(buffer)
+            self.written += len(buffer)
+
+    def _write_batch(self, results):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JSONLResultSink(ResultSink):
+    """JSON Lines结果文件，每行一个完整检测结果"""
+
+    def __init__(self, path, buffer_size=None, flush_interval=None):
+        super().__init__(buffer_size, flush_interval)
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def _write_batch(self, results):
+        self._file.writelines(
+            json.dumps(result, ensure_ascii=False, default=result_json_default) + '\n' for result in results
+        )
+        self._file.flush()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+
+class CSVResultSink(ResultSink):
+    """CSV简要结果文件（网址、风险等级、风险评分、检测时间）"""
+
+    def __init__(self, path, buffer_size=None, flush_interval=None):
+        super().__init__(buffer_size, flush_interval)
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(CSV_RESULT_FIELDS)
+
+    def _write_batch(self, results):
+        self._writer.writerows([result.get(field, '') for field in CSV_RESULT_FIELDS] for result in results)
+        self._file.flush()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+
+class MySQLResultSink(ResultSink):
+    """检测结果表，缓冲区每次写出为一批upsert；写入失败只记录日志，不中断检测"""
+
+    def __init__(self, buffer_size=None, flush_interval=None):
+        super().__init__(buffer_size or CONFIG.get('db_batch_size', 500), flush_interval)
+        self.failed = 0
+
+    def _write_batch(self, results):
+        try:
+            save_results_to_database(results)
+        except Exception as e:
+            self.failed += len(results)
+            logger.error(f"保存{len(results)}条检测结果到数据库时出错: {e}")
+
+
 class BatchDetector:
     """批量检测器"""
     
-    def __init__(self, max_workers=10):
-        self.detector = WebsiteDetector()
+    def __init__(self, max_workers=10, keep_results=None, detector=None):
+        self.detector = detector or WebsiteDetector()
         self.max_workers = max_workers
+        # keep_results为False时检测结果只写入输出端，不在内存中保留（统计只保留各风险等级数量）
+        self.keep_results = CONFIG.get('keep_results', True) if keep_results is None else keep_results
         self.results = []
+        self.risk_counts = {}
+        # 风险评分按微批次进行：累积score_batch_size个结果或等待超过score_batch_interval秒即评分一次
+        self.score_batch_size = CONFIG.get('score_batch_size', 64)
+        self.score_batch_interval = CONFIG.get('score_batch_interval', 1.0)
+        # 同时提交到线程池的最大URL数（为0时取线程数的4倍）
+        self.max_in_flight = CONFIG.get('max_in_flight') or max_workers * 4
+        # 同一主机同时检测的最大URL数与调度预读的URL数
+        self.max_detections_per_host = CONFIG.get('per_host_detections', 2)
+        self.schedule_lookahead = CONFIG.get('schedule_lookahead', 1000)
+        # 主机繁忙（退避中）而未能开始检测的URL重新排队的次数上限，超过后记为检测失败
+        self.host_busy_retries = CONFIG.get('host_busy_retries', 3)
     
     def detect_single(self, url):
         """检测单个URL"""
+        return self._score_batch([self._extract_features(url)])[0]
+    
+    def _extract_host_features(self, host):
+        """计算主机级特征，供HostFeatureCache调用"""
+        return self.detector.extract_host_features(host)
+
+    def _extract_features(self, url, host_cache=None):
+        """提取单个URL的特征，返回 (URL, 特征, 异常)；传入host_cache时同一主机的主机级特征只计算一次"""
         try:
             # logger.info(f"开始检测: {url}")
             color_printer.print(f"🚀 开始检测 {url} ", 'cyan', bold=True)
@@ -1120,61 +3809,91 @@ class BatchDetector:
                 url = 'http://' + url
             
             # 提取特征
-            features = self.detector.extract_all_features(url)
-            
-            # 预测风险
-            risk_level, risk_score = self.detector.predict_risk(features)
-            
-            # 风险等级中文映射
-            risk_level_cn = {
-                'HIGH': '高风险',
-                'MEDIUM': '中风险', 
-                'LOW': '低风险',
-                'ERROR': '检测失败'
-            }.get(risk_level, risk_level)
-            
-            # 生成中文风险描述
-            risk_description = self._generate_risk_description(features, risk_level, risk_score)
-            
-            result = {
-                '网址': url,
-                '风险等级': risk_level_cn,
-                '风险评分': f"{risk_score}%",
-                '风险描述': risk_description,
-                '检测时间': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                '详细特征': self._translate_features(features),
-                '英文原文': {
-                    'url': url,
-                    'risk_level': risk_level,
-                    'risk_score': risk_score,
-                    'features': features,
-                    'timestamp': datetime.datetime.now().isoformat()
-                }
-            }
-            
-            # 根据风险等级设置不同颜色
-            if risk_level_cn == "高风险":
-                color = 'red'
-            elif risk_level_cn == "中风险":
-                color = 'yellow'
-            else:  # 低风险
-                color = 'blue'
-                
-            color_printer.print(f"检测完成: {url} - 风险等级: {risk_level_cn} ({risk_score}%) - 风险描述： {risk_description} \n", color, bold=True)
-            return result
-            
+            host_features = host_cache.get(urlparse(url).netloc) if host_cache is not None else None
+            return url, self.detector.extract_all_features(url, host_features), None
+        except Exception as e:
+            return url, None, e
+    
+    def _score_batch(self, extracted):
+        """对一批 (URL, 特征, 异常) 统一预测风险并构建检测结果，顺序与输入一致"""
+        scored = [(url, features) for url, features, error in extracted if error is None]
+        try:
+            # 整批只调用一次模型
+            predictions = iter(self.detector.predict_risk_batch([features for _, features in scored]))
+            batch_error = None
         except Exception as e:
+            batch_error = e
+        
+        if batch_error is not None:
+            logger.warning(f"整批风险评分失败，逐个评分: {batch_error}")
+        
+        results = []
+        for url, features, error in extracted:
+            if error is not None:
+                results.append(self._build_error_result(url, error))
+                continue
+            try:
+                if batch_error is not None:
+                    # 整批评分失败时逐个评分，只有出错的URL记为检测失败
+                    risk_level, risk_score = self.detector.predict_risk_batch([features])[0]
+                else:
+                    risk_level, risk_score = next(predictions)
+                results.append(self._build_result(url, features, risk_level, risk_score))
+            except Exception as e:
+                results.append(self._build_error_result(url, e))
+        return results
+    
+    def detect_urls(self, urls, executor=None, max_concurrency=None):
+        """提取全部特征后整批评分，返回与urls顺序一致的检测结果
+
+        未传入executor时依次提取；传入时在该（可由多个调用方共享的）线程池中并发提取，
+        本次调用同时提交的URL不超过max_concurrency个
+        """
+        # 同一主机的域名、DNS特征只计算一次
+        host_cache = HostFeatureCache(self._extract_host_features)
+        if executor is None:
+            return self._score_batch([self._extract_features(url, host_cache) for url in urls])
+        
+        max_concurrency = max_concurrency or len(urls) or 1
+        extracted = [None] * len(urls)
+        pending = {}
+        next_index = 0
+        while next_index < len(urls) or pending:
+            while next_index < len(urls) and len(pending) < max_concurrency:
+                pending[executor.submit(self._extract_features, urls[next_index], host_cache)] = next_index
+                next_index += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                extracted[pending.pop(future)] = future.result()
+        return self._score_batch(extracted)
+    
+    def _build_result(self, url, features, risk_level, risk_score):
+        """根据特征和风险预测结果构建检测结果"""
+        result = self._make_result(url, features, risk_level, risk_score)
+        risk_level_cn = result['风险等级']
+        risk_description = result.risk_description
+        
+        # 根据风险等级设置不同颜色
+        if risk_level_cn == "高风险":
+            color = 'red'
+        elif risk_level_cn == "中风险":
+            color = 'yellow'
+        else:  # 低风险
+            color = 'blue'
             
-            color_printer.print(f"🚨 检测失败 {url}: {e}", 'red', bold=True)
-            return {
-                '网址': url,
-                '风险等级': '检测失败',
-                '风险评分': '0%',
-                '风险描述': f'检测过程中发生错误: {str(e)}',
-                '检测时间': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                '详细特征': {},
-                '错误信息': str(e)
-            }
+        color_printer.print(f"检测完成: {url} - 风险等级: {risk_level_cn} ({risk_score}%) - 风险描述： {risk_description} \n", color, bold=True)
+        return result
+    
+    def _make_result(self, url, features, risk_level, risk_score):
+        """构建检测结果（不输出日志）"""
+        # 生成中文风险描述
+        risk_description = self._generate_risk_description(features, risk_level, risk_score)
+        return DetectionResult(url, risk_level, risk_score, risk_description, features)
+    
+    def _build_error_result(self, url, e):
+        """构建检测失败的结果"""
+        color_printer.print(f"🚨 检测失败 {url}: {e}", 'red', bold=True)
+        return DetectionResult(url, 'ERROR', 0, f'检测过程中发生错误: {str(e)}', FeatureRecord({}), error=str(e))
     
     def _generate_risk_description(self, features, risk_level, risk_score):
         """生成中文风险描述"""
@@ -1260,143 +3979,145 @@ class BatchDetector:
     
     def _translate_features(self, features):
         """翻译特征名称为中文（包含子页面特征）"""
+        if isinstance(features, FeatureRecord):
+            return features.translated()
         if not isinstance(features, dict):
             return {}
-            
-        translate_map = {
-            'domain_length': '域名长度',
-            'subdomain_count': '子域名数量',
-            'has_hyphen': '包含连字符',
-            'has_digits': '包含数字',
-            'suspicious_tld': '可疑顶级域名',
-            'digit_ratio': '数字比例',
-            'special_char_ratio': '特殊字符比例',
-            'consonant_ratio': '辅音比例',
-            'entropy': '熵值（随机性）',
-            'in_blacklist': '黑名单匹配',
-            'brand_similarity': '品牌相似度',
-            'potential_phishing': '疑似钓鱼',
-            'homograph_attack': '同形异义攻击',
-            'suspicious_combo': '可疑关键词组合',
-            'domain_age_days': '域名年龄（天）',
-            'is_new_domain': '新域名（30天内）',
-            'is_very_new_domain': '极新域名（7天内）',
-            'days_to_expire': '到期剩余天数',
-            'short_registration': '短期注册',
-            'suspicious_registrar': '可疑注册商',
-            'content_length': '内容长度',
-            'text_length': '文本长度',
-            'image_count': '图片数量',
-            'link_count': '链接数量',
-            'form_count': '表单数量',
-            'external_links': '外部链接数',
-            'sensitive_gambling': '赌博关键词',
-            'sensitive_fraud': '诈骗关键词',
-            'sensitive_pornography': '色情关键词',
-            'sensitive_financial_fraud': '金融诈骗关键词',
-            'sensitive_illegal_trade': '非法交易关键词',
-            'sensitive_cybercrime': '网络犯罪关键词',
-            'sensitive_违规书籍': '违规书籍关键词数量',
-            'sensitive_网站违禁词': '网站违禁词数量',
-            'sensitive_涉稳': '涉稳关键词数量',
-            'sensitive_涉黄': '涉黄关键词数量',
-            'sensitive_涉赌': '涉赌关键词数量',
-            'sensitive_涉政': '涉政关键词数量',
-            'sensitive_涉枪暴': '涉枪暴关键词数量',
-            'sensitive_涉恐涉邪': '涉恐涉邪关键词数量',
-            'sensitive_涉黑灰产': '涉黑灰产关键词数量',
-            'sensitive_涉电诈': '涉电诈关键词数量',
-            'sensitive_违规化学品': '违规化学品关键词数量',
-            'sensitive_keyword_count': '敏感词总数',
-            'sensitive_keyword_ratio': '敏感词占比',
-            'sensitive_keyword_count': '敏感词总数',
-            'sensitive_keyword_ratio': '敏感词占比',
-            'has_title': '有标题',
-            'title_length': '标题长度',
-            'has_description': '有描述',
-            'has_keywords': '有关键词',
-            'has_robots': '有robots',
-            'has_login_form': '有登录表单',
-            'has_contact_info': '有联系信息',
-            'has_privacy_policy': '有隐私政策',
-            'suspicious_images': '可疑图片',
-            'script_count': '脚本数量',
-            'suspicious_scripts': '可疑脚本',
-            'redirect_count': '重定向次数',
-            'domain_changed': '域名变更',
-            'has_ssl': '有SSL证书',
-            'ssl_valid': 'SSL有效',
-            'trusted_ca': '可信CA',
-            'cert_valid_days': '证书有效天数',
-            'cert_too_new': '证书太新',
-            'ssl_domain_match': '域名匹配',
-            'wildcard_cert': '通配符证书',
-            'dns_resolved': 'DNS解析成功',
-            'ip_count': 'IP数量',
-            'first_ip': '首个IP',
-            'blacklisted_ip': 'IP黑名单',
-            'has_mx': '有MX记录',
-            'mx_count': 'MX记录数',
-            'has_spf': '有SPF记录',
-            'web_accessible': '可访问',
-            'response_time': '响应时间',
-            'http_status': 'HTTP状态码',
-            'server_header': '服务器信息',
-            'powered_by': '技术栈',
-            'hsts': 'HSTS安全头',
-            'x_frame_options': 'X-Frame-Options',
-            'x_content_type': 'X-Content-Type-Options',
-            'x_xss_protection': 'X-XSS-Protection',
-            'csp': 'Content-Security-Policy',
-            'subpage_count': '检测子页面数量',
-            'suspicious_subpages': '可疑子页面数',
-            'avg_subpage_risk': '子页面平均风险',
-            'has_sensitive_subpage': '包含敏感子页面',
-            'subpage_keywords': '子页面中发现的关键词统计',
-            'subpage_details': '子页面详细信息'
-        }
-        translated = {}
-        for key, value in features.items():
-            if key in translate_map:
-                chinese_key = translate_map[key]
-                if isinstance(value, (int, float)) and value != -1:
-                    translated[chinese_key] = value
-                elif value not in [None, '', -1]:
-                    translated[chinese_key] = value
-            elif key == 'url':
-                translated['网址'] = value
-            elif key == 'final_url':
-                translated['最终网址'] = value
-                
-        return translated
+        return FeatureRecord(features).translated()
     
-    def detect_batch(self, urls):
-        """批量检测"""
+    def detect_batch(self, urls, sinks=()):
+        """批量检测，每个结果评分后立即写入sinks中的各输出端（输出端由调用方关闭）
+
+        urls可以是列表或任意迭代器（如逐行读取的文件、数据库流式游标），
+        同时提交到线程池的URL不超过max_in_flight个，预读不超过schedule_lookahead个，内存占用与URL总数无关；
+        URL按主机交错提交（HostScheduler）
+        """
         self.results = []
-        total = len(urls)
+        self.risk_counts = {}
+        # 迭代器输入无法预知总数，进度只显示已完成数量
+        total = len(urls) if hasattr(urls, '__len__') else None
+        
+        if total is None:
+            logger.info("🚀 开始批量检测（流式输入）")
+        else:
+            logger.info(f"🚀 开始批量检测，共 {total} 个网站")
         
-        logger.info(f"🚀 开始批量检测，共 {total} 个网站")
+        # 按主机交错提交，同一主机同时检测的URL不超过per_host_detections个
+        scheduler = HostScheduler(urls, self.max_detections_per_host, self.schedule_lookahead, HOST_LIMITER)
+        # 同一主机的域名、DNS特征只计算一次，页面级特征按URL计算
+        host_cache = HostFeatureCache(self._extract_host_features)
+        extracted = []
+        busy_retries = {}  # URL -> 因主机繁忙重新排队的次数
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_url = {executor.submit(self.detect_single, url): url for url in urls}
-            
-            for i, future in enumerate(as_completed(future_to_url), 1):
-                result = future.result()
-                self.results.append(result)
-                
-                # 获取中文风险等级用于进度显示
-                risk_level = result.get('风险等级', '未知')
-                url = result.get('网址', '未知网址')
+        def score_extracted():
+            self._score_and_record(extracted, sinks, total)
+            extracted.clear()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending_futures = {}  # future -> 主机
+                batch_started = None
                 
-                # 进度显示
+                while True:
+                    # 补足提交窗口，只在有空位时才从输入中读取URL
+                    while len(pending_futures) < self.max_in_flight:
+                        scheduled = scheduler.next()
+                        if scheduled is None:
+                            break
+                        url, host = scheduled
+                        pending_futures[executor.submit(self._extract_features, url, host_cache)] = host
+                    if not pending_futures:
+                        break
+                    
+                    done, _ = wait(pending_futures, timeout=self.score_batch_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        host = pending_futures.pop(future)
+                        if self._finish_scheduled(future.result(), host, scheduler, host_cache, busy_retries):
+                            extracted.append(future.result())
+                    for sink in sinks:
+                        sink.flush_if_due()
+                    if not extracted:
+                        continue
+                    batch_started = batch_started or time.time()
+                    
+                    # 凑满一批、等待超时或全部完成时评分
+                    if (len(extracted) >= self.score_batch_size or (scheduler.empty and not pending_futures)
+                            or time.time() - batch_started >= self.score_batch_interval):
+                        score_extracted()
+                        batch_started = None
+            if extracted:
+                score_extracted()
+        finally:
+            # 中途出错时已完成的结果也写出
+            for sink in sinks:
+                sink.flush()
+        
+        self._log_batch_summary(host_cache)
+        return self.results
+    
+    def _finish_scheduled(self, item, host, scheduler, host_cache, busy_retries):
+        """处理调度提交的URL的提取结果 (URL, 特征, 异常)，返回是否进入评分
+
+        主机繁忙（退避中）时放回主机队列稍后重试（调度时退避中的主机排在最后），超过host_busy_retries次后记为检测失败；
+        预读窗口内该主机的URL全部检测完后释放其主机级特征
+        """
+        url, _, error = item
+        if isinstance(error, HostBusyError) and busy_retries.get(url, 0) < self.host_busy_retries:
+            busy_retries[url] = busy_retries.get(url, 0) + 1
+            scheduler.requeue(url, host)
+            scheduler.done(host)
+            return False
+        busy_retries.pop(url, None)
+        if scheduler.done(host):
+            host_cache.discard(host)
+        return True
+    
+    def _score_and_record(self, extracted, sinks, total=None):
+        """对一批 (URL, 特征, 异常) 评分，逐条统计、写入输出端并显示进度"""
+        for result in self._score_batch(extracted):
+            self._record_result(result, sinks)
+            i = sum(self.risk_counts.values())
+            
+            # 获取中文风险等级用于进度显示
+            risk_level = result.get('风险等级', '未知')
+            url = result.get('网址', '未知网址')
+            
+            # 进度显示
+            if total:
                 progress_bar = self._create_progress_bar(i, total)
                 color_printer.print(f"{progress_bar} {i}/{total} - {url} - {risk_level}", 'cyan', bold=True)
-        
+            else:
+                color_printer.print(f"{i} - {url} - {risk_level}", 'cyan', bold=True)
+    
+    def _log_batch_summary(self, host_cache):
+        """批量检测结束后输出统计摘要与缓存命中情况"""
         # 生成中文统计摘要
-        stats = self._generate_chinese_summary(self.results)
+        stats = self._generate_chinese_summary(self.results, self.risk_counts)
         logger.info(stats)
-        
-        return self.results
+        whois_stats = get_whois_cache().stats()
+        logger.info(f"WHOIS缓存: 命中 {whois_stats['hits']} 次, 未命中 {whois_stats['misses']} 次, 命中率 {whois_stats['hit_rate']:.1%}")
+        logger.info(f"主机级特征: 计算 {host_cache.computed} 次, 复用 {host_cache.reused} 次")
+    
+    def _record_result(self, result, sinks=()):
+        """统计并输出单个检测结果"""
+        risk_level = result.get('风险等级', '未知')
+        self.risk_counts[risk_level] = self.risk_counts.get(risk_level, 0) + 1
+        if self.keep_results:
+            self.results.append(result)
+        for sink in sinks:
+            sink.write(result)
+    
+    def _count_risk_levels(self, results=None, risk_counts=None):
+        """统计各风险等级数量，未保留结果时使用检测过程中的计数"""
+        if risk_counts is not None:
+            return risk_counts
+        if not results and not self.keep_results:
+            return self.risk_counts
+        counts = {}
+        for result in results or []:
+            risk_level = result.get('风险等级', '未知')
+            counts[risk_level] = counts.get(risk_level, 0) + 1
+        return counts
     
     def _create_progress_bar(self, current, total, length=20):
         """创建进度条"""
@@ -1405,18 +4126,13 @@ class BatchDetector:
         bar = '█' * filled + '░' * (length - filled)
         return f"[{bar}] {progress*100:.1f}%"
     
-    def _generate_chinese_summary(self, results):
+    def _generate_chinese_summary(self, results, risk_counts=None):
         """生成彩色中文统计摘要"""
-        if not results:
-            return "📊 无检测结果"
-        
-        total = len(results)
-        
         # 统计各风险等级
-        risk_counts = {}
-        for result in results:
-            risk_level = result.get('风险等级', '未知')
-            risk_counts[risk_level] = risk_counts.get(risk_level, 0) + 1
+        risk_counts = self._count_risk_levels(results, risk_counts)
+        total = sum(risk_counts.values())
+        if not total:
+            return "📊 无检测结果"
         
         summary_parts = []
         summary_parts.append("\n" + "=" * 60)
@@ -1458,34 +4174,21 @@ class BatchDetector:
 
 
     def save_results(self, output_prefix=None):
-        """保存检测结果"""
+        """保存内存中的检测结果（流式检测时结果已由输出端逐条写出）"""
         if not output_prefix:
             output_prefix = f"detection_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
         # 保存JSON格式
         json_file = f"{output_prefix}.json"
         with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, ensure_ascii=False, indent=2)
+            json.dump(self.results, f, ensure_ascii=False, indent=2, default=result_json_default)
         
         # 保存CSV格式
         csv_file = f"{output_prefix}.csv"
         if self.results:
-            import csv
-            with open(csv_file, 'w', encoding='utf-8-sig', newline='') as f:
-                writer = csv.writer(f)
-                # 写入表头
-                headers = ['网址', '风险等级', '风险评分', '检测时间']
-                writer.writerow(headers)
-                
-                # 写入数据
+            with CSVResultSink(csv_file) as sink:
                 for result in self.results:
-                    row = [
-                        result.get('网址', ''),
-                        result.get('风险等级', ''),
-                        result.get('风险评分', ''),
-                        result.get('检测时间', '')
-                    ]
-                    writer.writerow(row)
+                    sink.write(result)
         # 新增：保存到数据库
         try:
             logger.info("正在保存结果到数据库...")
@@ -1498,7 +4201,9 @@ class BatchDetector:
     
     def generate_report(self):
         """生成中文检测报告"""
-        if not self.results:
+        risk_counts = self._count_risk_levels(self.results)
+        total = sum(risk_counts.values())
+        if not total:
             return "无检测结果"
         
         report_lines = []
@@ -1508,20 +4213,17 @@ class BatchDetector:
         report_lines.append("🛡️ 违法网站检测报告".center(60))
         report_lines.append("=" * 60)
         report_lines.append(f"检测时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        report_lines.append(f"检测网站总数: {len(self.results)} 个")
+        report_lines.append(f"检测网站总数: {total} 个")
         report_lines.append("")
         
-        # 风险等级统计
-        risk_counts = {}
-        for result in self.results:
-            risk_level = result.get('风险等级', '未知')
-            risk_counts[risk_level] = risk_counts.get(risk_level, 0) + 1
-        
         report_lines.append("📊 风险等级统计:")
         for risk_level, count in sorted(risk_counts.items()):
-            percentage = (count / len(self.results)) * 100
+            percentage = (count / total) * 100
             report_lines.append(f"  {risk_level}: {count} 个 ({percentage:.1f}%)")
         report_lines.append("")
+        if not self.keep_results:
+            report_lines.append("（未在内存中保留检测结果，各网站详情见结果文件）")
+            report_lines.append("")
         
         # 高风险网站详细分析
         high_risk_sites = [r for r in self.results if r.get('风险等级') == '高风险']
@@ -1577,14 +4279,10 @@ class BatchDetector:
 
     def print_summary(self, results):
         """打印统计摘要"""
-        if not results:
+        risk_counts = self._count_risk_levels(results)
+        total = sum(risk_counts.values())
+        if not total:
             return
-            
-        total = len(results)
-        risk_counts = {}
-        for result in results:
-            risk_level = result.get('风险等级', '未知')
-            risk_counts[risk_level] = risk_counts.get(risk_level, 0) + 1
         
         print("\n" + "=" * 60)
         print("📊 检测统计汇总".center(60))
@@ -1614,16 +4312,240 @@ class BatchDetector:
         if high_risk == 0 and medium_risk == 0:
             print("✅ 安全良好: 本次检测未发现明显风险网站")
 
+class BatchJobStore:
+    """批量检测任务的持久化存储
+
+    任务、待检测URL与已完成的结果保存在SQLite中，程序重启后排队和未完成的任务可以继续执行。
+    """
+
+    # 任务状态
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, completed INTEGER NOT NULL DEFAULT 0, "
+                "save_to_db INTEGER NOT NULL, created_at TEXT, started_at TEXT, finished_at TEXT, error TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_urls ("
+                "job_id TEXT NOT NULL, seq INTEGER NOT NULL, url TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_results ("
+                "job_id TEXT NOT NULL, seq INTEGER NOT NULL, risk_level TEXT, result TEXT NOT NULL, "
+                "PRIMARY KEY (job_id, seq))"
+            )
+            # 上次运行中断的任务重新排队，已完成的结果保留
+            self._conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (self.QUEUED, self.RUNNING))
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def create(self, urls, save_to_db=True):
+        """创建任务并返回任务ID"""
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, total, save_to_db, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, self.QUEUED, len(urls), int(bool(save_to_db)), self._now())
+            )
+            self._conn.executemany(
+                "INSERT INTO job_urls (job_id, seq, url) VALUES (?, ?, ?)",
+                ((job_id, seq, url) for seq, url in enumerate(urls))
+            )
+        return job_id
+
+    def claim_next(self):
+        """取出最早排队的任务并标记为运行中，没有任务时返回None"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id, save_to_db FROM jobs WHERE status = ? ORDER BY created_at, rowid LIMIT 1", (self.QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (self.RUNNING, self._now(), row[0])
+            )
+        return {'id': row[0], 'save_to_db': bool(row[1])}
+
+    def pending_urls(self, job_id):
+        """返回任务中尚未完成的 (序号, URL)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, url FROM job_urls WHERE job_id = ? AND seq NOT IN "
+                "(SELECT seq FROM job_results WHERE job_id = ?) ORDER BY seq",
+                (job_id, job_id)
+            ).fetchall()
+
+    def add_results(self, job_id, rows):
+        """保存一批 (序号, 风险等级, 结果JSON) 并更新完成数量"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "REPLACE INTO job_results (job_id, seq, risk_level, result) VALUES (?, ?, ?, ?)",
+                ((job_id, seq, risk_level, result) for seq, risk_level, result in rows)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET completed = (SELECT COUNT(*) FROM job_results WHERE job_id = ?) WHERE id = ?",
+                (job_id, job_id)
+            )
+
+    def finish(self, job_id, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (self.FAILED if error else self.DONE, self._now(), error, job_id)
+            )
+
+    def get(self, job_id):
+        """返回任务状态与各风险等级数量，任务不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, total, completed, save_to_db, created_at, started_at, finished_at, error "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            risk_counts = dict(self._conn.execute(
+                "SELECT risk_level, COUNT(*) FROM job_results WHERE job_id = ? GROUP BY risk_level", (job_id,)
+            ).fetchall())
+        job = dict(zip(('job_id', 'status', 'total', 'completed', 'save_to_db', 'created_at', 'started_at',
+                        'finished_at', 'error'), row))
+        job['save_to_db'] = bool(job['save_to_db'])
+        job['risk_counts'] = risk_counts
+        return job
+
+    def status_counts(self):
+        """返回各状态的任务数"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def results(self, job_id, offset=0, limit=100):
+        """按提交顺序分页返回已完成的结果"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM job_results WHERE job_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (job_id, limit, offset)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobResultSink(ResultSink):
+    """将检测结果写入任务存储，结果按URL对应回提交时的序号"""
+
+    def __init__(self, store, job_id, pending, buffer_size=20, flush_interval=1.0):
+        super().__init__(buffer_size, flush_interval)
+        self.store = store
+        self.job_id = job_id
+        # 同一URL可能提交多次，按出现顺序依次对应
+        self._seqs = {}
+        for seq, url in pending:
+            self._seqs.setdefault(url, deque()).append(seq)
+
+    def _write_batch(self, results):
+        rows = []
+        for result in results:
+            seq = self._seqs[result['网址']].popleft()
+            # 英文原文与详细特征内容相同，不重复保存
+            record = {key: value for key, value in result.items() if key != '英文原文'}
+            rows.append((seq, result.get('风险等级'), json.dumps(record, ensure_ascii=False)))
+        self.store.add_results(self.job_id, rows)
+
+
+class BatchJobRunner:
+    """后台执行批量检测任务：单个后台线程按提交顺序逐个执行任务，任务内部由detect_batch并发检测"""
+
+    def __init__(self, store, batch_detector):
+        self.store = store
+        self.batch_detector = batch_detector
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def submit(self, urls, save_to_db=True):
+        """提交任务，URL按 detect_batch 的规则补全协议，立即返回任务ID"""
+        urls = [url if url.startswith(('http://', 'https://')) else 'http://' + url for url in urls]
+        job_id = self.store.create(urls, save_to_db)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='batch-job-runner', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            job = self.store.claim_next()
+            if job is None:
+                self._wakeup.wait(5)
+                self._wakeup.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        """执行单个任务，只检测尚未完成的URL"""
+        job_id = job['id']
+        pending = self.store.pending_urls(job_id)
+        logger.info(f"开始执行批量检测任务 {job_id}，待检测 {len(pending)} 个网站")
+        sinks = [JobResultSink(self.store, job_id, pending)]
+        if job['save_to_db']:
+            sinks.append(MySQLResultSink())
+        error = None
+        try:
+            self.batch_detector.detect_batch((url for _, url in pending), sinks=sinks)
+        except Exception as e:
+            error = str(e)
+            logger.exception(f"批量检测任务 {job_id} 执行失败")
+        finally:
+            for sink in sinks:
+                try:
+                    sink.close()
+                except Exception as e:
+                    error = error or str(e)
+                    logger.error(f"批量检测任务 {job_id} 保存结果失败: {e}")
+        self.store.finish(job_id, error)
+
+
+def get_job_db_path():
+    """任务数据库路径（相对路径相对于脚本目录）"""
+    path = CONFIG.get('job_db_path', 'detection_jobs.db')
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return path
+
+
+# 待检测URL查询（未检测过的线索，按更新时间倒序）
+PENDING_URLS_SQL = "select url from gat_illegal_result where  discovery_method not in (4,5)   and url not in (select url from gat_illegal_result_detector)   order by update_time desc"
+
+
 # 添加函数从MySQL数据库查询URL
 def get_urls_from_mysql():
     """从MySQL数据库查询URL列表并进行去重，然后写入sample_urls.txt"""
     urls = []
     try:
-        # 连接数据库
-        connection = pymysql.connect(**DB_CONFIG)
-        with connection.cursor() as cursor:
+        with get_db_pool().connection() as connection, connection.cursor() as cursor:
             # 执行SQL查询
-            sql = "select url from gat_illegal_result where  discovery_method not in (4,5)   and url not in (select url from gat_illegal_result_detector)   order by update_time desc   LIMIT 5"
+            sql = PENDING_URLS_SQL + "   LIMIT 5"
             # sql = "select url from gat_illegal_result where  discovery_method not in (4,5)  LIMIT 5"
             cursor.execute(sql)
             # 获取所有查询结果
@@ -1648,17 +4570,36 @@ def get_urls_from_mysql():
     except Exception as e:
         color_printer = ColorPrinter()
         color_printer.print_error(f"从数据库查询URL或写入文件失败: {e}")
-    finally:
-        if 'connection' in locals() and connection.open:
-            connection.close()
     return urls
+
+
+def iter_urls_from_file(path):
+    """逐行读取URL文件（跳过空行），不将整个文件读入内存"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            url = line.strip()
+            if url:
+                yield url
+
+
+def iter_urls_from_mysql(sql=PENDING_URLS_SQL):
+    """使用服务端游标（SSDictCursor）流式读取待检测URL，结果集不在客户端缓存
+
+    读取期间占用连接池中的一个连接；为保持内存恒定不做去重
+    """
+    with get_db_pool().connection() as connection:
+        with connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(sql)
+            for row in cursor:
+                if row['url']:
+                    yield row['url']
+
+
 # 创建检测结果表
 def create_detector_result_table():
-    """创建检测结果表"""
+    """创建检测结果表，成功时返回True"""
     try:
-        # 连接数据库
-        connection = pymysql.connect(**DB_CONFIG)
-        try:
+        with get_db_pool().connection() as connection:
             with connection.cursor() as cursor:
                 # 创建表的SQL语句，添加了表注释和字段注释
                 create_table_sql = """
@@ -1758,427 +4699,202 @@ def create_detector_result_table():
                 cursor.execute(create_table_sql)
                 connection.commit()
                 logger.info("检测结果表创建成功")
-        finally:
-            connection.close()
+        return True
     except Exception as e:
         logger.error(f"创建检测结果表失败: {e}")
+        return False
+
+
+_detector_table_ready = False
+_detector_table_lock = threading.Lock()
+
+
+def ensure_detector_result_table():
+    """确保检测结果表存在，每个进程只在首次调用时检查"""
+    global _detector_table_ready
+    with _detector_table_lock:
+        if not _detector_table_ready:
+            _detector_table_ready = create_detector_result_table()
+
+
+# 检测结果表的特征字段：(字段名, 详细特征中的中文名)，字段名即英文特征名
+DETECTOR_FEATURE_COLUMNS = [
+    ('domain_length', '域名长度'),
+    ('subdomain_count', '子域名数量'),
+    ('has_hyphen', '包含连字符'),
+    ('has_digits', '包含数字'),
+    ('suspicious_tld', '可疑顶级域名'),
+    ('digit_ratio', '数字比例'),
+    ('special_char_ratio', '特殊字符比例'),
+    ('consonant_ratio', '辅音比例'),
+    ('entropy', '熵值（随机性）'),
+    ('in_blacklist', '黑名单匹配'),
+    ('brand_similarity', '品牌相似度'),
+    ('potential_phishing', '疑似钓鱼'),
+    ('homograph_attack', '同形异义攻击'),
+    ('suspicious_combo', '可疑关键词组合'),
+    ('domain_age_days', '域名年龄（天）'),
+    ('is_new_domain', '新域名（30天内）'),
+    ('is_very_new_domain', '极新域名（7天内）'),
+    ('days_to_expire', '到期剩余天数'),
+    ('short_registration', '短期注册'),
+    ('suspicious_registrar', '可疑注册商'),
+    ('content_length', '内容长度'),
+    ('text_length', '文本长度'),
+    ('image_count', '图片数量'),
+    ('link_count', '链接数量'),
+    ('form_count', '表单数量'),
+    ('external_links', '外部链接数'),
+    ('sensitive_keyword_count', '敏感词总数'),
+    ('sensitive_keyword_ratio', '敏感词占比'),
+    ('has_title', '有标题'),
+    ('title_length', '标题长度'),
+    ('has_description', '有描述'),
+    ('has_keywords', '有关键词'),
+    ('has_robots', '有robots'),
+    ('has_login_form', '有登录表单'),
+    ('has_contact_info', '有联系信息'),
+    ('has_privacy_policy', '有隐私政策'),
+    ('suspicious_images', '可疑图片'),
+    ('script_count', '脚本数量'),
+    ('suspicious_scripts', '可疑脚本'),
+    ('redirect_count', '重定向次数'),
+    ('final_url', '最终网址'),
+    ('domain_changed', '域名变更'),
+    ('has_ssl', '有SSL证书'),
+    ('ssl_valid', 'SSL有效'),
+    ('trusted_ca', '可信CA'),
+    ('cert_valid_days', '证书有效天数'),
+    ('cert_too_new', '证书太新'),
+    ('ssl_domain_match', '域名匹配'),
+    ('wildcard_cert', '通配符证书'),
+    ('dns_resolved', 'DNS解析成功'),
+    ('ip_count', 'IP数量'),
+    ('first_ip', '首个IP'),
+    ('blacklisted_ip', 'IP黑名单'),
+    ('has_mx', '有MX记录'),
+    ('mx_count', 'MX记录数'),
+    ('has_spf', '有SPF记录'),
+    ('response_time', '响应时间'),
+    ('http_status', 'HTTP状态码'),
+    ('web_accessible', '可访问'),
+    ('server_header', '服务器信息'),
+    ('hsts', 'HSTS安全头'),
+    ('x_frame_options', 'X-Frame-Options'),
+    ('x_content_type', 'X-Content-Type-Options'),
+    ('x_xss_protection', 'X-XSS-Protection'),
+    ('csp', 'Content-Security-Policy'),
+    ('sensitive_违规书籍', None),
+    ('sensitive_网站违禁词', None),
+    ('sensitive_涉稳', None),
+    ('sensitive_涉黄', None),
+    ('sensitive_涉赌', None),
+    ('sensitive_涉政', None),
+    ('sensitive_涉枪暴', None),
+    ('sensitive_涉恐涉邪', None),
+    ('sensitive_涉黑灰产', None),
+    ('sensitive_涉电诈', None),
+    ('sensitive_违规化学品', None),
+    ('subpage_count', '检测子页面数量'),
+    ('suspicious_subpages', '可疑子页面数'),
+    ('avg_subpage_risk', '子页面平均风险'),
+    ('has_sensitive_subpage', '包含敏感子页面'),
+]
+
+# 检测结果表写入字段（顺序与_detector_result_row一致）
+DETECTOR_RESULT_COLUMNS = (
+    ['url', 'risk_level', 'risk_score', 'risk_description', 'detection_time']
+    + [column for column, _ in DETECTOR_FEATURE_COLUMNS]
+    + ['subpage_keywords', 'subpage_details']
+)
+
+
+def _detector_result_row(result):
+    """将检测结果转换为检测结果表的一行数据（直接读取英文特征，无效值写入NULL）"""
+    features = result['英文原文']['features']
+    if not isinstance(features, FeatureRecord):
+        features = FeatureRecord(features)
+    # 将子页面特征转换为JSON字符串
+    subpage_keywords = features.display_value('subpage_keywords')
+    subpage_details = features.display_value('subpage_details')
+    
+    row = [
+        result['网址'],
+        result['风险等级'],
+        int(result['风险评分'].replace('%', '')),
+        result['风险描述'],
+        result['检测时间'],
+    ]
+    for column, _ in DETECTOR_FEATURE_COLUMNS:
+        row.append(features.display_value(column))
+    row.append(json.dumps(subpage_keywords, ensure_ascii=False) if subpage_keywords is not None else None)
+    row.append(json.dumps(subpage_details, ensure_ascii=False) if subpage_details is not None else None)
+    return row
+
+
+def _build_upsert_sql(row_count):
+    """构建多行 INSERT ... ON DUPLICATE KEY UPDATE 语句（url为唯一键）"""
+    columns = ', '.join(f'`{column}`' for column in DETECTOR_RESULT_COLUMNS)
+    placeholders = '(' + ', '.join(['%s'] * len(DETECTOR_RESULT_COLUMNS)) + ')'
+    updates = ', '.join(f'`{column}` = VALUES(`{column}`)' for column in DETECTOR_RESULT_COLUMNS[1:])
+    return (
+        f"INSERT INTO gat_illegal_result_detector ({columns}) VALUES "
+        + ', '.join([placeholders] * row_count)
+        + f" ON DUPLICATE KEY UPDATE {updates}"
+    )
 
 
 def save_result_to_database(result):
     """保存检测结果到数据库，如果存在则更新，不存在则新增"""
     try:
-        # 连接数据库
-        connection = pymysql.connect(**DB_CONFIG)
-        try:
-            with connection.cursor() as cursor:
-                # 检查记录是否存在
-                check_sql = "SELECT id FROM gat_illegal_result_detector WHERE url = %s"
-                cursor.execute(check_sql, (result['网址'],))
-                exists = cursor.fetchone() is not None
-                
-                # 获取详细特征
-                features = result['详细特征']
-                en_features = result['英文原文']['features']
-                # 将子页面特征转换为JSON字符串
-            #     'subpage_keywords': '子页面中发现的关键词统计',
-            # 'subpage_details': '子页面详细信息'
-                subpage_keywords = json.dumps(features.get('子页面中发现的关键词统计', {}), ensure_ascii=False) if '子页面中发现的关键词统计' in features else None
-                subpage_details = json.dumps(features.get('子页面详细信息', []), ensure_ascii=False) if '子页面详细信息' in features else None
-                if exists:
-                    # 更新记录
-                    update_sql = """
-                    UPDATE gat_illegal_result_detector
-                    SET 
-                        risk_level = %s,
-                        risk_score = %s,
-                        risk_description = %s,
-                        detection_time = %s,
-                        domain_length = %s,
-                        subdomain_count = %s,
-                        has_hyphen = %s,
-                        has_digits = %s,
-                        suspicious_tld = %s,
-                        digit_ratio = %s,
-                        special_char_ratio = %s,
-                        consonant_ratio = %s,
-                        entropy = %s,
-                        in_blacklist = %s,
-                        brand_similarity = %s,
-                        potential_phishing = %s,
-                        homograph_attack = %s,
-                        suspicious_combo = %s,
-                        domain_age_days = %s,
-                        is_new_domain = %s,
-                        is_very_new_domain = %s,
-                        days_to_expire = %s,
-                        short_registration = %s,
-                        suspicious_registrar = %s,
-                        content_length = %s,
-                        text_length = %s,
-                        image_count = %s,
-                        link_count = %s,
-                        form_count = %s,
-                        external_links = %s,
-                        sensitive_keyword_count = %s,
-                        sensitive_keyword_ratio = %s,
-                        has_title = %s,
-                        title_length = %s,
-                        has_description = %s,
-                        has_keywords = %s,
-                        has_robots = %s,
-                        has_login_form = %s,
-                        has_contact_info = %s,
-                        has_privacy_policy = %s,
-                        suspicious_images = %s,
-                        script_count = %s,
-                        suspicious_scripts = %s,
-                        redirect_count = %s,
-                        final_url = %s,
-                        domain_changed = %s,
-                        has_ssl = %s,
-                        ssl_valid = %s,
-                        trusted_ca = %s,
-                        cert_valid_days = %s,
-                        cert_too_new = %s,
-                        ssl_domain_match = %s,
-                        wildcard_cert = %s,
-                        dns_resolved = %s,
-                        ip_count = %s,
-                        first_ip = %s,
-                        blacklisted_ip = %s,
-                        has_mx = %s,
-                        mx_count = %s,
-                        has_spf = %s,
-                        response_time = %s,
-                        http_status = %s,
-                        web_accessible = %s,
-                        server_header = %s,
-                        hsts = %s,
-                        x_frame_options = %s,
-                        x_content_type = %s,
-                        x_xss_protection = %s,
-                        csp = %s,
-                        sensitive_违规书籍 = %s,
-                        sensitive_网站违禁词 = %s,
-                        sensitive_涉稳 = %s,
-                        sensitive_涉黄 = %s,
-                        sensitive_涉赌 = %s,
-                        sensitive_涉政 = %s,
-                        sensitive_涉枪暴 = %s,
-                        sensitive_涉恐涉邪 = %s,
-                        sensitive_涉黑灰产 = %s,
-                        sensitive_涉电诈 = %s,
-                        sensitive_违规化学品 = %s,
-                        subpage_count = %s,
-                        suspicious_subpages = %s,
-                        avg_subpage_risk = %s,
-                        has_sensitive_subpage = %s,
-                        subpage_keywords = %s,
-                        subpage_details = %s
-
-                    WHERE url = %s
-                    """
-                    
-                    # 准备参数
-                    params = (
-                        result['风险等级'],
-                        int(result['风险评分'].replace('%', '')),
-                        result['风险描述'],
-                        result['检测时间'],
-                        features.get('域名长度'),
-                        features.get('子域名数量'),
-                        features.get('包含连字符'),
-                        features.get('包含数字'),
-                        features.get('可疑顶级域名'),
-                        features.get('数字比例'),
-                        features.get('特殊字符比例'),
-                        features.get('辅音比例'),
-                        features.get('熵值（随机性）'),
-                        features.get('黑名单匹配'),
-                        features.get('品牌相似度'),
-                        features.get('疑似钓鱼'),
-                        features.get('同形异义攻击'),
-                        features.get('可疑关键词组合'),
-                        features.get('域名年龄（天）'),
-                        features.get('新域名（30天内）'),
-                        features.get('极新域名（7天内）'),
-                        features.get('到期剩余天数'),
-                        features.get('短期注册'),
-                        features.get('可疑注册商'),
-                        features.get('内容长度'),
-                        features.get('文本长度'),
-                        features.get('图片数量'),
-                        features.get('链接数量'),
-                        features.get('表单数量'),
-                        features.get('外部链接数'),
-                        features.get('敏感词总数'),
-                        features.get('敏感词占比'),
-                        features.get('有标题'),
-                        features.get('标题长度'),
-                        features.get('有描述'),
-                        features.get('有关键词'),
-                        features.get('有robots'),
-                        features.get('有登录表单'),
-                        features.get('有联系信息'),
-                        features.get('有隐私政策'),
-                        features.get('可疑图片'),
-                        features.get('脚本数量'),
-                        features.get('可疑脚本'),
-                        features.get('重定向次数'),
-                        features.get('最终网址'),
-                        features.get('域名变更'),
-                        features.get('有SSL证书'),
-                        features.get('SSL有效'),
-                        features.get('可信CA'),
-                        features.get('证书有效天数'),
-                        features.get('证书太新'),
-                        features.get('域名匹配'),
-                        features.get('通配符证书'),
-                        features.get('DNS解析成功'),
-                        features.get('IP数量'),
-                        features.get('首个IP'),
-                        features.get('IP黑名单'),
-                        features.get('有MX记录'),
-                        features.get('MX记录数'),
-                        features.get('有SPF记录'),
-                        features.get('响应时间'),
-                        features.get('HTTP状态码'),
-                        features.get('可访问'),
-                        features.get('服务器信息'),
-                        features.get('HSTS安全头'),
-                        features.get('X-Frame-Options'),
-                        features.get('X-Content-Type-Options'),
-                        features.get('X-XSS-Protection'),
-                        features.get('Content-Security-Policy'),
-                        en_features.get('sensitive_违规书籍'),
-                        en_features.get('sensitive_网站违禁词'),
-                        en_features.get('sensitive_涉稳'),
-                        en_features.get('sensitive_涉黄'),
-                        en_features.get('sensitive_涉赌'),
-                        en_features.get('sensitive_涉政'),
-                        en_features.get('sensitive_涉枪暴'),
-                        en_features.get('sensitive_涉恐涉邪'),
-                        en_features.get('sensitive_涉黑灰产'),
-                        en_features.get('sensitive_涉电诈'),
-                        en_features.get('sensitive_违规化学品'),
-                        features.get('检测子页面数量'),
-                        features.get('可疑子页面数'),
-                        features.get('子页面平均风险'),
-                        features.get('包含敏感子页面'),
-                        subpage_keywords,
-                        subpage_details,
-                        result['网址']
-                    )
-                    
-                    cursor.execute(update_sql, params)
-                    logger.info(f"更新检测结果成功: {result['网址']}")
-                else:
-                    # 插入新记录
-                    insert_sql = """
-                    INSERT INTO gat_illegal_result_detector (
-                        url,
-                        risk_level,
-                        risk_score,
-                        risk_description,
-                        detection_time,
-                        domain_length,
-                        subdomain_count,
-                        has_hyphen,
-                        has_digits,
-                        suspicious_tld,
-                        digit_ratio,
-                        special_char_ratio,
-                        consonant_ratio,
-                        entropy,
-                        in_blacklist,
-                        brand_similarity,
-                        potential_phishing,
-                        homograph_attack,
-                        suspicious_combo,
-                        domain_age_days,
-                        is_new_domain,
-                        is_very_new_domain,
-                        days_to_expire,
-                        short_registration,
-                        suspicious_registrar,
-                        content_length,
-                        text_length,
-                        image_count,
-                        link_count,
-                        form_count,
-                        external_links,
-                        sensitive_keyword_count,
-                        sensitive_keyword_ratio,
-                        has_title,
-                        title_length,
-                        has_description,
-                        has_keywords,
-                        has_robots,
-                        has_login_form,
-                        has_contact_info,
-                        has_privacy_policy,
-                        suspicious_images,
-                        script_count,
-                        suspicious_scripts,
-                        redirect_count,
-                        final_url,
-                        domain_changed,
-                        has_ssl,
-                        ssl_valid,
-                        trusted_ca,
-                        cert_valid_days,
-                        cert_too_new,
-                        ssl_domain_match,
-                        wildcard_cert,
-                        dns_resolved,
-                        ip_count,
-                        first_ip,
-                        blacklisted_ip,
-                        has_mx,
-                        mx_count,
-                        has_spf,
-                        response_time,
-                        http_status,
-                        web_accessible,
-                        server_header,
-                        hsts,
-                        x_frame_options,
-                        x_content_type,
-                        x_xss_protection,
-                        csp,
-                        sensitive_违规书籍,
-                        sensitive_网站违禁词,
-                        sensitive_涉稳,
-                        sensitive_涉黄,
-                        sensitive_涉赌,
-                        sensitive_涉政,
-                        sensitive_涉枪暴,
-                        sensitive_涉恐涉邪,
-                        sensitive_涉黑灰产,
-                        sensitive_涉电诈,
-                        sensitive_违规化学品,
-                        subpage_count,
-                        suspicious_subpages,
-                        avg_subpage_risk,
-                        has_sensitive_subpage,
-                        subpage_keywords,
-                        subpage_details
-                    )VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    
-                    # 准备参数（与更新时相同）
-                    params = (
-                        result['网址'],
-                        result['风险等级'],
-                        int(result['风险评分'].replace('%', '')),
-                        result['风险描述'],
-                        result['检测时间'],
-                        features.get('域名长度'),
-                        features.get('子域名数量'),
-                        features.get('包含连字符'),
-                        features.get('包含数字'),
-                        features.get('可疑顶级域名'),
-                        features.get('数字比例'),
-                        features.get('特殊字符比例'),
-                        features.get('辅音比例'),
-                        features.get('熵值（随机性）'),
-                        features.get('黑名单匹配'),
-                        features.get('品牌相似度'),
-                        features.get('疑似钓鱼'),
-                        features.get('同形异义攻击'),
-                        features.get('可疑关键词组合'),
-                        features.get('域名年龄（天）'),
-                        features.get('新域名（30天内）'),
-                        features.get('极新域名（7天内）'),
-                        features.get('到期剩余天数'),
-                        features.get('短期注册'),
-                        features.get('可疑注册商'),
-                        features.get('内容长度'),
-                        features.get('文本长度'),
-                        features.get('图片数量'),
-                        features.get('链接数量'),
-                        features.get('表单数量'),
-                        features.get('外部链接数'),
-                        features.get('敏感词总数'),
-                        features.get('敏感词占比'),
-                        features.get('有标题'),
-                        features.get('标题长度'),
-                        features.get('有描述'),
-                        features.get('有关键词'),
-                        features.get('有robots'),
-                        features.get('有登录表单'),
-                        features.get('有联系信息'),
-                        features.get('有隐私政策'),
-                        features.get('可疑图片'),
-                        features.get('脚本数量'),
-                        features.get('可疑脚本'),
-                        features.get('重定向次数'),
-                        features.get('最终网址'),
-                        features.get('域名变更'),
-                        features.get('有SSL证书'),
-                        features.get('SSL有效'),
-                        features.get('可信CA'),
-                        features.get('证书有效天数'),
-                        features.get('证书太新'),
-                        features.get('域名匹配'),
-                        features.get('通配符证书'),
-                        features.get('DNS解析成功'),
-                        features.get('IP数量'),
-                        features.get('首个IP'),
-                        features.get('IP黑名单'),
-                        features.get('有MX记录'),
-                        features.get('MX记录数'),
-                        features.get('有SPF记录'),
-                        features.get('响应时间'),
-                        features.get('HTTP状态码'),
-                        features.get('可访问'),
-                        features.get('服务器信息'),
-                        features.get('HSTS安全头'),
-                        features.get('X-Frame-Options'),
-                        features.get('X-Content-Type-Options'),
-                        features.get('X-XSS-Protection'),
-                        features.get('Content-Security-Policy'),
-                        en_features.get('sensitive_违规书籍'),
-                        en_features.get('sensitive_网站违禁词'),
-                        en_features.get('sensitive_涉稳'),
-                        en_features.get('sensitive_涉黄'),
-                        en_features.get('sensitive_涉赌'),
-                        en_features.get('sensitive_涉政'),
-                        en_features.get('sensitive_涉枪暴'),
-                        en_features.get('sensitive_涉恐涉邪'),
-                        en_features.get('sensitive_涉黑灰产'),
-                        en_features.get('sensitive_涉电诈'),
-                        en_features.get('sensitive_违规化学品'),
-                        features.get('检测子页面数量'),
-                        features.get('可疑子页面数'),
-                        features.get('子页面平均风险'),
-                        features.get('包含敏感子页面'),
-                        subpage_keywords,
-                        subpage_details
-                    )
-                    
-                    cursor.execute(insert_sql, params)
-                    logger.info(f"插入检测结果成功: {result['网址']}")
-                
-                connection.commit()
-        finally:
-            connection.close()
+        save_results_to_database([result])
     except Exception as e:
         logger.error(f"保存检测结果到数据库失败: {e}")
 
 
-def save_results_to_database(results):
-    """批量保存检测结果到数据库"""
+@METRICS.timed('db_save')
+def save_results_to_database(results, chunk_size=None):
+    """批量保存检测结果到数据库
+
+    每chunk_size条记录合并为一条多行upsert语句，每块提交一次
+    """
+    chunk_size = chunk_size or CONFIG.get('db_batch_size', 500)
     try:
-        # 确保表存在
-        create_detector_result_table()
+        # 确保表存在（每个进程只检查一次）
+        ensure_detector_result_table()
         
-        # 批量保存结果
+        rows = []
         for result in results:
-            save_result_to_database(result)
+            # 检测失败的网站不写入结果表，下一轮重新检测
+            if result.get('风险等级') == RISK_LEVEL_NAMES['ERROR']:
+                continue
+            try:
+                rows.append(_detector_result_row(result))
+            except Exception as e:
+                logger.error(f"保存检测结果到数据库失败 {result.get('网址')}: 结果数据不完整 {e}")
+        if not rows:
+            return
+        
+        saved = 0
+        with get_db_pool().connection() as connection:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(_build_upsert_sql(len(chunk)), [value for row in chunk for value in row])
+                    connection.commit()
+                    saved += len(chunk)
+                except pymysql.OperationalError:
+                    # 连接级错误，后续分块同样无法写入
+                    raise
+                except pymysql.MySQLError as e:
+                    connection.rollback()
+                    logger.error(f"保存检测结果到数据库失败（第{start + 1}-{start + len(chunk)}条）: {e}")
+        if saved:
+            logger.info(f"保存检测结果成功，共 {saved} 条")
     except pymysql.MySQLError as db_err:
         # 数据库特定错误处理
-        logger.error(f"数据库错误: {db_err.args[0]}, {db_err.args[1]}")
+        logger.error(f"数据库错误: {db_err.args[0]}, {db_err.args[1] if len(db_err.args) > 1 else ''}")
         # 根据错误代码采取不同的恢复策略
         if db_err.args[0] == 1045:  # 访问被拒绝
             logger.error("数据库认证失败，请检查用户名和密码")
@@ -2192,8 +4908,8 @@ def save_results_to_database(results):
 
 
 
-def main():
-    """主函数 - 彩色输出版"""
+def parse_args(argv=None):
+    """解析命令行参数"""
     import argparse
     
     parser = argparse.ArgumentParser(description='违法网站批量检测工具 - 彩色输出版')
@@ -2201,63 +4917,73 @@ def main():
     parser.add_argument('-u', '--urls', nargs='+', help='直接指定URL列表')
     parser.add_argument('-o', '--output', help='输出文件名前缀')
     parser.add_argument('-w', '--workers', type=int, default=10, help='并发工作线程数')
-    
-    args = parser.parse_args()
-    
-    # 彩色欢迎信息
-    color_printer.print_header("🛡️ 违法网站批量检测系统 v2.0")
-    color_printer.print("📋 功能特性:", 'cyan', bold=True)
-    color_printer.print("• 多维度特征分析", 'white')
-    color_printer.print("• 机器学习风险预测", 'white') 
-    color_printer.print("• 实时彩色输出", 'white')
-    color_printer.print("• 详细中文报告", 'white')
-    print()
-    # 从数据库更新恶意域名及恶意IP文件
-    update_blacklist_from_db()
-    # 获取URL列表
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help=f'定时检测间隔（秒），默认{DEFAULT_INTERVAL}秒')
+    parser.add_argument('--once', action='store_true', help='仅执行一次检测，不启用定时')
+    parser.add_argument('--db-stream', action='store_true',
+                        help='未指定-f/-u时，使用服务端游标流式读取数据库中全部待检测URL（默认只读取5个）')
+    parser.add_argument('--no-keep-results', dest='keep_results', action='store_false', default=None,
+                        help='不在内存中保留检测结果，只写入结果文件与数据库（适合大批量检测）')
+    parser.add_argument('--metrics-file',
+                        help='每轮检测结束后将累计的阶段耗时、出错次数与缓存命中等指标（Prometheus文本格式）写入该文件')
+    parser.add_argument('--timings', action='store_true', help='每轮检测结束后输出各阶段耗时分位数表')
+    parser.add_argument('--attach-timings', action='store_true',
+                        help='在检测结果的特征中附加各阶段耗时（stage_timings）')
+    parser.add_argument('--engine', choices=('thread', 'async'), default='thread',
+                        help='检测引擎：thread为多线程（默认），async为基于asyncio的异步引擎（需安装aiohttp）')
+    parser.add_argument('--concurrency', type=int,
+                        help='异步引擎同时检测的网站数，默认取配置async_concurrency')
+    return parser.parse_args(argv)
+
+
+def run_detection_round(detector, args, span_stats=None):
+    """执行一轮检测：获取URL、检测并保存结果与报告；传入span_stats时输出本轮各阶段耗时分位数表"""
+    # 获取URL列表（文件与数据库流式读取时为迭代器，检测过程中逐个读取）
     urls = []
     if args.file:
         try:
-            with open(args.file, 'r', encoding='utf-8') as f:
-                urls = [line.strip() for line in f if line.strip()]
-            color_printer.print_success(f"成功读取 {len(urls)} 个URL")
+            urls = iter_urls_from_file(args.file)
+            first_url = next(urls, None)
+            color_printer.print_success(f"开始逐行读取URL文件: {args.file}")
         except Exception as e:
             color_printer.print_error(f"读取文件失败: {e}")
             return
+        urls = itertools.chain([first_url], urls) if first_url is not None else []
     elif args.urls:
         urls = args.urls
         color_printer.print_success(f"检测到 {len(urls)} 个URL参数")
+    elif args.db_stream:
+        try:
+            urls = iter_urls_from_mysql()
+            first_url = next(urls, None)
+        except Exception as e:
+            color_printer.print_error(f"从数据库读取URL失败: {e}")
+            return
+        urls = itertools.chain([first_url], urls) if first_url is not None else []
     else:
-        # 使用示例URL进行测试
+        # 从数据库获取待检测URL
         urls = get_urls_from_mysql()
-        # if not urls:
-        #     # 如果从数据库获取失败，使用备用的示例URL
-        #     color_printer.print_warning("从数据库获取URL失败，使用示例URL进行测试")
-        #     urls = [
-        #         "http://36guanxiang.com",
-        #         "http://51dxjy.com", 
-        #         "http://etdd.cn",
-        #         "http://fast024.com",
-        #         "http://gsmoyy.com",
-        #         "http://hry.lmtc.work"
-        #     ]
-        #     color_printer.print_info("使用示例URL进行测试")
-        # else:
-        #     color_printer.print_info("从数据库获取URL成功")
     
     if not urls:
         color_printer.print_error("没有提供待检测的URL")
         return
     
-    # 执行检测
-    detector = BatchDetector(max_workers=args.workers)
-    color_printer.print(f"🚀 开始检测 {len(urls)} 个网站...", 'cyan', bold=True)
-    
-    results = detector.detect_batch(urls)
-    
-    # 保存结果
-    color_printer.print_info("正在保存检测结果...")
-    json_file, csv_file = detector.save_results(args.output)
+    # 执行检测，结果逐条写入JSONL、CSV与数据库
+    if isinstance(urls, list):
+        color_printer.print(f"🚀 开始检测 {len(urls)} 个网站...", 'cyan', bold=True)
+    else:
+        color_printer.print("🚀 开始检测（流式读取URL）...", 'cyan', bold=True)
+    output_prefix = args.output or f"detection_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    json_file, csv_file = f"{output_prefix}.jsonl", f"{output_prefix}.csv"
+    sinks = [JSONLResultSink(json_file), CSVResultSink(csv_file), MySQLResultSink()]
+    try:
+        results = detector.detect_batch(urls, sinks=sinks)
+    finally:
+        color_printer.print_info("正在保存检测结果...")
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"关闭结果输出失败: {e}")
     
     # 生成并保存报告
     color_printer.print_info("正在生成检测报告...")
@@ -2268,52 +4994,121 @@ def main():
     with open(report_file, 'w', encoding='utf-8') as f:
         f.write(report)
     
+    # 保存进程累计指标（常驻运行时每轮覆盖）
+    if args.metrics_file:
+        with open(args.metrics_file, 'w', encoding='utf-8') as f:
+            f.write(METRICS.render())
+    
     # 彩色完成信息
     color_printer.print_header("🎉 检测完成！")
     color_printer.print(f"📁 结果文件:", 'cyan')
-    color_printer.print(f"• JSON详细数据: {json_file}", 'white')
+    color_printer.print(f"• JSONL详细数据: {json_file}", 'white')
     color_printer.print(f"• CSV简要结果: {csv_file}", 'white')  
     color_printer.print(f"• 中文检测报告: {report_file}", 'white')
+    if args.metrics_file:
+        color_printer.print(f"• 检测指标: {args.metrics_file}", 'white')
     
     # 显示最终统计
     detector.print_summary(results)
+    
+    if span_stats is not None:
+        color_printer.print_header("⏱️ 各阶段耗时（毫秒）")
+        print(span_stats.format_table())
+        span_stats.reset()
 
-if __name__ == '__main__':
-    # 设置信号处理，允许优雅退出
+
+def run_daemon(detector, args, span_stats=None):
+    """常驻运行：检测器、缓存与连接池只创建一次，按间隔轮询待检测URL
+
+    黑名单每轮增量同步（每隔blacklist_update_interval秒全量同步一次），模型文件有变化时才重新加载；
+    收到SIGINT/SIGTERM后等待当前轮次完成再退出，再次按 Ctrl+C 立即中断
+    """
+    stop_event = threading.Event()
+    
     def signal_handler(sig, frame):
-        print('\n🛑 程序已停止')
-        sys.exit(0)
+        print('\n🛑 收到停止信号，当前轮次完成后退出（再次按 Ctrl+C 立即中断）')
+        stop_event.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
     
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
     
     print("🚀 违法网站批量检测系统已启动")
-    print("📅 定时任务：每隔10秒运行一次检测")
+    print(f"📅 定时任务：每隔{args.interval:g}秒运行一次检测")
     print("⌨️  按 Ctrl+C 可以随时停止程序\n")
     
-    # 定时任务主循环
     iteration = 1
     try:
-        while True:
+        while not stop_event.is_set():
             print(f"\n🔄 第{iteration}轮检测开始")
             start_time = time.time()
             
-            # 执行主检测逻辑
-            main()
+            try:
+                # 黑名单按水位增量同步，只拉取上一轮之后新增或变更的记录
+                update_blacklist_from_db()
+                detector.detector.refresh_reference_data()
+                
+                run_detection_round(detector, args, span_stats)
+            except Exception as e:
+                # 单轮出错不影响后续轮次
+                print(f"❌ 第{iteration}轮检测出错: {e}")
+                logger.exception(f"第{iteration}轮检测出错")
             
             # 计算本次执行耗时
             elapsed_time = time.time() - start_time
             print(f"✅ 第{iteration}轮检测完成，耗时: {elapsed_time:.2f}秒")
-            
-            # 增加轮次计数
             iteration += 1
             
-            # 等待10秒后再次执行
-            wait_time = 10
-            print(f"⏳ 等待{wait_time}秒后进行下一轮检测...")
-            time.sleep(wait_time)
-            
-    except Exception as e:
-        print(f"❌ 程序运行出错: {e}")
-        
+            if not stop_event.is_set():
+                print(f"⏳ 等待{args.interval:g}秒后进行下一轮检测...")
+                stop_event.wait(args.interval)
+    except KeyboardInterrupt:
+        print('\n🛑 检测已中断')
+    finally:
+        get_keyword_store().stop()
+        get_db_pool().close()
+        print('🛑 程序已停止')
 
+
+def main(argv=None):
+    """主函数 - 彩色输出版"""
+    args = parse_args(argv)
     
+    # 彩色欢迎信息
+    color_printer.print_header("🛡️ 违法网站批量检测系统 v2.0")
+    color_printer.print("📋 功能特性:", 'cyan', bold=True)
+    color_printer.print("• 多维度特征分析", 'white')
+    color_printer.print("• 机器学习风险预测", 'white') 
+    color_printer.print("• 实时彩色输出", 'white')
+    color_printer.print("• 详细中文报告", 'white')
+    print()
+    
+    # 检测器（关键词、黑名单、模型、连接池）只创建一次，各轮检测复用
+    if args.engine == 'async':
+        # 异步引擎依赖aiohttp，按需导入
+        from async_website_detector import AsyncBatchDetector
+        detector = AsyncBatchDetector(max_concurrency=args.concurrency, keep_results=args.keep_results)
+    else:
+        detector = BatchDetector(max_workers=args.workers, keep_results=args.keep_results)
+    
+    # 分段计时（未启用时不做任何计时）
+    span_stats = None
+    if args.timings:
+        span_stats = SpanStats()
+        TRACER.add_hook(span_stats)
+    if args.attach_timings:
+        TRACER.attach_to_results = True
+    
+    if args.once:
+        # 从数据库更新恶意域名及恶意IP文件
+        update_blacklist_from_db()
+        detector.detector.refresh_reference_data()
+        run_detection_round(detector, args, span_stats)
+    else:
+        run_daemon(detector, args, span_stats)
+
+
+if __name__ == '__main__':
+    # 以脚本运行时注册为batch_website_detector模块，按需导入的异步引擎与本模块共享主机限速、指标与计时等全局状态
+    sys.modules.setdefault('batch_website_detector', sys.modules[__name__])
+    main()
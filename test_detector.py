@@ -6,7 +6,41 @@
 
 import sys
 import os
-from batch_website_detector import BatchDetector, WebsiteDetector
+import json
+import csv
+import random
+import asyncio
+import datetime
+import tempfile
+import threading
+import time
+import dns.name
+import dns.resolver
+from concurrent.futures import ThreadPoolExecutor
+from batch_website_detector import (
+    BatchDetector, WebsiteDetector, KeywordMatcher, KeywordStore, DomainSuffixIndex, IPRangeIndex,
+    BrandIndex, RISK_RULES, RuleScorer, rule_based_risk, FeatureRecord, FEATURE_TRANSLATIONS, result_json_default,
+    JSONLResultSink, CSVResultSink, BatchJobStore, BatchJobRunner, DetectionResultCache, normalize_url,
+    DetectionResult, SingleFlight, HostLimiter, HostScheduler, HostFeatureCache, MetricsRegistry, SpanTracer, SpanStats,
+    HOST_LIMITER, HostBusyError, PageFetch, DnsCache
+)
+from async_website_detector import AsyncWebsiteDetector, AsyncBatchDetector
+
+def make_batch_detector(detector=None, **settings):
+    """构建测试用的BatchDetector：不加载关键词、模型等参考数据，settings覆盖调度参数
+
+    未传入detector时使用占位对象，适用于替换了_extract_features的测试
+    """
+    batch_detector = BatchDetector(
+        max_workers=settings.pop('max_workers', 4),
+        keep_results=settings.pop('keep_results', True),
+        detector=detector if detector is not None else object()
+    )
+    batch_detector.score_batch_interval = 0.05
+    for name, value in settings.items():
+        assert hasattr(batch_detector, name), name
+        setattr(batch_detector, name, value)
+    return batch_detector
 
 def test_single_detection():
     """测试单个网站检测"""
@@ -90,6 +124,784 @@ def test_from_file():
     else:
         print("sample_urls.txt 文件不存在")
 
+def test_keyword_matcher():
+    """测试关键词自动机与逐词匹配结果一致"""
+    print("\n=== 测试关键词自动机 ===")
+
+    with open("keyword.json", 'r', encoding='utf-8') as f:
+        keywords = json.loads(f.read().lstrip('\ufeff'))
+    keywords['测试类别'] = ['AB', 'ab', 'b', 'abc', 'bca', '']
+    matcher = KeywordMatcher(keywords)
+
+    all_keywords = [keyword for values in keywords.values() for keyword in values]
+    rng = random.Random(42)
+    for _ in range(200):
+        parts = [rng.choice(all_keywords)[:rng.randint(0, 8)] for _ in range(20)] + ['abcab']
+        rng.shuffle(parts)
+        text = ''.join(parts).lower()
+        expected = {category: sum(1 for keyword in values if keyword.lower() in text)
+                    for category, values in keywords.items()}
+        assert matcher.count(text) == expected
+
+    print(f"共 {matcher.keyword_count} 个关键词，匹配结果一致")
+
+def test_keyword_store():
+    """测试关键词库只在关键词变化时重建匹配器"""
+    print("\n=== 测试关键词库刷新 ===")
+
+    versions = [{'涉赌': ['赌场']}, {'涉赌': ['赌场']}, {'涉赌': ['赌场', '百家乐']}, {}]
+    store = KeywordStore(loader=lambda: versions.pop(0), refresh_interval=0)
+    first = store.matcher
+    assert first.count('赌场') == {'涉赌': 1}
+
+    assert not store.refresh()
+    assert store.matcher is first
+
+    assert store.refresh()
+    assert store.matcher is not first
+    assert store.matcher.count('百家乐赌场') == {'涉赌': 2}
+    # 旧快照不受刷新影响
+    assert first.count('百家乐赌场') == {'涉赌': 1}
+
+    # 加载失败（空结果）时保留现有关键词
+    current = store.matcher
+    assert not store.refresh()
+    assert store.matcher is current
+
+    print("关键词库刷新正常")
+
+def test_blacklist_index():
+    """测试黑名单上级域名、通配符与CIDR网段匹配"""
+    print("\n=== 测试黑名单索引 ===")
+
+    domains = DomainSuffixIndex(['evil.com', '*.wild.org', 'Bad.NET.'])
+    for host, expected in [('evil.com', True), ('www.evil.com', True), ('m.a.evil.com:8080', True),
+                           ('notevil.com', False), ('evil.co', False), ('wild.org', False),
+                           ('cdn.wild.org', True), ('bad.net', True)]:
+        assert domains.match(host) == expected, host
+
+    ips = IPRangeIndex(['1.2.3.4', '10.0.0.0/8', '10.1.0.0/16', '2001:db8::/32', 'not-an-ip'])
+    ips.update(['11.0.0.0/8'])
+    assert len(ips) == 3  # 10.0.0.0/8 与 11.0.0.0/8 相邻合并，10.1.0.0/16 被包含
+    for ip, expected in [('1.2.3.4', True), ('1.2.3.5', False), ('10.255.255.255', True),
+                         ('11.0.0.1', True), ('12.0.0.0', False), ('2001:db8::1', True),
+                         ('::1', False), ('garbage', False)]:
+        assert ips.match(ip) == expected, ip
+
+    print("黑名单索引匹配正常")
+
+def test_brand_index():
+    """测试品牌相似度索引与逐个计算编辑距离结果一致"""
+    print("\n=== 测试品牌相似度索引 ===")
+
+    detector = WebsiteDetector()
+    rng = random.Random(7)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+    brands = detector.brand_keywords + [''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 14)))
+                                        for _ in range(500)]
+    index = BrandIndex(brands)
+
+    for _ in range(200):
+        text = rng.choice(brands)[:rng.randint(1, 14)] + rng.choice(['', '.com', '-login.cn', ':8080'])
+        if rng.random() < 0.5:
+            text = ''.join(rng.choice(alphabet + '.-0') for _ in range(rng.randint(0, 20)))
+        similarities = sorted((max(0, 1 - detector._calculate_levenshtein_distance(text, brand) / max(len(text), len(brand)))
+                               for brand in index.brands), reverse=True)
+        expected = [similarity for similarity in similarities[:3] if similarity > 0]
+        assert [similarity for _, similarity in index.closest(text, 3)] == expected, text
+        assert index.best_similarity(text) == (similarities[0] if text else 0), text
+
+    print(f"共 {len(index.brands)} 个品牌，相似度结果一致")
+
+def test_rule_scorer():
+    """测试向量化规则评分与逐条规则评分结果一致"""
+    print("\n=== 测试向量化规则评分 ===")
+
+    # 缺失特征按0处理：无SSL(15)、证书无效(20)、非可信CA(10)、证书即将过期(10)、无法访问(30)、DNS未解析(25)
+    assert rule_based_risk({}) == ('HIGH', 100)
+
+    rng = random.Random(13)
+    features_list = []
+    for _ in range(2000):
+        features = {}
+        for rule in RISK_RULES:
+            for feature, threshold in ((rule.feature, rule.threshold), rule.also[:3:2] if rule.also else (None, None)):
+                if feature and rng.random() < 0.8:
+                    features[feature] = rng.choice([0, 1, threshold, threshold + rng.choice([-1, 1]) * rng.random() * 10,
+                                                    rng.randint(-5, 500)])
+        features['sensitive_gambling'] = rng.randint(0, 8)
+        features['sensitive_fraud'] = rng.randint(0, 8)
+        features_list.append(features)
+
+    scorer = RuleScorer()
+    expected = [rule_based_risk(features) for features in features_list]
+    assert scorer.score(features_list) == expected
+    assert scorer.score([]) == []
+
+    levels = {level: sum(1 for item in expected if item[0] == level) for level in ('HIGH', 'MEDIUM', 'LOW')}
+    print(f"共 {len(features_list)} 组特征，评分结果一致 {levels}")
+
+def test_feature_record():
+    """测试紧凑特征记录与检测结果的中文视图"""
+    print("\n=== 测试紧凑特征记录 ===")
+
+    features = {
+        'url': 'http://example.com',
+        'domain_length': 11,
+        'domain_age_days': -1,
+        'has_ssl': 0,
+        'response_time': 0.35,
+        'server_header': '',
+        'first_ip': '93.184.216.34',
+        'final_url': 'http://example.com/',
+        'sensitive_custom': 2,
+        'subpage_keywords': {'博彩': 3},
+        'subpage_details': [
+            {'url': 'http://example.com/a', 'risk_score': 40, 'keyword_count': 3, 'has_login_form': 1, 'script_count': 2}
+        ],
+        'huge_count': 2 ** 60,
+    }
+    record = FeatureRecord(features)
+    assert record.to_dict() == features
+    assert list(record) == list(features)
+    assert type(record['domain_length']) is int and type(record['response_time']) is float
+    assert record.get('missing', 'x') == 'x' and 'missing' not in record
+
+    translated = record.translated()
+    assert translated['网址'] == 'http://example.com'
+    assert translated[FEATURE_TRANSLATIONS['domain_length']] == 11
+    # -1与空字符串不出现在中文视图中
+    assert FEATURE_TRANSLATIONS['domain_age_days'] not in translated
+    assert FEATURE_TRANSLATIONS['server_header'] not in translated
+    assert translated[FEATURE_TRANSLATIONS['subpage_details']] == features['subpage_details']
+
+    detector = make_batch_detector()
+    assert detector._translate_features(features) == translated
+    result = detector._make_result(features['url'], features, 'MEDIUM', 45)
+    assert result['风险等级'] == '中风险' and result['风险评分'] == '45%'
+    assert result['详细特征'] == translated
+    assert json.loads(json.dumps(result, default=result_json_default))['英文原文']['features'] == features
+
+    # 检测失败的结果与正常结果类型一致
+    error_result = detector._build_error_result('http://down.com', TimeoutError('timed out'))
+    assert isinstance(error_result, DetectionResult) and error_result['风险等级'] == '检测失败'
+    assert error_result['风险评分'] == '0%' and error_result['错误信息'] == 'timed out'
+    assert error_result['详细特征'] == {} and error_result['英文原文']['risk_level'] == 'ERROR'
+    assert list(error_result)[-1] == '错误信息' and '错误信息' not in result
+    assert json.loads(json.dumps(error_result, default=result_json_default))['英文原文']['features'] == {}
+    print(f"特征记录还原一致，中文视图 {len(translated)} 项")
+
+def test_result_sinks():
+    """测试检测结果逐条写入输出端"""
+    print("\n=== 测试流式结果输出 ===")
+
+    features = {'url': 'http://example.com', 'domain_length': 11, 'has_ssl': 0}
+    detector = make_batch_detector(keep_results=False)
+    results = [detector._make_result(f'http://site{i}.com', features, 'HIGH' if i % 3 == 0 else 'LOW', 80 if i % 3 == 0 else 10)
+               for i in range(10)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, 'results.jsonl')
+        csv_path = os.path.join(tmp, 'results.csv')
+        jsonl_sink = JSONLResultSink(jsonl_path, buffer_size=4, flush_interval=3600)
+        csv_sink = CSVResultSink(csv_path, buffer_size=4, flush_interval=3600)
+        for result in results[:5]:
+            detector._record_result(result, (jsonl_sink, csv_sink))
+
+        # 缓冲满4条即写出，第5条仍在缓冲区中
+        with open(jsonl_path, encoding='utf-8') as f:
+            assert len(f.readlines()) == 4
+
+        for result in results[5:]:
+            detector._record_result(result, (jsonl_sink, csv_sink))
+        jsonl_sink.close()
+        csv_sink.close()
+
+        with open(jsonl_path, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        assert [line['网址'] for line in lines] == [result['网址'] for result in results]
+        assert lines[0]['英文原文']['features'] == features
+        with open(csv_path, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == ['网址', '风险等级', '风险评分', '检测时间'] and len(rows) == 11
+
+    # 未保留结果时统计与报告仍使用计数
+    assert detector.results == []
+    assert detector.risk_counts == {'高风险': 4, '低风险': 6}
+    assert '检测网站总数: 10 个' in detector.generate_report()
+    print(f"写出 {len(lines)} 条结果，风险统计 {detector.risk_counts}")
+
+def test_streaming_input():
+    """测试迭代器输入时同时检测的URL数量有上限"""
+    print("\n=== 测试流式URL输入 ===")
+
+    detector = make_batch_detector(max_workers=4, max_in_flight=8, schedule_lookahead=1, score_batch_size=16)
+
+    lock = threading.Lock()
+    state = {'read': 0, 'done': 0, 'max_ahead': 0}
+
+    def url_source(count):
+        for i in range(count):
+            with lock:
+                state['read'] += 1
+                state['max_ahead'] = max(state['max_ahead'], state['read'] - state['done'])
+            yield f'http://site{i}.com'
+
+    def fake_extract(url, host_cache=None):
+        time.sleep(0.002)
+        with lock:
+            state['done'] += 1
+        return url, {'url': url}, None
+
+    detector._extract_features = fake_extract
+    detector._score_batch = lambda extracted: [{'网址': url, '风险等级': '低风险'} for url, _, _ in extracted]
+
+    results = detector.detect_batch(url_source(300))
+    assert len(results) == 300
+    assert sorted(r['网址'] for r in results) == sorted(f'http://site{i}.com' for i in range(300))
+    # 已读取但未完成特征提取的URL数不超过提交窗口
+    assert state['max_ahead'] <= detector.max_in_flight
+    print(f"检测 {len(results)} 个URL，最多同时读取 {state['max_ahead']} 个")
+
+def test_batch_jobs():
+    """测试批量检测任务的持久化与重启后继续执行"""
+    print("\n=== 测试批量检测任务 ===")
+
+    detector = make_batch_detector(max_workers=2, keep_results=False, max_in_flight=4, schedule_lookahead=100,
+                                   score_batch_size=8)
+    detected = []
+
+    def fake_extract(url, host_cache=None):
+        detected.append(url)
+        return url, {'url': url}, None
+
+    detector._extract_features = fake_extract
+    detector._score_batch = lambda extracted: [
+        {'网址': url, '风险等级': '高风险' if 'bad' in url else '低风险', '风险评分': '50%'} for url, _, _ in extracted
+    ]
+
+    urls = ['a.com', 'http://bad.com', 'a.com', 'https://c.com', 'bad.org']
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'jobs.db')
+        store = BatchJobStore(path)
+        job_id = store.create(['http://' + url if '://' not in url else url for url in urls], save_to_db=False)
+        assert store.claim_next()['id'] == job_id
+        # 模拟执行到一半时进程退出
+        store.add_results(job_id, [(0, '低风险', json.dumps({'网址': 'http://a.com'}))])
+        store.close()
+
+        store = BatchJobStore(path)
+        job = store.get(job_id)
+        assert job['status'] == BatchJobStore.QUEUED and job['completed'] == 1
+        runner = BatchJobRunner(store, detector)
+        runner.run_job(store.claim_next())
+        assert sorted(detected) == ['http://a.com', 'http://bad.com', 'http://bad.org', 'https://c.com']
+
+        job = store.get(job_id)
+        assert job['status'] == BatchJobStore.DONE and job['completed'] == job['total'] == 5
+        assert job['risk_counts'] == {'低风险': 3, '高风险': 2}
+        assert [r['网址'] for r in store.results(job_id, offset=1, limit=3)] == ['http://bad.com', 'http://a.com', 'https://c.com']
+        assert store.claim_next() is None
+        store.close()
+    print(f"任务 {job_id[:8]} 完成 {job['completed']}/{job['total']}，重启后只检测 {len(detected)} 个网站")
+
+def test_parallel_detect_urls():
+    """测试共享线程池中并发检测时结果顺序与并发上限"""
+    print("\n=== 测试并发批量检测 ===")
+
+    detector = make_batch_detector()
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def fake_extract(url, host_cache=None):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        # 序号越小耗时越长，完成顺序与提交顺序相反
+        time.sleep(0.002 * (40 - int(url.rsplit('/', 1)[1])))
+        with lock:
+            state['running'] -= 1
+        return url, {'url': url}, None
+
+    detector._extract_features = fake_extract
+    detector._score_batch = lambda extracted: [url for url, _, _ in extracted]
+
+    urls = [f'http://site.com/{i}' for i in range(40)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert detector.detect_urls(urls, executor=executor, max_concurrency=5) == urls
+        assert state['max_running'] <= 5
+        assert detector.detect_urls([], executor=executor) == []
+    assert detector.detect_urls(urls[:3]) == urls[:3]
+    print(f"检测 {len(urls)} 个URL，结果顺序一致，最大并发 {state['max_running']}")
+
+def test_result_cache():
+    """测试检测结果缓存的URL规范化、容量淘汰与过期"""
+    print("\n=== 测试检测结果缓存 ===")
+
+    assert normalize_url('Example.COM') == 'http://example.com/'
+    assert normalize_url('http://example.com:80/#top') == 'http://example.com/'
+    assert normalize_url('HTTPS://Example.com:443/a?x=1') == 'https://example.com/a?x=1'
+    assert normalize_url('example.com:8080/a') == 'http://example.com:8080/a'
+
+    cache = DetectionResultCache(max_entries=3, max_bytes=10 ** 6, ttl=3600)
+    for i in range(4):
+        cache.put(f'k{i}', {'网址': f'site{i}'})
+    # 超出条目数时淘汰最久未使用的结果
+    assert cache.get('k0') is None
+    assert cache.get('k1')[0] == {'网址': 'site1'}
+    cache.put('k4', {'网址': 'site4'})
+    assert cache.get('k2') is None and cache.get('k1') is not None
+
+    # 超出字节上限时同样淘汰
+    small = DetectionResultCache(max_entries=100, max_bytes=100, ttl=3600)
+    for i in range(10):
+        small.put(f'k{i}', {'网址': 'x' * 20, 'i': i})
+    stats = small.stats()
+    assert stats['bytes'] <= 100 and stats['entries'] < 10 and stats['evictions'] > 0
+    small.put('huge', {'网址': 'x' * 200})
+    assert small.get('huge') is None
+
+    expired = DetectionResultCache(ttl=0.05)
+    expired.put('k', {'网址': 'site'})
+    assert expired.get('k') is not None
+    time.sleep(0.06)
+    assert expired.get('k') is None and expired.stats()['entries'] == 0
+
+    # 网站无法访问或域名无法解析的结果只短时间缓存
+    detector = make_batch_detector()
+    down = detector._make_result('http://down.com', {'url': 'http://down.com', 'web_accessible': 0, 'dns_resolved': 1}, 'HIGH', 90)
+    unresolved = detector._make_result('http://nx.com', {'url': 'http://nx.com', 'web_accessible': 1, 'dns_resolved': 0}, 'HIGH', 90)
+    up = detector._make_result('http://up.com', {'url': 'http://up.com', 'web_accessible': 1, 'dns_resolved': 1}, 'LOW', 10)
+    failures = DetectionResultCache(ttl=3600, failure_ttl=0.05)
+    for key, result in (('down', down), ('nx', unresolved), ('up', up)):
+        failures.put(key, result)
+    assert failures.get('down') is not None and failures.get('nx') is not None
+    time.sleep(0.06)
+    assert failures.get('down') is None and failures.get('nx') is None and failures.get('up') is not None
+    no_failures = DetectionResultCache(failure_ttl=0)
+    no_failures.put('down', down)
+    assert no_failures.get('down') is None
+    print(f"缓存统计 {cache.stats()}")
+
+def test_single_flight():
+    """测试同一键的并发调用只执行一次"""
+    print("\n=== 测试并发请求合并 ===")
+
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_lookup(key):
+        calls.append(key)
+        started.set()
+        release.wait(5)
+        if key == 'bad.com':
+            raise ValueError('lookup failed')
+        return {'domain': key}
+
+    results = []
+    errors = []
+
+    def worker(key):
+        try:
+            results.append(flight.do(key, slow_lookup, key))
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=('example.com',)) for _ in range(5)]
+    threads += [threading.Thread(target=worker, args=('bad.com',)) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # 等待其余调用方进入等待状态后再放行
+    deadline = time.time() + 5
+    while flight.stats()['shared'] < 6 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(calls) == ['bad.com', 'example.com']
+    assert all(value == {'domain': 'example.com'} for value, _ in results) and len(results) == 5
+    assert sum(1 for _, shared in results if shared) == 4
+    assert errors == ['lookup failed'] * 3
+    # 调用结束后不缓存结果
+    assert flight.do('example.com', lambda: 'again') == ('again', False)
+    print(f"合并统计 {flight.stats()}")
+
+def test_host_politeness():
+    """测试按主机交错调度、请求速率限制与429/5xx退避"""
+    print("\n=== 测试主机礼貌调度 ===")
+
+    # 前8个URL都在同一主机上，调度时与其他主机交错，同一主机最多同时检测2个
+    urls = [f'http://big.com/{i}' for i in range(8)] + ['http://a.com/', 'b.com', 'http://c.com/x']
+    scheduler = HostScheduler(urls, max_per_host=2, lookahead=100)
+    first = [scheduler.next() for _ in range(5)]
+    assert [host for _, host in first] == ['big.com', 'a.com', 'b.com', 'c.com', 'big.com']
+    assert scheduler.next() is None
+    scheduler.done('big.com')
+    assert scheduler.next() == ('http://big.com/2', 'big.com')
+    assert not scheduler.empty
+
+    # 退避中的主机排在其他主机之后
+    limiter = HostLimiter(4, rate=0, backoff_base=30)
+    limiter.report('slow.com', 503)
+    assert 29 < limiter.backoff_remaining('slow.com') <= 30
+    scheduler = HostScheduler(['http://slow.com/1', 'http://ok.com/1'], lookahead=10, limiter=limiter)
+    assert scheduler.next()[1] == 'ok.com'
+    with limiter.slot('slow.com', timeout=0.1) as acquired:
+        assert not acquired
+
+    # 协程版本与同步调用方共享名额与退避
+    async def try_slot_async():
+        async with limiter.slot_async('slow.com', timeout=0.1) as acquired:
+            return acquired
+    assert asyncio.run(try_slot_async()) is False
+    limiter.report('slow.com', 200)
+    limiter.report('slow.com', 429, retry_after='2')
+    assert 1 < limiter.backoff_remaining('slow.com') <= 2
+
+    # 同一主机的请求按速率间隔开始
+    limiter = HostLimiter(4, rate=20)
+    started = time.time()
+    for _ in range(5):
+        with limiter.slot('fast.com') as acquired:
+            assert acquired
+    assert time.time() - started >= 0.19
+    print("主机交错调度、速率限制与退避正常")
+
+def test_host_feature_sharing():
+    """测试批量检测中同一主机的主机级特征只计算一次"""
+    print("\n=== 测试主机级特征共享 ===")
+
+    lock = threading.Lock()
+    computed = []
+
+    class FakeDetector:
+        def extract_host_features(self, host):
+            time.sleep(0.01)
+            with lock:
+                computed.append(host)
+            return {'host': host}, {'dns': host}
+
+        def extract_all_features(self, url, host_features=None):
+            domain_features, dns_features = host_features
+            return {'url': url, **domain_features, **dns_features}
+
+    detector = make_batch_detector(FakeDetector(), max_workers=8, max_in_flight=16, max_detections_per_host=4,
+                                   schedule_lookahead=1000, score_batch_size=8)
+    detector._score_batch = lambda extracted: [features for _, features, _ in extracted]
+
+    urls = [f'http://{host}/page{i}' for i in range(10) for host in ('a.com', 'b.com', 'c.com:8080')]
+    results = detector.detect_batch(urls)
+    assert len(results) == 30
+    assert all(r['host'] == r['dns'] == r['url'].split('/')[2] for r in results)
+    assert sorted(computed) == ['a.com', 'b.com', 'c.com:8080']
+
+    # 并发请求同一主机时只计算一次，discard后重新计算
+    computed.clear()
+    cache = HostFeatureCache(detector.detector.extract_host_features)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert len(set(map(id, executor.map(cache.get, ['x.com'] * 8)))) == 1
+    assert computed == ['x.com'] and (cache.computed, cache.reused) == (1, 7)
+    cache.discard('x.com')
+    cache.get('x.com')
+    assert computed == ['x.com', 'x.com']
+    print(f"{len(urls)} 个URL只计算 3 次主机级特征")
+
+def test_metrics_registry():
+    """测试阶段耗时、出错计数与Prometheus文本格式输出"""
+    print("\n=== 测试检测指标 ===")
+
+    metrics = MetricsRegistry(buckets=(0.1, 1.0))
+    metrics.describe('detector_stage_seconds', 'histogram', '检测各阶段耗时（秒）')
+    metrics.observe('detector_stage_seconds', 0.05, {'stage': 'whois'})
+    metrics.observe('detector_stage_seconds', 0.5, {'stage': 'whois'})
+    metrics.observe('detector_stage_seconds', 3, {'stage': 'whois'})
+    with metrics.time_stage('dns'):
+        pass
+    try:
+        with metrics.time_stage('dns'):
+            raise OSError('timeout')
+    except OSError:
+        pass
+    metrics.register('detector_cache_hit_ratio', 'gauge', '缓存命中率', lambda: [({'cache': 'whois'}, 0.75)])
+    metrics.register('detector_cache_hit_ratio', 'gauge', '缓存命中率', lambda: None)
+    metrics.register('detector_executor_queue_depth', 'gauge', '线程池中等待执行的任务数', lambda: 1 / 0)
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE detector_stage_seconds histogram' in lines
+    assert 'detector_stage_seconds_bucket{stage="whois",le="0.1"} 1' in lines
+    assert 'detector_stage_seconds_bucket{stage="whois",le="1.0"} 2' in lines
+    assert 'detector_stage_seconds_bucket{stage="whois",le="+Inf"} 3' in lines
+    assert 'detector_stage_seconds_sum{stage="whois"} 3.55' in lines
+    assert 'detector_stage_seconds_count{stage="dns"} 2' in lines
+    assert 'detector_stage_errors_total{stage="dns"} 1' in lines
+    assert 'detector_cache_hit_ratio{cache="whois"} 0.75' in lines
+    assert not any(line.startswith('detector_executor_queue_depth') for line in lines)
+    assert metrics.histogram_stats('detector_stage_seconds')[(('stage', 'whois'),)][0] == 3
+    print(f"输出 {len(lines)} 行指标")
+
+def test_span_tracer():
+    """测试分段计时的嵌套关系、钩子与耗时分位数表"""
+    print("\n=== 测试分段计时 ===")
+
+    tracer = SpanTracer()
+    # 未启用时不计时
+    with tracer.span('detect') as span:
+        assert span is None
+
+    finished = []
+    stats = SpanStats()
+    tracer.add_hook(lambda span: finished.append(span.path))
+    tracer.add_hook(stats)
+    tracer.add_hook(lambda span: 1 / 0)  # 出错的钩子不影响检测
+
+    @tracer.traced('whois')
+    def lookup():
+        time.sleep(0.01)
+
+    for _ in range(3):
+        with tracer.span('detect', url='http://a.com') as root:
+            with tracer.span('domain'):
+                lookup()
+            try:
+                with tracer.span('tls'):
+                    raise OSError('handshake failed')
+            except OSError:
+                pass
+            with tracer.span('domain'):
+                pass
+    assert finished[:4] == ['detect/domain/whois', 'detect/domain', 'detect/tls', 'detect/domain']
+    assert root.attributes == {'url': 'http://a.com'} and root.children[1].error == 'OSError'
+    timings = root.timings()
+    assert list(timings) == ['domain', 'domain/whois', 'tls']
+    assert timings['domain'] >= timings['domain/whois'] >= 0.01
+
+    summary = stats.summary()
+    assert summary['detect']['count'] == 3 and summary['detect/tls']['errors'] == 3
+    assert summary['detect/domain']['count'] == 6
+    assert 0.01 <= summary['detect/domain/whois']['p50'] <= summary['detect/domain/whois']['max']
+    table = stats.format_table().splitlines()
+    assert len(table) == 5 and table[3].startswith('    whois')
+    print(stats.format_table())
+
+    tracer = SpanTracer()
+    tracer.add_hook(finished.append)
+    tracer.remove_hook(finished.append)
+    with tracer.span('detect') as span:
+        assert span is None
+
+def test_subpage_budget():
+    """测试子页面在共享线程池中检测，超出时间预算后不再开始新的子页面"""
+    print("\n=== 测试子页面时间预算 ===")
+
+    detector = WebsiteDetector.__new__(WebsiteDetector)
+    detector.subpage_workers = 2
+    detector.subpage_budget = 0.25
+    links = [f'http://site.com/p{i}' for i in range(10)]
+    detector._collect_internal_links = lambda url, page: links
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0, 'started': []}
+
+    def fake_scan(subpage_url, deadline, matcher=None):
+        with lock:
+            state['started'].append(subpage_url)
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.1)
+        with lock:
+            state['running'] -= 1
+        return {'url': subpage_url, 'risk_score': 80, 'keyword_count': 6, 'has_login_form': 0, 'script_count': 0}, {}
+
+    detector._scan_subpage = fake_scan
+    page = type('Page', (), {'error': None})()
+    started = time.time()
+    features = detector._extract_subpage_features('http://site.com/', page, matcher=object())
+    assert time.time() - started < 0.4
+    # 同时最多检测2个子页面，预算内只开始了前几个子页面，其余子页面不再提交
+    assert state['max_running'] <= 2
+    assert 2 <= features['subpage_count'] <= 4 < len(links)
+    assert state['started'] == links[:len(state['started'])] and len(state['started']) <= 6
+    assert [detail['url'] for detail in features['subpage_details']] == links[:features['subpage_count']]
+    print(f"预算内完成 {features['subpage_count']} 个子页面，共开始 {len(state['started'])} 个")
+
+def test_host_busy_requeue():
+    """测试主机退避时主页面等待名额有上限，批量检测将繁忙主机的URL重新排队"""
+    print("\n=== 测试繁忙主机重新排队 ===")
+
+    # 主机退避中时最多等待host_slot_timeout秒，不占用检测线程等到退避结束
+    detector = WebsiteDetector.__new__(WebsiteDetector)
+    detector.host_slot_timeout = 0.1
+    HOST_LIMITER.report('busy.test', 503, retry_after='30')
+    started = time.time()
+    try:
+        detector._collect_features('http://busy.test/', host_features=({}, {}))
+        assert False, '应抛出HostBusyError'
+    except HostBusyError as e:
+        assert 'busy.test' in str(e)
+    finally:
+        HOST_LIMITER.report('busy.test', 200)
+    assert time.time() - started < 1
+
+    # 批量检测：繁忙的URL放回队列重试，超过重试次数后记为检测失败
+    lock = threading.Lock()
+    attempts = {}
+
+    def fake_extract(url, host_cache=None):
+        with lock:
+            attempts[url] = attempts.get(url, 0) + 1
+            count = attempts[url]
+        if url == 'http://down.com/' or (url == 'http://slow.com/' and count < 3):
+            return url, None, HostBusyError(url)
+        return url, {'url': url}, None
+
+    batch = make_batch_detector(max_workers=2, host_busy_retries=3, schedule_lookahead=100)
+    batch._extract_features = fake_extract
+    batch._score_batch = lambda extracted: [{'url': url, 'ok': error is None} for url, _, error in extracted]
+    urls = ['http://slow.com/', 'http://ok.com/', 'http://down.com/']
+    results = {r['url']: r['ok'] for r in batch.detect_batch(urls)}
+    assert results == {'http://slow.com/': True, 'http://ok.com/': True, 'http://down.com/': False}
+    assert attempts == {'http://slow.com/': 3, 'http://ok.com/': 1, 'http://down.com/': 4}
+    print(f"繁忙主机重试次数: {attempts}")
+
+def test_async_parity():
+    """测试异步引擎与多线程引擎提取的特征一致（页面请求、DNS、TLS与WHOIS均为桩实现）"""
+    print("\n=== 测试异步引擎特征一致性 ===")
+
+    detector = WebsiteDetector()
+    category, words = next(iter(detector.sensitive_keywords.items()))
+    keyword = words[0]
+    pages = {
+        'https://parity.test/': f'<html><body><p>{keyword} {keyword}</p><a href="/a">a</a><a href="/b#x">b</a>'
+                                f'<a href="http://other.test/">o</a><form><input type="password"></form></body></html>',
+        'https://parity.test/a': f'<html><body>{keyword}<script>eval(1)</script></body></html>',
+        'https://parity.test/b': '<html><body>about</body></html>',
+    }
+    dns_records = {'A': ['93.184.216.34', '93.184.216.35'], 'MX': ['10 mail.parity.test.'], 'TXT': ['"v=spf1 -all"']}
+    certificate = {
+        'issuer': ((('organizationName', "Let's Encrypt"),),),
+        'subject': ((('commonName', 'parity.test'),),),
+        'notBefore': 'Jan  1 00:00:00 2024 GMT', 'notAfter': 'Jan  1 00:00:00 2099 GMT',
+    }
+    whois_info = {'creation_date': datetime.datetime(2020, 1, 1), 'expiration_date': datetime.datetime(2099, 1, 1)}
+
+    def fetch(url, timeout=None):
+        if url not in pages:
+            return PageFetch(url, error=ConnectionError(url))
+        return PageFetch(url, content=pages[url].encode(), status_code=200, headers={'Server': 'nginx'},
+                         final_url=url, history=[], elapsed=0.05)
+
+    async def fetch_async(url, timeout=None):
+        return fetch(url)
+
+    async def resolve_async(domain):
+        return dns_records
+
+    async def certificate_async(host):
+        return certificate
+
+    detector._fetch_page = fetch
+    detector._resolve_dns = lambda domain: dns_records
+    detector._get_peer_certificate = lambda host: certificate
+    detector._lookup_whois = lambda domain: whois_info
+
+    async def extract_async(urls):
+        async with AsyncWebsiteDetector(detector) as engine:
+            engine._fetch_page = fetch_async
+            engine._resolve_dns = resolve_async
+            engine._get_peer_certificate = certificate_async
+            return await asyncio.gather(*(engine.extract_all_features(url) for url in urls))
+
+    urls = ['https://parity.test/', 'https://parity.test/missing']
+    async_features = asyncio.run(extract_async(urls))
+    for url, features in zip(urls, async_features):
+        expected = detector.extract_all_features(url)
+        assert features == expected, {k for k in expected if features.get(k) != expected[k]}
+        assert detector.predict_risk(features) == detector.predict_risk(expected)
+    assert async_features[0]['subpage_count'] == 2 and async_features[0][f'sensitive_{category}'] > 0
+    assert async_features[0]['dns_resolved'] == 1 and async_features[0]['trusted_ca'] == 1
+
+    # 异步批量检测的结果逐条写入输出端，keep_results为False时不在内存中保留
+    # 异步批量检测按主机交错调度，同一主机同时检测的URL不超过per_host_detections个，主机繁忙的URL重新排队
+    running = {}
+    max_running = {}
+    attempts = {}
+
+    async def fake_extract(engine, url, host_cache):
+        host = url.split('/')[2]
+        attempts[url] = attempts.get(url, 0) + 1
+        running[host] = running.get(host, 0) + 1
+        max_running[host] = max(max_running.get(host, 0), running[host])
+        await asyncio.sleep(0.01)
+        running[host] -= 1
+        if url == 'https://big.test/3' and attempts[url] == 1:
+            return url, None, HostBusyError(url)
+        return url, dict(async_features[0], url=url), None
+
+    # 结果逐条写入输出端，keep_results为False时不在内存中保留
+    batch = AsyncBatchDetector(max_concurrency=8, keep_results=False, detector=detector)
+    batch.max_detections_per_host = 2
+    batch._extract_features_async = fake_extract
+    batch_urls = [f'https://big.test/{i}' for i in range(8)] + ['https://a.test/', 'https://b.test/']
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, 'results.jsonl')
+        sink = JSONLResultSink(jsonl_path, buffer_size=4, flush_interval=3600)
+        assert batch.detect_batch(iter(batch_urls), sinks=(sink,)) == []
+        sink.close()
+        with open(jsonl_path, encoding='utf-8') as f:
+            assert sorted(json.loads(line)['网址'] for line in f) == sorted(batch_urls)
+    assert sum(batch.risk_counts.values()) == len(batch_urls) and '检测失败' not in batch.risk_counts
+    assert max_running['big.test'] == 2 and attempts['https://big.test/3'] == 2
+
+    # 异步DNS查询共享NXDOMAIN负缓存，同一域名同一记录类型的并发查询只发起一次
+    queries = []
+
+    class DeadResolver:
+        async def resolve(self, domain, record_type):
+            queries.append((domain, record_type))
+            await asyncio.sleep(0.01)
+            raise dns.resolver.NXDOMAIN(qnames=[dns.name.from_text(domain)])
+
+    async def resolve_twice(cache):
+        return await asyncio.gather(*(cache.resolve_records_async('dead.test') for _ in range(2)))
+
+    dns_cache = DnsCache(negative_ttl=60)
+    dns_cache._async_resolver = DeadResolver()
+    for records in asyncio.run(resolve_twice(dns_cache)) + asyncio.run(resolve_twice(dns_cache)):
+        assert all(isinstance(records[record_type], dns.resolver.NXDOMAIN) for record_type in ('A', 'MX', 'TXT'))
+    assert sorted(queries) == [('dead.test', 'A'), ('dead.test', 'MX'), ('dead.test', 'TXT')]
+    print(f"{len(urls)} 个URL的异步与多线程特征一致，异步批量检测写出 {len(batch_urls)} 条结果")
+
+def test_score_batch_fallback():
+    """测试整批风险评分失败时逐个评分，只有出错的URL记为检测失败"""
+    print("\n=== 测试评分失败回退 ===")
+
+    calls = []
+
+    class FakeDetector:
+        def predict_risk_batch(self, features_list):
+            calls.append(len(features_list))
+            if any(features.get('bad') for features in features_list):
+                raise ValueError('无法评分的特征')
+            return [('HIGH', 90) if features.get('risky') else ('LOW', 10) for features in features_list]
+
+    detector = make_batch_detector(FakeDetector())
+    extracted = [
+        ('http://a.com', {'url': 'http://a.com', 'risky': 1}, None),
+        ('http://bad.com', {'url': 'http://bad.com', 'bad': 1}, None),
+        ('http://down.com', None, ConnectionError('down')),
+        ('http://c.com', {'url': 'http://c.com'}, None),
+    ]
+    results = detector._score_batch(extracted)
+    assert [r['风险等级'] for r in results] == ['高风险', '检测失败', '检测失败', '低风险']
+    assert '无法评分的特征' in results[1].error and 'down' in results[2].error
+    # 整批评分一次，失败后3个URL各评分一次
+    assert calls == [3, 1, 1, 1]
+    print(f"整批评分失败后逐个评分: {[r['风险等级'] for r in results]}")
+
 if __name__ == '__main__':
     print("违法网站检测器测试")
     print("=" * 50)
@@ -98,6 +910,26 @@ if __name__ == '__main__':
         test_single_detection()
         test_batch_detection()
         test_from_file()
+        test_keyword_matcher()
+        test_keyword_store()
+        test_blacklist_index()
+        test_brand_index()
+        test_rule_scorer()
+        test_feature_record()
+        test_result_sinks()
+        test_streaming_input()
+        test_batch_jobs()
+        test_parallel_detect_urls()
+        test_result_cache()
+        test_single_flight()
+        test_host_politeness()
+        test_host_feature_sharing()
+        test_metrics_registry()
+        test_span_tracer()
+        test_subpage_budget()
+        test_host_busy_requeue()
+        test_async_parity()
+        test_score_batch_fallback()
         
         print("\n" + "=" * 50)
         print("测试完成！")
@@ -7,8 +7,13 @@
 
 import json
 import logging
-from flask import Flask, request, jsonify
-from batch_website_detector import WebsiteDetector, BatchDetector, save_result_to_database, save_results_to_database
+from flask import Flask, Response, g, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from batch_website_detector import (
+    CONFIG, WebsiteDetector, BatchDetector, BatchJobStore, BatchJobRunner, get_job_db_path,
+    METRICS, SingleFlight, get_result_cache, normalize_url,
+    save_result_to_database, save_results_to_database
+)
 import time
 import datetime
 
@@ -21,7 +26,63 @@ logger = logging.getLogger(__name__)
 
 # 初始化检测器
 website_detector = WebsiteDetector()
-batch_detector = BatchDetector()
+batch_detector = BatchDetector(detector=website_detector)
+
+# 所有批量检测请求共享的检测线程池，单个请求同时占用的线程数不超过api_request_concurrency
+detect_executor = ThreadPoolExecutor(max_workers=CONFIG.get('api_workers', 32), thread_name_prefix='api-detect')
+API_REQUEST_CONCURRENCY = CONFIG.get('api_request_concurrency', 8)
+
+# 单个网站检测结果缓存（LRU + TTL）与进行中检测的合并
+result_cache = get_result_cache()
+detect_flight = SingleFlight()
+
+# 后台批量检测任务（任务状态保存在SQLite中，服务重启后继续执行未完成的任务）
+job_store = BatchJobStore(get_job_db_path())
+job_runner = BatchJobRunner(job_store, BatchDetector(keep_results=False, detector=website_detector))
+job_runner.start()
+
+# 任务结果每页最大条数
+MAX_JOB_PAGE_SIZE = 500
+
+# API指标：各接口请求数与耗时，以及共享线程池、请求合并与后台任务的状态
+METRICS.describe('detector_http_requests_total', 'counter', 'API请求次数')
+METRICS.describe('detector_http_request_seconds', 'histogram', 'API请求耗时（秒）')
+METRICS.register('detector_executor_queue_depth', 'gauge', '线程池中等待执行的任务数',
+                 lambda: [({'executor': 'api_detect'}, detect_executor._work_queue.qsize())])
+METRICS.register('detector_singleflight_calls_total', 'counter', '合并并发调用后实际执行的次数',
+                 lambda: [({'flight': 'api_detect'}, detect_flight.stats()['calls'])])
+METRICS.register('detector_singleflight_shared_total', 'counter', '等待并共享其他调用结果的次数',
+                 lambda: [({'flight': 'api_detect'}, detect_flight.stats()['shared'])])
+METRICS.register('detector_jobs', 'gauge', '各状态的批量检测任务数',
+                 lambda: [({'status': status}, count) for status, count in job_store.status_counts().items()])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # 以路由模板作为接口标签（如 /api/jobs/<job_id>），避免任务ID等路径参数产生过多标签
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.inc('detector_http_requests_total', {
+        'endpoint': endpoint, 'method': request.method, 'status': response.status_code
+    })
+    if 'request_start' in g:
+        METRICS.observe('detector_http_request_seconds', time.perf_counter() - g.request_start, {'endpoint': endpoint})
+    return response
+
+def detect_and_cache(url, cache_key):
+    """检测单个网站并写入结果缓存"""
+    # 提取特征
+    features = website_detector.extract_all_features(url)
+    
+    # 预测风险
+    risk_level, risk_score = website_detector.predict_risk(features)
+    
+    # 构建检测结果（特征以紧凑记录保存，中文视图在序列化时生成）
+    full_result = batch_detector._make_result(url, features, risk_level, risk_score)
+    result_cache.put(cache_key, full_result)
+    return full_result
 
 @app.route('/api/detect', methods=['POST'])
 def detect_website():
@@ -30,7 +91,8 @@ def detect_website():
     请求示例:
     {
         "url": "https://example.com",
-        "save_to_db": true  # 可选参数，默认为true
+        "save_to_db": true,  # 可选参数，默认为true
+        "force_refresh": false  # 可选参数，为true时忽略缓存重新检测
     }
     
     返回示例:
@@ -44,7 +106,8 @@ def detect_website():
             "risk_description": "...",
             "detection_time": "2023-07-01 12:00:00",
             "features": {},
-            "saved_to_db": true
+            "saved_to_db": true,
+            "cache": {"hit": true, "shared": false, "cached_at": "2023-07-01 12:00:00", "age_seconds": 12.3}
         }
     }
     """
@@ -65,39 +128,19 @@ def detect_website():
         if not url.startswith(('http://', 'https://')):
             url = 'http://' + url
         
-        # 提取特征
-        features = website_detector.extract_all_features(url)
-        
-        # 预测风险
-        risk_level, risk_score = website_detector.predict_risk(features)
-        
-        # 风险等级中文映射
-        risk_level_cn = {
-            'HIGH': '高风险',
-            'MEDIUM': '中风险', 
-            'LOW': '低风险',
-            'ERROR': '检测失败'
-        }.get(risk_level, risk_level)
-        
-        # 生成中文风险描述
-        risk_description = batch_detector._generate_risk_description(features, risk_level, risk_score)
-        
-        # 构建完整的结果对象，用于数据库存储
-        full_result = {
-            '网址': url,
-            '风险等级': risk_level_cn,
-            '风险评分': f"{risk_score}%",
-            '风险描述': risk_description,
-            '检测时间': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            '详细特征': batch_detector._translate_features(features),
-            '英文原文': {
-                'url': url,
-                'risk_level': risk_level,
-                'risk_score': risk_score,
-                'features': features,
-                'timestamp': datetime.datetime.now().isoformat()
-            }
-        }
+        # 相同网址（按规范化URL）在缓存有效期内直接返回缓存的检测结果
+        cache_key = normalize_url(url)
+        force_refresh = bool(data.get('force_refresh', False))
+        cached = None if force_refresh else result_cache.get(cache_key)
+        shared = False
+        if cached is not None:
+            full_result, cached_at = cached
+            logger.info(f"命中检测结果缓存: {url}")
+        else:
+            # 同一规范化URL的并发请求只检测一次，其余请求等待并共享结果
+            full_result, shared = detect_flight.do(cache_key, detect_and_cache, url, cache_key)
+            cached_at = None
+        risk_level_cn = full_result['风险等级']
         
         # 保存结果到数据库
         saved_to_db = False
@@ -117,11 +160,17 @@ def detect_website():
             'data': {
                 'url': url,
                 'risk_level': risk_level_cn,
-                'risk_score': f"{risk_score}%",
-                'risk_description': risk_description,
-                'detection_time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'features': batch_detector._translate_features(features),
-                'saved_to_db': saved_to_db
+                'risk_score': full_result['风险评分'],
+                'risk_description': full_result['风险描述'],
+                'detection_time': full_result['检测时间'],
+                'features': full_result['详细特征'],
+                'saved_to_db': saved_to_db,
+                'cache': {
+                    'hit': cached_at is not None,
+                    'shared': shared,
+                    'cached_at': datetime.datetime.fromtimestamp(cached_at).strftime('%Y-%m-%d %H:%M:%S') if cached_at else None,
+                    'age_seconds': round(time.time() - cached_at, 1) if cached_at else 0
+                }
             }
         }
         
@@ -180,15 +229,20 @@ def batch_detect_websites():
         results = []
         full_results_for_db = []  # 用于数据库存储的完整结果列表
         
-        for url in urls:
+        # 标准化URL
+        urls_to_detect = [
+            'http://' + url if url and not url.startswith(('http://', 'https://')) else url
+            for url in urls
+        ]
+        # 在共享线程池中并发提取特征后整批预测风险（模型只调用一次），结果顺序与请求一致
+        detected_results = batch_detector.detect_urls(
+            urls_to_detect, executor=detect_executor, max_concurrency=API_REQUEST_CONCURRENCY
+        )
+        
+        for url, result in zip(urls_to_detect, detected_results):
             try:
-                # 标准化URL
-                if url and not url.startswith(('http://', 'https://')):
-                    url = 'http://' + url
-                
-                # 使用detect_single方法检测单个网站
-                result = batch_detector.detect_single(url)
                 full_results_for_db.append(result)  # 保存完整结果用于数据库
+                translated_features = result.get('详细特征', {})
                 
                 # 构建返回结果，包含更多详细信息
                 simplified_result = {
@@ -197,13 +251,13 @@ def batch_detect_websites():
                     'risk_score': result['风险评分'],
                     'risk_description': result['风险描述'],
                     'detection_time': result['检测时间'],
-                    'features': result.get('详细特征', {}),  # 包含详细特征信息
+                    'features': translated_features,  # 包含详细特征信息
                     'saved_to_db': save_to_db,  # 默认标记为已保存
                     '英文原文': {
                         'url': url,
                         'risk_level': result['风险等级'],
                         'risk_score': result['风险评分'],
-                        'features': result.get('详细特征', {}),
+                        'features': translated_features,
                         'timestamp': datetime.datetime.now().isoformat()
                     }
                 }
@@ -254,13 +308,147 @@ def batch_detect_websites():
             'message': f'批量检测失败: {str(e)}'
         })
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_batch_job():
+    """
+    提交批量检测任务，立即返回任务ID，检测在后台执行
+    请求示例:
+    {
+        "urls": ["https://example1.com", "https://example2.com"],
+        "save_to_db": true  # 可选参数，默认为true
+    }
+    
+    返回示例:
+    {
+        "code": 200,
+        "message": "success",
+        "data": {"job_id": "...", "status": "queued", "total": 2}
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data or 'urls' not in data or not isinstance(data['urls'], list):
+            return jsonify({
+                'code': 400,
+                'message': '缺少必要参数: urls (列表格式)'
+            })
+        
+        urls = [url.strip() for url in data['urls'] if isinstance(url, str) and url.strip()]
+        if not urls:
+            return jsonify({
+                'code': 400,
+                'message': 'urls中没有有效的网址'
+            })
+        save_to_db = data.get('save_to_db', True)
+        
+        job_id = job_runner.submit(urls, save_to_db)
+        logger.info(f"已创建批量检测任务 {job_id}，共{len(urls)}个网站，保存到数据库: {save_to_db}")
+        return jsonify({
+            'code': 200,
+            'message': 'success',
+            'data': {
+                'job_id': job_id,
+                'status': BatchJobStore.QUEUED,
+                'total': len(urls)
+            }
+        })
+    except Exception as e:
+        logger.error(f"创建批量检测任务失败: {str(e)}")
+        return jsonify({
+            'code': 500,
+            'message': f'创建批量检测任务失败: {str(e)}'
+        })
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """
+    查询批量检测任务的状态与进度
+    返回示例:
+    {
+        "code": 200,
+        "message": "success",
+        "data": {
+            "job_id": "...",
+            "status": "running",  # queued / running / done / failed
+            "total": 500,
+            "completed": 120,
+            "progress": "24.0%",
+            "risk_counts": {"高风险": 3, "低风险": 117},
+            ...
+        }
+    }
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({
+            'code': 404,
+            'message': f'任务不存在: {job_id}'
+        })
+    job['progress'] = f"{job['completed'] / job['total'] * 100:.1f}%" if job['total'] else '100.0%'
+    return jsonify({
+        'code': 200,
+        'message': 'success',
+        'data': job
+    })
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def get_batch_job_results(job_id):
+    """
+    分页查询批量检测任务已完成的结果（按提交顺序）
+    请求参数: page（从1开始，默认1）、page_size（默认100，最大500）
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({
+            'code': 404,
+            'message': f'任务不存在: {job_id}'
+        })
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 100)), 1), MAX_JOB_PAGE_SIZE)
+    except ValueError:
+        return jsonify({
+            'code': 400,
+            'message': 'page与page_size必须为整数'
+        })
+    
+    results = [
+        {
+            'url': result.get('网址'),
+            'risk_level': result.get('风险等级'),
+            'risk_score': result.get('风险评分'),
+            'risk_description': result.get('风险描述'),
+            'detection_time': result.get('检测时间'),
+            'features': result.get('详细特征', {})
+        }
+        for result in job_store.results(job_id, (page - 1) * page_size, page_size)
+    ]
+    return jsonify({
+        'code': 200,
+        'message': 'success',
+        'data': results,
+        'pagination': {
+            'page': page,
+            'page_size': page_size,
+            'completed': job['completed'],
+            'total': job['total'],
+            'status': job['status']
+        }
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus文本格式的指标：请求数与耗时、检测各阶段耗时与出错次数、线程池队列与缓存命中"""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """\API健康检查接口"""
     return jsonify({
         'code': 200,
         'message': 'API服务运行正常',
-        'timestamp': time.time()
+        'timestamp': time.time(),
+        'result_cache': result_cache.stats()
     })
 
 if __name__ == '__main__':
@@ -278,7 +466,9 @@ if __name__ == '__main__':
     print(f"📡 API服务运行在: http://localhost:{api_port}")
     print(f"🔍 检测单个网站: POST http://localhost:{api_port}/api/detect")
     print(f"📋 批量检测网站: POST http://localhost:{api_port}/api/batch_detect")
+    print(f"🗂️ 提交批量检测任务: POST http://localhost:{api_port}/api/jobs")
     print(f"❤️ 健康检查: GET http://localhost:{api_port}/api/health")
+    print(f"📊 监控指标: GET http://localhost:{api_port}/api/metrics")
     
     # 注意：在生产环境中，应该将debug设置为False，并使用WSGI服务器
     app.run(host='0.0.0.0', port=api_port, debug=False)
\ No newline at end of file